@@ -0,0 +1,328 @@
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+from anomaly_detector import AnomalyDetector, Autoencoder
+from backpressure import BoundedQueue, Stage, deliver
+from event_index import EventIndex, EventLogger
+from metrics import REGISTRY, get_logger
+from multichannel import METRICS_INTERVAL, LocalChannel, MultiChannelIngest, load_config
+from positioning import open_position
+from preprocessing import FeaturePipeline
+from recorder import Recorder
+from rollups import TIERS
+from sample_bus import (DEFAULT_PREFIX, RollupBus, SampleBus, SharedState, bus_name, rollup_name,
+                        state_name, unlink_shared, writer_alive)
+from serial_ingest import SerialIngest
+from sources import open_source
+
+
+# Acquisition daemon: owns the serial port(s), parses, records and scores
+# every sample, and publishes to shared memory (see sample_bus) for any
+# number of read-only dashboard processes. Run it on its own with
+#   python acquisition.py
+# and then start one or more dashboards, e.g. gunicorn -w 4 gps_simulation:server
+
+# Set up serial communication
+arduino_port = 'COM6'  # Replace with your Arduino COM port
+baud_rate = 9600  # Must match the Arduino sketch; ingest keeps up at 115200
+
+# Where samples come from; see sources.open_source. For example
+#   TEJAS_SOURCE=replay:capture.bin@10x   replay a recorded run at 10x speed
+#   TEJAS_SOURCE=synthetic:5000@max       generated data with crack signatures
+# TEJAS_CAPTURE=file.bin records everything read from the serial port.
+SOURCE_SPEC = os.environ.get('TEJAS_SOURCE', f'serial:{arduino_port}@{baud_rate}')
+
+# Several sensors: TEJAS_CHANNELS=channels.json declares one source per
+# channel (see multichannel), each running in its own worker process
+CHANNELS_CONFIG = os.environ.get('TEJAS_CHANNELS')
+
+# Shared-memory name prefix, so several daemons can run side by side
+BUS_PREFIX = os.environ.get('TEJAS_BUS', DEFAULT_PREFIX)
+
+# Samples kept in shared memory per channel for the dashboards
+BUFFER_CAPACITY = 100000
+
+# Every sample is also appended to disk; see recorder for the layout and
+# recorder.query for reading a time range back
+RECORD_DIR = os.environ.get('TEJAS_RECORD_DIR', 'recordings')
+RECORD_MAX_AGE = 7 * 24 * 3600  # Keep a week of recordings
+
+# ADC sample rate of the sensor (TEJAS_SAMPLE_RATE; a synthetic source runs
+# at its own) and the band kept by the denoising filter
+SAMPLE_RATE = int(os.environ.get('TEJAS_SAMPLE_RATE', 5000))
+BANDPASS = (20, 2000)
+
+# Every detected anomaly is stored with its position in an indexed event
+# database; see event_index for queries. TEJAS_POSITION says where positions
+# come from (see positioning.open_position), e.g. 'nmea:/dev/ttyUSB0@9600'
+# for a GPS receiver, 'fixed:19.07,72.88' or 'odometry:19.07,72.88@45,20,
+# main-line'. By default events are stored without a position.
+EVENTS_DB = os.environ.get('TEJAS_EVENTS_DB', 'events.sqlite')
+POSITION_SPEC = os.environ.get('TEJAS_POSITION', 'none')
+
+# Alerts for track managers are POSTed as JSON to TEJAS_NOTIFY_URL (see
+# notifier); alerts that cannot be delivered wait in ALERT_SPOOL
+NOTIFY_URL = os.environ.get('TEJAS_NOTIFY_URL')
+ALERT_SPOOL = 'alerts'
+
+# The recorder and the detector are each handed every sample through their
+# own queue holding this many seconds, so a slow disk or a backlog of
+# windows does not hold up ingest (see backpressure)
+QUEUE_SECONDS = 60
+
+# Central node for edge nodes on trains (see edge): TEJAS_EDGE_LISTEN=host:port
+# receives the channels named in TEJAS_EDGE_CHANNELS (comma-separated)
+# instead of reading a sensor. Candidate windows are only scored with a
+# trained model file.
+EDGE_LISTEN = os.environ.get('TEJAS_EDGE_LISTEN')
+EDGE_CHANNELS = os.environ.get('TEJAS_EDGE_CHANNELS', 'default')
+
+# Without a trained model file the detector calibrates on the first few
+# thousand windows
+AUTOENCODER_MODEL = 'autoencoder.npz'
+
+log = get_logger('acquisition')
+
+
+def start_local_channel(samples, rollups, positions=None, notifier=None):
+    # A single sensor, ingested and scored by threads in this process
+    source = open_source(SOURCE_SPEC, record_to=os.environ.get('TEJAS_CAPTURE'))
+    rate = getattr(source, 'sample_rate', None) or SAMPLE_RATE
+    recorder = Recorder(RECORD_DIR, max_age=RECORD_MAX_AGE)
+    logger = EventLogger(EventIndex(EVENTS_DB), positions, 'default', recorder.run,
+                         notify=notifier.submit if notifier is not None else None)
+
+    # Neither queue ever drops a sample: if the recorder or the detector
+    # falls a whole queue behind, ingest waits for it. The ring the
+    # dashboards read never waits; its oldest samples are overwritten.
+    queues = {name: BoundedQueue(name, QUEUE_SECONDS * rate, channel='default')
+              for name in ('recorder', 'detector')}
+    writer = Stage('recorder', queues['recorder'], lambda batch: recorder.extend(*batch))
+
+    def store_samples(timestamp, adc, amplitude, frequency, status):
+        # Called from the ingest thread with every parsed batch. Rollups
+        # first, so the detector never scores a window whose bucket is not
+        # there yet to count an anomaly in.
+        rollups.extend(timestamp, adc, amplitude, frequency, status)
+        samples.extend(timestamp, adc, amplitude, frequency, status)
+        deliver(queues['detector'], (timestamp, adc), len(status))
+        deliver(queues['recorder'], (timestamp, adc, amplitude, frequency, status), len(status))
+
+    def on_anomaly(anomalies, threshold, features):
+        rollups.mark([anomaly.time for anomaly in anomalies])
+        logger(anomalies, threshold, features)
+
+    # Start the serial ingest thread; it owns the source and drains every line
+    ingest = SerialIngest(source, store_samples, channel='default', sample_rate=rate).open()
+    writer.start()
+    ingest.start()
+
+    # Score sliding windows of the denoised ADC stream off the callback thread
+    try:
+        model = Autoencoder.load(AUTOENCODER_MODEL)
+    except FileNotFoundError:
+        model = None
+    detector = AnomalyDetector(samples, model, pipeline=FeaturePipeline(rate, BANDPASS),
+                               on_anomaly=on_anomaly, channel='default', inbox=queues['detector'])
+    detector.start()
+    return LocalChannel('default', samples, ingest, detector, recorder, positions, rollups, queues, [writer],
+                        rate)
+
+
+def claim_state(prefix):
+    # Create the state block, taking over one left behind by a daemon that
+    # died. Raises FileExistsError while another daemon is publishing.
+    try:
+        return SharedState(state_name(prefix), create=True)
+    except FileExistsError:
+        stale = SharedState(state_name(prefix))
+        if stale.read() is None:
+            # Possibly just created by a daemon that has not published yet
+            time.sleep(0.5)
+        alive = writer_alive(stale)
+        stale.close()
+        if alive:
+            raise
+        unlink_shared(state_name(prefix))
+        return SharedState(state_name(prefix), create=True)
+
+
+def create_bus(name, capacity):
+    # Only called while holding the state block, so an existing ring was
+    # left behind by a daemon that died
+    try:
+        return SampleBus(name, capacity, create=True)
+    except FileExistsError:
+        unlink_shared(name)
+        return SampleBus(name, capacity, create=True)
+
+
+def create_rollups(name, tiers=TIERS):
+    # Like create_bus, for the channel's rollup tiers
+    try:
+        return RollupBus(name, tiers, create=True)
+    except FileExistsError:
+        unlink_shared(name)
+        return RollupBus(name, tiers, create=True)
+
+
+class Acquisition:
+    # Starts every channel on a SampleBus and publishes the rest of the
+    # channel state (detector output, ingest counters) every publish_interval
+
+    def __init__(self, prefix=BUS_PREFIX, publish_interval=0.1):
+        self.prefix = prefix
+        self.publish_interval = publish_interval
+        self.state = None
+        self.buses = {}
+        self.rollups = {}
+        self.channels = {}
+        self.positions = None
+        self.notifier = None
+        self._metrics = []
+        self._next_metrics = 0
+        self._multichannel = None
+        self._central = None
+        self._stop_event = threading.Event()
+        self._publisher = threading.Thread(target=self._publish_loop, name='state-publisher', daemon=True)
+
+    def start(self):
+        self.state = claim_state(self.prefix)
+        self.state.write({'pid': os.getpid(), 'time': time.time(), 'order': [], 'channels': {}})
+        self.positions = open_position(POSITION_SPEC)
+        configs = load_config(CHANNELS_CONFIG) if CHANNELS_CONFIG else None
+        for channel in configs or []:
+            channel['events_db'] = channel['events_db'] or EVENTS_DB
+            channel['position'] = channel['position'] or POSITION_SPEC
+            channel['notify_url'] = channel['notify_url'] or NOTIFY_URL
+        central = EDGE_LISTEN and not configs
+        if configs:
+            capacities = {channel['name']: channel['buffer_capacity'] for channel in configs}
+        elif central:
+            capacities = dict.fromkeys(EDGE_CHANNELS.split(','), BUFFER_CAPACITY)
+        else:
+            capacities = {'default': BUFFER_CAPACITY}
+        tiers = TIERS
+        if central:
+            # Imported only for a central node; it pulls in requests
+            from edge import CENTRAL_TIERS
+            tiers = CENTRAL_TIERS
+        self.buses = {name: create_bus(bus_name(self.prefix, index), capacity)
+                      for index, (name, capacity) in enumerate(capacities.items())}
+        self.rollups = {name: create_rollups(rollup_name(self.prefix, index), tiers)
+                        for index, name in enumerate(capacities)}
+        if configs:
+            self._multichannel = MultiChannelIngest(configs, buffers=self.buses, positions=self.positions,
+                                                    rollups=self.rollups).start()
+            self.channels = self._multichannel.channels
+        else:
+            if NOTIFY_URL:
+                # Imported only when alerting is configured; it pulls in requests
+                from notifier import Notifier
+                self.notifier = Notifier(NOTIFY_URL, ALERT_SPOOL).start()
+            if central:
+                self.channels = self._start_central(list(capacities))
+            else:
+                self.channels = {'default': start_local_channel(self.buses['default'], self.rollups['default'],
+                                                                self.positions, self.notifier)}
+        self.publish()
+        self._publisher.start()
+        return self
+
+    def _start_central(self, names):
+        # Channels fed by edge nodes, see edge.CentralReceiver
+        from edge import CentralReceiver
+        model = Autoencoder.load(AUTOENCODER_MODEL) if os.path.exists(AUTOENCODER_MODEL) else None
+        if model is None:
+            log.warning("No %s: edge windows are stored but not scored", AUTOENCODER_MODEL)
+        self._central = CentralReceiver(names, model, self.buses, self.rollups, EventIndex(EVENTS_DB),
+                                        RECORD_DIR, SAMPLE_RATE, BANDPASS,
+                                        notify=self.notifier.submit if self.notifier is not None else None)
+        host, _, port = EDGE_LISTEN.rpartition(':')
+        return self._central.listen(host or '0.0.0.0', int(port)).channels
+
+    def publish(self):
+        channels = {}
+        for name, channel in self.channels.items():
+            latest = channel.latest
+            position = channel.position
+            channels[name] = {
+                'latest': list(latest) if latest else None,
+                'features': channel.latest_features,
+                'threshold': channel.threshold,
+                'stats': channel.stats(),
+                'alive': channel.is_alive(),
+                'position': list(position) if position else None,
+                'sample_rate': channel.sample_rate,
+            }
+        now = time.monotonic()
+        if now >= self._next_metrics:
+            self._next_metrics = now + METRICS_INTERVAL
+            self._metrics = self.metrics()
+        self.state.write({'pid': os.getpid(), 'time': time.time(), 'order': list(self.buses),
+                          'channels': channels, 'metrics': self._metrics})
+
+    def metrics(self):
+        # Snapshots of this process's metrics and those of channel workers
+        snapshots = REGISTRY.snapshot()
+        for channel in self.channels.values():
+            snapshots.extend(getattr(channel, 'metrics', []))
+        return snapshots
+
+    def _publish_loop(self):
+        while not self._stop_event.wait(self.publish_interval):
+            self.publish()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._publisher.is_alive():
+            self._publisher.join()
+        if self._multichannel is not None:
+            self._multichannel.stop()
+        if self._central is not None:
+            self._central.stop()
+        for channel in self.channels.values():
+            if isinstance(channel, LocalChannel):
+                channel.stop()
+        if self.notifier is not None:
+            self.notifier.stop()
+        for bus in self.buses.values():
+            bus.close()
+        for rollups in self.rollups.values():
+            rollups.close()
+        if self.state is not None:
+            self.state.close()
+        if self.positions is not None:
+            self.positions.close()
+
+
+def serve(prefix=BUS_PREFIX):
+    # Acquire and publish until Ctrl-C or SIGTERM
+    acquisition = Acquisition(prefix).start()
+    # Exit cleanly on SIGTERM as well as Ctrl-C, so the shared memory is removed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    log.info("Publishing %s on %s", ', '.join(acquisition.channels), prefix)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        acquisition.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Acquire sensor data and publish it to shared memory')
+    parser.add_argument('--prefix', default=BUS_PREFIX, help='shared-memory name prefix')
+    args = parser.parse_args()
+    serve(args.prefix)
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,269 @@
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+from metrics import REGISTRY, get_logger, sample
+from preprocessing import extract_features, sliding_windows
+
+
+log = get_logger('detector')
+
+# Result of scoring one window of ADC samples; time is the window's last sample
+WindowScore = namedtuple('WindowScore', ('time', 'score', 'anomaly'))
+
+
+class Autoencoder:
+    # Dense autoencoder evaluated with NumPy on the CPU. Windows are
+    # normalised with the training mean window and a global scale, pushed
+    # through the layers (tanh on hidden layers unless activation='linear')
+    # and scored by mean squared reconstruction error.
+
+    def __init__(self, weights, biases, mean, scale, threshold, activation='tanh'):
+        self.weights = [np.asarray(w, dtype=np.float64) for w in weights]
+        self.biases = [np.asarray(b, dtype=np.float64) for b in biases]
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = float(scale)
+        self.threshold = float(threshold)
+        self.activation = activation
+
+    @property
+    def window(self):
+        return self.weights[0].shape[0]
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            layers = sum(1 for key in data.files if key.startswith('W'))
+            return cls(
+                [data[f'W{i}'] for i in range(layers)],
+                [data[f'b{i}'] for i in range(layers)],
+                data['mean'],
+                data['scale'],
+                data['threshold'],
+                str(data['activation']),
+            )
+
+    def save(self, path):
+        arrays = {f'W{i}': w for i, w in enumerate(self.weights)}
+        arrays.update({f'b{i}': b for i, b in enumerate(self.biases)})
+        np.savez(path, mean=self.mean, scale=self.scale, threshold=self.threshold,
+                 activation=self.activation, **arrays)
+
+    @classmethod
+    def fit_linear(cls, windows, hidden=8, quantile=0.995, margin=1.5):
+        # Closed-form linear autoencoder (the PCA subspace) fitted on windows
+        # of healthy track. The threshold is a margin over the given quantile
+        # of the training scores.
+        windows = windows[np.isfinite(windows).all(axis=1)]
+        mean = windows.mean(axis=0)
+        scale = (windows - mean).std() or 1.0
+        x = (windows - mean) / scale
+        _, _, vt = np.linalg.svd(x, full_matrices=False)
+        basis = vt[:hidden]
+        model = cls([basis.T, basis], [np.zeros(len(basis)), np.zeros(windows.shape[1])],
+                    mean, scale, np.inf, activation='linear')
+        model.threshold = float(np.quantile(model.score(windows), quantile) * margin)
+        return model
+
+    def reconstruct(self, x):
+        last = len(self.weights) - 1
+        for i, (w, b) in enumerate(zip(self.weights, self.biases)):
+            x = x @ w + b
+            if i < last and self.activation == 'tanh':
+                x = np.tanh(x)
+        return x
+
+    def score(self, windows, batch_size=4096):
+        # Reconstruction error per window; windows with missing samples score NaN
+        scores = np.empty(len(windows))
+        for start in range(0, len(windows), batch_size):
+            x = (windows[start:start + batch_size] - self.mean) / self.scale
+            scores[start:start + batch_size] = np.mean((x - self.reconstruct(x)) ** 2, axis=1)
+        return scores
+
+
+def score_windows(model, windows, ends, pipeline=None, with_features=True):
+    # Score windows ending at times `ends` against the model's threshold.
+    # Returns the scores, the flags, the flagged windows as WindowScores and,
+    # with a pipeline, their features ({name: array}, None otherwise). Used
+    # by the live detector and by offline re-analysis (see reanalyze).
+    scores = model.score(windows)
+    flags = scores > model.threshold
+    anomalies = [WindowScore(t, score, True) for t, score in zip(ends[flags].tolist(), scores[flags].tolist())]
+    features = None
+    if anomalies and pipeline is not None and with_features:
+        features = extract_features(windows[flags], pipeline.sample_rate, pipeline.bands)
+    return scores, flags, anomalies, features
+
+
+class AnomalyDetector(threading.Thread):
+    # Scores sliding windows of the ADC column of a SampleBuffer off the Dash
+    # callback thread. Without a model it calibrates a linear autoencoder on
+    # the first calibration_windows windows, assuming healthy track. With a
+    # preprocessing.FeaturePipeline the stream is band-pass filtered before
+    # windowing and the features of the newest window are published.
+    # The model scores the filtered waveform, not the feature vectors: a
+    # 64-sample window every 16 samples places a crack's short transient to
+    # within 3 ms at 5 kHz, the feature windows (256 samples every 128) only
+    # to within 26 ms, and the central node re-scores edge windows the same
+    # way (see edge). Features describe flagged windows in event records,
+    # alerts and the side panel.
+    # on_anomaly(anomalies, threshold, features) is called from the detector
+    # thread with the WindowScores flagged in each batch and, with a
+    # pipeline, their features ({name: array}, one value per anomaly).
+    #
+    # Reading the buffer skips whatever was overwritten while the detector
+    # was behind. With an inbox (a backpressure.BoundedQueue of (time, adc)
+    # batches that never drops) every sample is scored however far behind
+    # it falls. Each pass then takes at most max_batch samples, and the next
+    # follows without waiting while more are queued; while the inbox is in
+    # sustained overload the features of the newest window are only
+    # refreshed every degraded_interval seconds.
+
+    def __init__(self, samples, model=None, window=64, step=16, calibration_windows=2000,
+                 history=10000, poll_interval=0.05, pipeline=None, on_anomaly=None, channel='default',
+                 inbox=None, max_batch=50000, degraded_interval=1.0):
+        super().__init__(name='anomaly-detector', daemon=True)
+        self.samples = samples
+        self.model = model
+        self.pipeline = pipeline
+        self.on_anomaly = on_anomaly
+        self.inbox = inbox
+        self.max_batch = max_batch
+        self.degraded_interval = degraded_interval
+        self.window = model.window if model is not None else window
+        self.step = step
+        self.calibration_windows = calibration_windows
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+        self._cursor = samples.count
+        self._adc = np.empty(0)
+        self._time = np.empty(0)
+        self._calibration = []
+
+        # scores and windows_scored change together under lock; see scores_since
+        self.lock = threading.Lock()
+        self.scores = deque(maxlen=history)
+        self.latest = None
+        self.latest_features = None
+        self.windows_scored = 0
+        self.anomalies = 0
+        self.degraded = False
+        self._next_features = 0
+
+        self.channel = channel
+        self._detect_seconds = REGISTRY.histogram(
+            'tejas_detect_seconds', 'Time to filter and score one batch of windows', channel=channel)
+        REGISTRY.add_collector(self._collect)
+
+    @property
+    def calibrating(self):
+        return self.model is None
+
+    @property
+    def behind(self):
+        # Samples are waiting in the inbox
+        return self.inbox is not None and len(self.inbox) > 0
+
+    def stop(self):
+        self._stop_event.set()
+        REGISTRY.remove_collector(self._collect)
+
+    def run(self):
+        while not self._stop_event.wait(0 if self.behind else self.poll_interval):
+            start = time.perf_counter()
+            if self.process():
+                self._detect_seconds.observe(time.perf_counter() - start)
+
+    def process(self):
+        # Score every complete window that arrived since the last call
+        times, adc = self._take()
+        if not len(adc):
+            return 0
+        adc = adc if self.pipeline is None else self.pipeline.filter.process(adc)
+        self._adc = np.concatenate((self._adc, adc))
+        self._time = np.concatenate((self._time, times))
+
+        windows = sliding_windows(self._adc, self.window, self.step)
+        if not len(windows):
+            return 0
+        ends = self._time[self.window - 1::self.step][:len(windows)]
+        consumed = len(windows) * self.step
+        self._adc = self._adc[consumed:]
+        self._time = self._time[consumed:]
+
+        if self.model is None:
+            self._calibrate(windows)
+            return 0
+
+        scores, flags, anomalies, features = score_windows(self.model, windows, ends, self.pipeline,
+                                                           self.on_anomaly is not None)
+        with self.lock:
+            self.scores.extend(map(WindowScore, ends.tolist(), scores.tolist(), flags.tolist()))
+            self.latest = self.scores[-1]
+            self.windows_scored += len(scores)
+        self._degrade(self.inbox is not None and self.inbox.overloaded)
+        now = time.monotonic()
+        if self.pipeline is not None and (not self.degraded or now >= self._next_features):
+            self._next_features = now + self.degraded_interval
+            latest = extract_features(windows[-1:], self.pipeline.sample_rate, self.pipeline.bands)
+            self.latest_features = {name: float(value[0]) for name, value in latest.items()}
+        self.anomalies += len(anomalies)
+        if anomalies and self.on_anomaly is not None:
+            self.on_anomaly(anomalies, self.model.threshold, features)
+        return len(scores)
+
+    def scores_since(self, count):
+        # The WindowScores after the first `count` windows scored, as far as
+        # the history still holds them, and the count to pass next time
+        with self.lock:
+            fresh = min(self.windows_scored - count, len(self.scores))
+            scores = list(self.scores)[len(self.scores) - fresh:] if fresh > 0 else []
+            return scores, self.windows_scored
+
+    def _take(self):
+        # (time, adc) of the samples that arrived since the last call
+        if self.inbox is None:
+            new, self._cursor = self.samples.since(self._cursor)
+            return new.time, new.adc
+        try:
+            batches = self.inbox.get_all(timeout=0, max_size=self.max_batch)
+        except queue.Empty:
+            return self._time[:0], self._adc[:0]
+        times = [np.broadcast_to(np.asarray(t, dtype=np.float64), len(adc)) for t, adc in batches]
+        return np.concatenate(times), np.concatenate([adc for _, adc in batches])
+
+    def _degrade(self, degraded):
+        if degraded != self.degraded:
+            if degraded:
+                log.warning("%s: detector falling behind, refreshing features every %.1f s",
+                            self.channel, self.degraded_interval)
+            else:
+                log.info("%s: detector caught up", self.channel)
+            self.degraded = degraded
+
+    def _calibrate(self, windows):
+        self._calibration.append(windows.copy())
+        if sum(map(len, self._calibration)) >= self.calibration_windows:
+            self.model = Autoencoder.fit_linear(np.concatenate(self._calibration))
+            self._calibration = []
+
+    def _collect(self):
+        labels = {'channel': self.channel}
+        return [
+            sample('tejas_windows_scored_total', 'Windows scored by the detector', 'counter', labels,
+                   self.windows_scored),
+            sample('tejas_anomalies_total', 'Windows flagged as anomalous', 'counter', labels,
+                   self.anomalies),
+        ]
+
+    def stats(self):
+        return {
+            'windows_scored': self.windows_scored,
+            'anomalies': self.anomalies,
+            'threshold': self.model.threshold if self.model is not None else None,
+            'degraded': self.degraded,
+        }
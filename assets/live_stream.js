@@ -0,0 +1,250 @@
+// Live chart updates pushed by the /stream route of gps_simulation.py.
+// Sample batches are queued as they arrive and drawn at most once per
+// animation frame, so a burst of events costs one Plotly redraw. Each
+// batch replaces the points of the bucket the previous one left open.
+// Zooming or panning either chart stops following the live data and loads
+// the range from /history for both; double-click goes back to live.
+// Spectrogram columns arrive as PNG strips, scrolled into each channel's
+// canvas from the right.
+(function () {
+    var GRAPHS = ['frequency', 'amplitude'];
+    var source = null;
+    var current = null;
+    var config = {max_points: 2000, window: 15};
+    var pending = {frequency: [[], []], amplitude: [[], []]};
+    // Points to drop from the end of a drawn trace before the queued ones
+    // are appended, and how many at the end belong to the open bucket
+    var trim = {frequency: 0, amplitude: 0};
+    var tail = {frequency: 0, amplitude: 0};
+    var latestTime = null;
+    var values = {};
+    var frameRequested = false;
+    var following = true;
+    var historyRequest = 0;
+
+    function plot(id) {
+        var graph = document.getElementById(id);
+        return graph && graph.querySelector('.js-plotly-plot');
+    }
+
+    function axisTime(value) {
+        // The traces carry epoch seconds, which a date axis reads as
+        // milliseconds; its range comes back as UTC date strings
+        if (typeof value === 'number') {
+            return value;
+        }
+        var text = value.replace(' ', 'T');
+        return Date.parse(text.indexOf('T') < 0 ? text + 'T00:00Z' : text + 'Z');
+    }
+
+    function loadHistory(start, end) {
+        if (!current || !current.channel) {
+            return;
+        }
+        var request = ++historyRequest;
+        var url = '/history?channel=' + encodeURIComponent(current.channel) +
+            '&start=' + start + '&end=' + end;
+        fetch(url).then(function (response) {
+            return response.ok ? response.json() : null;
+        }).then(function (history) {
+            // A newer zoom may have been answered first
+            if (!history || request !== historyRequest || !window.Plotly) {
+                return;
+            }
+            var shapes = history.anomalies.map(function (anomaly) {
+                return {type: 'rect', xref: 'x', yref: 'paper', x0: anomaly[0], x1: anomaly[1], y0: 0, y1: 1,
+                        fillcolor: 'rgba(231, 76, 60, 0.25)', line: {width: 0}, layer: 'below'};
+            });
+            for (var i = 0; i < GRAPHS.length; i++) {
+                var gd = plot(GRAPHS[i] + '-graph');
+                if (gd) {
+                    var trace = history[GRAPHS[i]];
+                    trim[GRAPHS[i]] = 0;
+                    window.Plotly.update(gd, {x: [trace[0]], y: [trace[1]]},
+                                         {'xaxis.range': [history.start, history.end], shapes: shapes}, [0]);
+                }
+            }
+        });
+    }
+
+    function onRelayout(event) {
+        // Only user zooms and pans set range[0] and range[1]; the live
+        // updates below set xaxis.range as a whole
+        if ('xaxis.range[0]' in event && 'xaxis.range[1]' in event) {
+            following = false;
+            reset();
+            loadHistory(axisTime(event['xaxis.range[0]']), axisTime(event['xaxis.range[1]']));
+        } else if (event['xaxis.autorange'] && !following) {
+            following = true;
+            if (latestTime !== null) {
+                loadHistory(latestTime - config.window, latestTime);
+            }
+        }
+    }
+
+    function watchZoom() {
+        for (var i = 0; i < GRAPHS.length; i++) {
+            var gd = plot(GRAPHS[i] + '-graph');
+            if (gd && !gd.tejasZoom) {
+                gd.tejasZoom = true;
+                gd.on('plotly_relayout', onRelayout);
+            }
+        }
+    }
+
+    function reset() {
+        pending = {frequency: [[], []], amplitude: [[], []]};
+        trim = {frequency: 0, amplitude: 0};
+        tail = {frequency: 0, amplitude: 0};
+    }
+
+    function queue(name, batch, replace, open) {
+        if (!following) {
+            return;
+        }
+        var queued = pending[name];
+        // The open bucket's points, from the queue first, then the trace
+        var drop = Math.min(replace, tail[name]);
+        var queuedDrop = Math.min(drop, queued[0].length);
+        queued[0].length -= queuedDrop;
+        queued[1].length -= queuedDrop;
+        trim[name] += drop - queuedDrop;
+        tail[name] = open;
+        Array.prototype.push.apply(queued[0], batch[0]);
+        Array.prototype.push.apply(queued[1], batch[1]);
+        // A hidden tab gets no animation frames; keep only what fits on screen
+        var excess = queued[0].length - config.max_points;
+        if (excess > 0) {
+            queued[0].splice(0, excess);
+            queued[1].splice(0, excess);
+        }
+    }
+
+    function scheduleDraw() {
+        if (!frameRequested) {
+            frameRequested = true;
+            window.requestAnimationFrame(draw);
+        }
+    }
+
+    function draw() {
+        frameRequested = false;
+        watchZoom();
+        for (var i = 0; i < GRAPHS.length; i++) {
+            var gd = plot(GRAPHS[i] + '-graph');
+            var queued = pending[GRAPHS[i]];
+            if (!gd || !window.Plotly) {
+                continue;
+            }
+            if (trim[GRAPHS[i]]) {
+                var trace = gd.data[0];
+                var keep = Math.max(trace.x.length - trim[GRAPHS[i]], 0);
+                var x = Array.prototype.slice.call(trace.x, 0, keep).concat(queued[0]);
+                var y = Array.prototype.slice.call(trace.y, 0, keep).concat(queued[1]);
+                var excess = Math.max(x.length - config.max_points, 0);
+                window.Plotly.restyle(gd, {x: [x.slice(excess)], y: [y.slice(excess)]}, [0]);
+                trim[GRAPHS[i]] = 0;
+                pending[GRAPHS[i]] = [[], []];
+            } else if (queued[0].length) {
+                window.Plotly.extendTraces(gd, {x: [queued[0]], y: [queued[1]]}, [0], config.max_points);
+                pending[GRAPHS[i]] = [[], []];
+            }
+            if (following && latestTime !== null) {
+                window.Plotly.relayout(gd, {'xaxis.range': [latestTime - config.window, latestTime]});
+            }
+        }
+        for (var id in values) {
+            var element = document.getElementById(id);
+            if (element && values[id] !== null) {
+                element.textContent = values[id];
+            }
+        }
+        values = {};
+    }
+
+    function drawStrip(canvas, strip, reset) {
+        // Strips decode asynchronously; chain them so a canvas gets them in order
+        var image = new Image();
+        var loaded = new Promise(function (resolve) {
+            image.onload = resolve;
+            image.onerror = resolve;
+        });
+        image.src = 'data:image/png;base64,' + strip.image;
+        canvas.tejasStrips = (canvas.tejasStrips || Promise.resolve()).then(function () {
+            return loaded;
+        }).then(function () {
+            var context = canvas.getContext('2d');
+            var width = canvas.width;
+            var shift = Math.min(strip.columns, width);
+            if (reset) {
+                context.clearRect(0, 0, width, canvas.height);
+            } else if (shift < width) {
+                context.drawImage(canvas, shift, 0, width - shift, canvas.height,
+                                  0, 0, width - shift, canvas.height);
+            }
+            context.drawImage(image, width - strip.columns, 0);
+        });
+    }
+
+    function connect(state) {
+        if (source) {
+            source.close();
+            source = null;
+        }
+        reset();
+        current = state;
+        following = true;
+        if (!state || !state.channel) {
+            return null;
+        }
+        var url = '/stream?channel=' + encodeURIComponent(state.channel) +
+            '&window=' + state.window + '&cursor=' + state.cursor;
+        source = new EventSource(url);
+        source.addEventListener('config', function (event) {
+            config = JSON.parse(event.data);
+        });
+        source.addEventListener('samples', function (event) {
+            var batch = JSON.parse(event.data);
+            for (var i = 0; i < GRAPHS.length; i++) {
+                var name = GRAPHS[i];
+                queue(name, batch[name], batch.replace[name], batch.open[name]);
+            }
+            latestTime = batch.time;
+            Object.assign(values, batch.values);
+            scheduleDraw();
+        });
+        source.addEventListener('spectrogram', function (event) {
+            var message = JSON.parse(event.data);
+            for (var id in message.channels) {
+                var canvas = document.getElementById(id);
+                if (canvas) {
+                    drawStrip(canvas, message.channels[id], message.reset);
+                }
+            }
+        });
+        source.addEventListener('status', function (event) {
+            var status = JSON.parse(event.data);
+            Object.assign(values, status.values);
+            var anomaly = document.getElementById('anomaly-display');
+            if (anomaly) {
+                anomaly.style.color = status.anomaly_color;
+            }
+            scheduleDraw();
+        });
+        source.addEventListener('anomaly', function (event) {
+            // Shown straight away, until the next status event
+            var anomaly = JSON.parse(event.data);
+            var element = document.getElementById('anomaly-display');
+            if (element) {
+                element.textContent = 'Anomaly: score ' + anomaly.score.toFixed(3) +
+                    (anomaly.count > 1 ? ' (' + anomaly.count + ' windows)' : '');
+                element.style.color = '#e74c3c';
+            }
+        });
+        return url;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        tejas: {connect: connect}
+    });
+})();
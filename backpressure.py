@@ -0,0 +1,217 @@
+import queue
+import threading
+import time
+from collections import deque
+
+from metrics import REGISTRY, get_logger, sample
+
+
+# Bounded hand-off between pipeline stages, so a stage that falls behind
+# shows up as a growing queue instead of a silently overflowing port buffer
+# or ring. Capacities are in samples. What a full queue does is its policy:
+#   block        put() waits for room; nothing is ever dropped. For the
+#                recorder and the detector: if they stall for longer than
+#                the queue holds, ingest stalls with them and the loss shows
+#                up at the source (frames_lost), never as a hole in the data.
+#                Producers put through deliver(), so a stall that lasts is
+#                logged as an error every STALL_SECONDS and exported as
+#                tejas_queue_stalled rather than hanging quietly.
+#   drop-oldest  the oldest batches are shed to make room; for views such as
+#                the dashboards, where only the newest data matters.
+#   drop-newest  the batch being put is shed.
+# A queue is overloaded once it has stayed at least `overload` full for
+# `sustain` seconds; consumers use that to shed optional work.
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+STALL_SECONDS = 10.0
+
+log = get_logger('backpressure')
+
+
+class BoundedQueue:
+    # Thread-safe FIFO of batches with a bound on the samples queued
+
+    def __init__(self, name, capacity, policy=BLOCK, overload=0.5, sustain=2.0, channel='default'):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy!r}, expected one of {', '.join(POLICIES)}")
+        self.name = name
+        self.capacity = capacity
+        self.policy = policy
+        self.overload = overload
+        self.sustain = sustain
+        self.channel = channel
+        self._items = deque()
+        self._ready = threading.Condition()
+        self._room = threading.Condition(self._ready)
+        self._over_since = None
+
+        self.depth = 0
+        self.max_depth = 0
+        self.samples_in = 0
+        self.shed = 0
+        self.shed_batches = 0
+        self.blocked_seconds = 0.0
+        self.stalled = False  # a put gave up waiting for room; cleared by the next that fits
+        self.stalls = 0
+        REGISTRY.add_collector(self._collect)
+
+    def __len__(self):
+        return len(self._items)
+
+    def close(self):
+        # Stop exporting this queue's metrics; for the owner, once its
+        # producer and consumer have stopped
+        REGISTRY.remove_collector(self._collect)
+
+    @property
+    def overloaded(self):
+        over_since = self._over_since
+        return over_since is not None and time.monotonic() - over_since >= self.sustain
+
+    def put(self, item, size=1, timeout=None):
+        # Queue item, `size` samples. Returns False if it was shed; with
+        # the block policy, raises queue.Full if there is still no room
+        # after `timeout` seconds. A batch larger than the whole queue is
+        # let in once the queue is empty.
+        with self._ready:
+            if self.depth + size > self.capacity and self._items:
+                if self.policy == DROP_NEWEST:
+                    self._shed(size)
+                    return False
+                if self.policy == DROP_OLDEST:
+                    while self._items and self.depth + size > self.capacity:
+                        _, dropped = self._items.popleft()
+                        self.depth -= dropped
+                        self._shed(dropped)
+                else:
+                    start = time.monotonic()
+                    if not self.stalled:
+                        log.warning("%s %s queue full (%d samples); waiting", self.channel, self.name,
+                                    self.depth)
+                    fits = self._room.wait_for(lambda: self.depth + size <= self.capacity or not self._items,
+                                               timeout)
+                    self.blocked_seconds += time.monotonic() - start
+                    if not fits:
+                        if not self.stalled:
+                            self.stalls += 1
+                        self.stalled = True
+                        raise queue.Full
+            if self.stalled:
+                log.warning("%s %s queue moving again", self.channel, self.name)
+                self.stalled = False
+            self._items.append((item, size))
+            self.depth += size
+            self.samples_in += size
+            self.max_depth = max(self.max_depth, self.depth)
+            self._watch()
+            self._ready.notify()
+            return True
+
+    def get(self, timeout=None):
+        # The oldest item; raises queue.Empty if none arrives within timeout
+        return self.get_all(timeout, limit=1)[0]
+
+    def get_all(self, timeout=None, limit=None, max_size=None):
+        # Every queued item (at most limit items, or as many as fit in
+        # max_size samples but at least one), oldest first, waiting up to
+        # timeout seconds for the first; raises queue.Empty if none arrives
+        with self._ready:
+            if not self._ready.wait_for(lambda: self._items, timeout):
+                raise queue.Empty
+            count = len(self._items) if limit is None else min(limit, len(self._items))
+            items = [self._items.popleft()]
+            taken = items[0][1]
+            while len(items) < count and (max_size is None or taken + self._items[0][1] <= max_size):
+                items.append(self._items.popleft())
+                taken += items[-1][1]
+            self.depth -= taken
+            self._watch()
+            self._room.notify_all()
+        return [item for item, _ in items]
+
+    def _shed(self, size):
+        self.shed += size
+        self.shed_batches += 1
+
+    def _watch(self):
+        if self.depth < self.overload * self.capacity:
+            self._over_since = None
+        elif self._over_since is None:
+            self._over_since = time.monotonic()
+
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'capacity': self.capacity,
+            'policy': self.policy,
+            'max_depth': self.max_depth,
+            'shed': self.shed,
+            'blocked_seconds': self.blocked_seconds,
+            'overloaded': self.overloaded,
+            'stalled': self.stalled,
+        }
+
+    def _collect(self):
+        labels = {'channel': self.channel, 'queue': self.name}
+        return [
+            sample('tejas_queue_depth', 'Samples waiting in a stage queue', 'gauge', labels, self.depth),
+            sample('tejas_queue_capacity', 'Samples a stage queue holds', 'gauge', labels, self.capacity),
+            sample('tejas_queue_samples_total', 'Samples put into a stage queue', 'counter', labels,
+                   self.samples_in),
+            sample('tejas_queue_shed_samples_total', 'Samples shed by a full stage queue', 'counter', labels,
+                   self.shed),
+            sample('tejas_queue_blocked_seconds_total', 'Time producers waited on a full stage queue',
+                   'counter', labels, self.blocked_seconds),
+            sample('tejas_queue_overloaded', 'Whether a stage queue is in sustained overload', 'gauge',
+                   labels, int(self.overloaded)),
+            sample('tejas_queue_stalled', 'Whether a producer has waited STALL_SECONDS on a full stage queue',
+                   'gauge', labels, int(self.stalled)),
+            sample('tejas_queue_stalls_total', 'Times a stage queue stalled its producer', 'counter', labels,
+                   self.stalls),
+        ]
+
+
+def deliver(q, item, size=1, stall_after=STALL_SECONDS):
+    # put() into a block-policy queue, waiting as long as it takes, but with
+    # an error logged for every stall_after seconds without room
+    waited = 0.0
+    while True:
+        try:
+            return q.put(item, size, timeout=stall_after)
+        except queue.Full:
+            waited += stall_after
+            log.error("%s %s queue stalled: no room for %.0f s, its producer is blocked; is the %s stuck?",
+                      q.channel, q.name, waited, q.name)
+
+
+class Stage(threading.Thread):
+    # Consumer thread calling handler(item) for every item of a queue, in
+    # order. stop() lets it finish what is already queued.
+
+    def __init__(self, name, inbox, handler):
+        super().__init__(name=name, daemon=True)
+        self.inbox = inbox
+        self.handler = handler
+        self._stop_event = threading.Event()
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        self.join(timeout)
+
+    def run(self):
+        while True:
+            try:
+                items = self.inbox.get_all(timeout=0.1)
+            except queue.Empty:
+                if self._stop_event.is_set():
+                    return
+                continue
+            for item in items:
+                try:
+                    self.handler(item)
+                except Exception:
+                    log.exception("%s failed on a batch", self.name)
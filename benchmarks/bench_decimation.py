@@ -0,0 +1,38 @@
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from decimation import lttb, minmax
+
+
+WIDTH = 1000
+REPEAT = 5
+
+
+def make_trace(n, spikes):
+    # An hour of noisy sensor data with a few one-sample crack spikes
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 3600, n)
+    y = 2.5 + 0.1 * rng.standard_normal(n)
+    y[spikes] += 4.0
+    return x, y
+
+
+def main():
+    for n in (10_000, 100_000, 1_000_000):
+        spikes = np.random.default_rng(1).choice(n, 5, replace=False)
+        x, y = make_trace(n, spikes)
+        for name, method in (('minmax', lambda: minmax(x, y, WIDTH)), ('lttb', lambda: lttb(x, y, WIDTH))):
+            ms = min(timeit.repeat(method, number=1, repeat=REPEAT)) * 1e3
+            xd, yd = method()
+            kept = np.isin(x[spikes], xd).sum()
+            print(f"{n:9d} points  {name:6s} -> {len(xd):5d} points in {ms:8.2f} ms, "
+                  f"{kept}/{len(spikes)} spikes kept, max {yd.max():.2f} (raw {y.max():.2f})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import os
+
+# Pin BLAS to one thread so "single core" means one core
+os.environ.setdefault('OMP_NUM_THREADS', '1')
+os.environ.setdefault('OPENBLAS_NUM_THREADS', '1')
+os.environ.setdefault('MKL_NUM_THREADS', '1')
+
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from anomaly_detector import Autoencoder
+from preprocessing import sliding_windows
+
+
+WINDOW = 64
+STEP = 16
+N_SAMPLES = 2_000_000
+
+
+def make_signal(n, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(n)
+    return 512 + 100 * np.sin(2 * np.pi * t / 37) + 10 * rng.standard_normal(n)
+
+
+def score_chunk(args):
+    model, signal = args
+    return len(model.score(sliding_windows(signal, WINDOW, STEP)))
+
+
+def main():
+    model = Autoencoder.fit_linear(sliding_windows(make_signal(100_000), WINDOW, STEP))
+    signal = make_signal(N_SAMPLES, seed=1)
+    windows = sliding_windows(signal, WINDOW, STEP)
+
+    start = time.perf_counter()
+    model.score(windows)
+    single = len(windows) / (time.perf_counter() - start)
+    print(f"{len(windows)} windows of {WINDOW} samples")
+    print(f"{'single core':16s} {single:12.0f} windows/s")
+
+    for workers in sorted({2, os.cpu_count() or 1}):
+        chunks = np.array_split(signal, workers * 4)
+        with ProcessPoolExecutor(workers) as pool:
+            # Warm the workers up before timing
+            list(pool.map(score_chunk, [(model, chunks[0][:WINDOW * 4])] * workers))
+            start = time.perf_counter()
+            scored = sum(pool.map(score_chunk, [(model, chunk) for chunk in chunks]))
+            rate = scored / (time.perf_counter() - start)
+        print(f"{f'{workers} process pool':16s} {rate:12.0f} windows/s  {rate / single:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
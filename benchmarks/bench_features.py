@@ -0,0 +1,33 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from preprocessing import FeaturePipeline
+
+
+SAMPLE_RATE = 5000
+SECONDS = 120
+
+
+def main():
+    rng = np.random.default_rng(0)
+    t = np.arange(SAMPLE_RATE * SECONDS) / SAMPLE_RATE
+    signal = 512 + 50 * np.sin(2 * np.pi * 300 * t) + 10 * rng.standard_normal(len(t))
+
+    print(f"{SECONDS} s of {SAMPLE_RATE} Hz ADC data")
+    for chunk_ms in (10, 100, 1000):
+        pipeline = FeaturePipeline(SAMPLE_RATE)
+        chunks = np.array_split(signal, len(signal) // (SAMPLE_RATE * chunk_ms // 1000))
+        start = time.perf_counter()
+        windows = sum(len(pipeline.process(chunk)[1]['rms']) for chunk in chunks)
+        elapsed = time.perf_counter() - start
+        print(f"{chunk_ms:5d} ms chunks: {len(signal) / elapsed:12.0f} samples/s, "
+              f"{windows} windows, {len(signal) / elapsed / SAMPLE_RATE:6.0f}x real time")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from line_parser import parse_line, parse_lines
+
+
+N_LINES = 10000
+REPEAT = 5
+
+
+def legacy_parse(raw):
+    # The parsing steps update_graph used to run for every line
+    line = raw.decode('utf-8').strip()
+    if 'ADC Value' in line and 'Amplitude' in line and 'Frequency' in line:
+        parts = [part.strip() for part in line.split('|')]
+        adc_value = float(parts[0].split(':')[1].strip().split()[0])
+        amplitude = float(parts[1].split(':')[1].strip().split('V')[0])
+        frequency = float(parts[2].split(':')[1].strip().split('Hz')[0])
+        status = parts[3].strip() if len(parts) > 3 else "N/A"
+        return adc_value, amplitude, frequency, status
+    return None
+
+
+def make_lines(n):
+    return [
+        f"ADC Value: {i % 1024} | Amplitude: {(i % 500) / 100:.2f}V | "
+        f"Frequency: {100 + i % 50}Hz | Normal operation\r\n".encode('ascii')
+        for i in range(n)
+    ]
+
+
+def best_ns_per_line(func):
+    return min(timeit.repeat(func, number=1, repeat=REPEAT)) / N_LINES * 1e9
+
+
+def main():
+    lines = make_lines(N_LINES)
+    buffer = b''.join(lines)
+
+    results = {
+        'legacy update_graph parsing': best_ns_per_line(lambda: [legacy_parse(l) for l in lines]),
+        'line_parser.parse_line': best_ns_per_line(lambda: [parse_line(l) for l in lines]),
+        'line_parser.parse_lines (batch)': best_ns_per_line(lambda: parse_lines(buffer)),
+    }
+
+    baseline = results['legacy update_graph parsing']
+    print(f"{N_LINES} lines, best of {REPEAT}")
+    for name, ns in results.items():
+        print(f"{name:34s} {ns:8.0f} ns/line  {baseline / ns:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
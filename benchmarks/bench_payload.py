@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+
+import numpy as np
+from dash import Patch
+from plotly.io.json import to_json_plotly
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from figures import make_figures
+
+
+MAX_POINTS = 1000
+TICKS = 200
+
+
+def full_figure_tick(figures, times, frequency, amplitude):
+    # What update_graph used to return: both figures, data and layout
+    fig_frequency, fig_amplitude = figures
+    fig_frequency.data[0].update(x=list(times), y=list(frequency))
+    fig_amplitude.data[0].update(x=list(times), y=list(amplitude))
+    xaxis_range = [times[-1] - 15, times[-1]]
+    fig_frequency.update_layout(xaxis_range=xaxis_range)
+    fig_amplitude.update_layout(xaxis_range=xaxis_range)
+    return to_json_plotly([fig_frequency, fig_amplitude])
+
+
+def incremental_tick(times, frequency, amplitude):
+    # What update_graph returns now: extendData for the new points and a
+    # Patch for the x-axis range
+    times = times.tolist()
+    patch = Patch()
+    patch['layout']['xaxis']['range'] = [times[-1] - 15, times[-1]]
+    return to_json_plotly([
+        [{'x': [times], 'y': [frequency.tolist()]}, [0], MAX_POINTS],
+        [{'x': [times], 'y': [amplitude.tolist()]}, [0], MAX_POINTS],
+        patch,
+        patch,
+    ])
+
+
+def measure(tick):
+    sizes = []
+    start = time.process_time()
+    for i in range(TICKS):
+        sizes.append(len(tick(i).encode('utf-8')))
+    return np.mean(sizes), (time.process_time() - start) / TICKS * 1e3
+
+
+def main():
+    figures = make_figures()
+    rng = np.random.default_rng(0)
+    now = time.time()
+    times = now + np.arange(MAX_POINTS) * 0.01
+    frequency = rng.uniform(100, 150, MAX_POINTS)
+    amplitude = rng.uniform(0, 5, MAX_POINTS)
+
+    print(f"{MAX_POINTS} points on screen, {TICKS} ticks")
+    full_bytes, full_ms = measure(lambda i: full_figure_tick(figures, times, frequency, amplitude))
+    print(f"{'full figures':28s} {full_bytes:10.0f} bytes/tick {full_ms:8.3f} ms CPU/tick")
+    for new_points in (1, 10, 100):
+        sl = slice(-new_points, None)
+        inc_bytes, inc_ms = measure(lambda i: incremental_tick(times[sl], frequency[sl], amplitude[sl]))
+        print(f"{f'extendData, {new_points} new points':28s} {inc_bytes:10.0f} bytes/tick "
+              f"{inc_ms:8.3f} ms CPU/tick  {full_bytes / inc_bytes:6.0f}x smaller")
+
+
+if __name__ == '__main__':
+    main()
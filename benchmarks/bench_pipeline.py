@@ -0,0 +1,440 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import numpy as np
+from plotly.io.json import to_json_plotly
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from acquisition import BANDPASS, BUFFER_CAPACITY, QUEUE_SECONDS, SAMPLE_RATE
+from anomaly_detector import AnomalyDetector, Autoencoder
+from backpressure import BoundedQueue, Stage
+from event_index import EventIndex, EventLogger
+from frame_protocol import StreamDecoder, encode_frames
+from metrics import REGISTRY, Histogram
+from multichannel import LocalChannel
+from preprocessing import FeaturePipeline, sliding_windows
+from recorder import Recorder
+from rollups import Rollups
+from sample_buffer import SampleBuffer
+from serial_ingest import SerialIngest
+from sources import SyntheticSource
+
+
+# End-to-end benchmark of the acquisition-to-dashboard path, headless: no
+# serial port, no browser. Prints one JSON document; keep it next to the
+# commit it was taken on and compare with --compare.
+#
+#   python benchmarks/bench_pipeline.py --output before.json
+#   python benchmarks/bench_pipeline.py --compare before.json
+
+RATES = (1000, 10000, 100000)  # lines/s
+POOL_LINES = 100000
+# Receive buffer of the stand-in serial port; a reader that falls further
+# behind than this loses lines, like a real UART driver
+DRIVER_BUFFER = 64 * 1024
+REPEAT = 5
+
+
+class PacedLines:
+    # Serial port stand-in: lines from a pre-generated pool become readable
+    # at `rate` lines per second of wall time, for `seconds`. read() returns
+    # everything that has arrived since the previous read, up to the receive
+    # buffer; the rest is counted in lines_dropped.
+
+    exhausted = False
+
+    def __init__(self, lines, rate, seconds, buffer_bytes=DRIVER_BUFFER):
+        self.data = b''.join(lines)
+        self.offsets = np.concatenate(([0], np.cumsum([len(line) for line in lines])))
+        self.rate = rate
+        self.total = int(rate * seconds)
+        self.buffer_lines = max(1, int(buffer_bytes / (len(self.data) / len(lines))))
+        self.sent = 0
+        self.lines_dropped = 0
+        self.start = None
+
+    def open(self):
+        return self
+
+    def read(self):
+        now = time.perf_counter()
+        if self.start is None:
+            self.start = now
+        due = min(int((now - self.start) * self.rate), self.total)
+        if due == self.sent:
+            # Nothing new yet: wait for the next line, as a blocking read would
+            time.sleep(min((self.sent + 1) / self.rate - (now - self.start), 0.01))
+            return b'', time.time()
+        n = due - self.sent
+        if n > self.buffer_lines:
+            self.lines_dropped += n - self.buffer_lines
+            n = self.buffer_lines
+        chunk = self._lines(self.sent, n)
+        self.sent = due
+        self.exhausted = self.sent >= self.total
+        return chunk, time.time()
+
+    def _lines(self, first, n):
+        pool = len(self.offsets) - 1
+        first %= pool
+        if first + n <= pool:
+            return self.data[self.offsets[first]:self.offsets[first + n]]
+        return self.data[self.offsets[first]:] + self._lines(0, n - (pool - first))
+
+    def close(self):
+        pass
+
+
+def make_pool(n=POOL_LINES):
+    # Arduino text lines and the matching columns, with crack signatures.
+    # No Time field: the pool is replayed in a loop at other rates, so the
+    # samples are stamped by their position in the stream instead.
+    source = SyntheticSource(SAMPLE_RATE, crack_rate=0.5, speed=None, seed=0, timestamps=False)
+    adc, amplitude, frequency, status, index = source.generate(np.arange(n))
+    text = source.encode(adc, amplitude, frequency, status, index)
+    lines = text.splitlines(keepends=True)
+    return lines, (adc, amplitude, frequency, status)
+
+
+def fit_model(columns):
+    # Model fitted on the filtered pool, so the detector scores from the start
+    pipeline = FeaturePipeline(SAMPLE_RATE, BANDPASS)
+    return Autoencoder.fit_linear(sliding_windows(pipeline.filter.process(columns[0]), 64, 16))
+
+
+def rss_bytes():
+    # Resident set size; peak RSS where /proc is not available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def quantile(histogram, q):
+    # Upper bucket bound below which a fraction q of the observations fell
+    if not histogram.count:
+        return None
+    cumulative = np.cumsum(histogram.counts)
+    i = int(np.searchsorted(cumulative, q * histogram.count))
+    return histogram.buckets[i] if i < len(histogram.buckets) else float('inf')
+
+
+def latency(histogram):
+    if not histogram.count:
+        return None
+    return {
+        'count': histogram.count,
+        'mean_us': histogram.sum / histogram.count * 1e6,
+        'p50_us': quantile(histogram, 0.5) * 1e6,
+        'p99_us': quantile(histogram, 0.99) * 1e6,
+    }
+
+
+def bench_parse(lines, columns):
+    # Decoder cost per line and per binary frame, best of REPEAT
+    text = b''.join(lines)
+    frames = encode_frames(*columns)
+    results = {'bytes_per_line': len(text) / len(lines)}
+    for name, data in (('text', text), ('binary', frames)):
+        best = min(timeit.repeat(lambda: StreamDecoder().feed(data), number=1, repeat=REPEAT))
+        results[f'{name}_ns_per_sample'] = best / len(lines) * 1e9
+    return results
+
+
+def run_pipeline(lines, model, rate, seconds, buffer_bytes=DRIVER_BUFFER, memory_interval=None):
+    # The acquisition path of one channel: ingest thread into the rollups
+    # and the sample buffer, and through queues to the recorder thread and
+    # the detector thread logging events to SQLite
+    directory = tempfile.mkdtemp(prefix='tejas-bench-')
+    channel = f'bench-{rate}-{time.monotonic_ns()}'
+    try:
+        source = PacedLines(lines, rate, seconds, buffer_bytes)
+        samples = SampleBuffer(BUFFER_CAPACITY)
+        rollups = Rollups()
+        recorder = Recorder(directory, run=channel)
+        index = EventIndex(os.path.join(directory, 'events.sqlite'))
+        queues = {name: BoundedQueue(name, QUEUE_SECONDS * SAMPLE_RATE, channel=channel)
+                  for name in ('recorder', 'detector')}
+        writer = Stage('recorder', queues['recorder'], lambda batch: recorder.extend(*batch))
+
+        def store_samples(timestamp, adc, amplitude, frequency, status):
+            rollups.extend(timestamp, adc, amplitude, frequency, status)
+            samples.extend(timestamp, adc, amplitude, frequency, status)
+            queues['detector'].put((timestamp, adc), len(status))
+            queues['recorder'].put((timestamp, adc, amplitude, frequency, status), len(status))
+
+        ingest = SerialIngest(source, store_samples, channel=channel).open()
+        detector = AnomalyDetector(samples, model, pipeline=FeaturePipeline(SAMPLE_RATE, BANDPASS),
+                                   on_anomaly=EventLogger(index, channel=channel, run=channel),
+                                   channel=channel, inbox=queues['detector'])
+        memory = []
+        start = time.perf_counter()
+        writer.start()
+        ingest.start()
+        detector.start()
+        while ingest.is_alive():
+            ingest.join(memory_interval or 0.5)
+            if memory_interval:
+                memory.append((time.perf_counter() - start, rss_bytes()))
+        elapsed = time.perf_counter() - start
+        # Let the detector work through its queue
+        while len(queues['detector']):
+            time.sleep(detector.poll_interval)
+        time.sleep(2 * detector.poll_interval)
+        ingest.stop()
+        detector.stop()
+        detector.join()
+        writer.stop()
+        for q in queues.values():
+            q.close()
+        recorder.close()
+        events = index.count()
+        index.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    result = {
+        'rate': rate,
+        'seconds': elapsed,
+        'lines_offered': source.total,
+        'lines_dropped': source.lines_dropped,
+        'samples_parsed': ingest.samples_parsed,
+        'lines_per_second': ingest.samples_parsed / elapsed,
+        'sustained': source.lines_dropped == 0 and ingest.samples_parsed == source.total,
+        'windows_scored': detector.windows_scored,
+        'events': events,
+        # Deepest each stage queue got, in samples, and how long ingest
+        # waited on them
+        'queues': {name: {'max_depth': q.max_depth, 'blocked_seconds': q.blocked_seconds}
+                   for name, q in queues.items()},
+    }
+    # The stage histograms of this run, see metrics.REGISTRY
+    for stage, name, labels in (('read', 'tejas_read_seconds', {'channel': channel}),
+                                ('parse', 'tejas_parse_seconds', {'channel': channel}),
+                                ('append', 'tejas_append_seconds', {'channel': channel}),
+                                ('detect', 'tejas_detect_seconds', {'channel': channel}),
+                                ('record_flush', 'tejas_record_flush_seconds', {'run': channel})):
+        result[stage] = latency(REGISTRY.histogram(name, '', **labels))
+    if ingest.samples_parsed:
+        parse = REGISTRY.histogram('tejas_parse_seconds', '', channel=channel)
+        result['parse_ns_per_line'] = parse.sum / ingest.samples_parsed * 1e9
+    return result, memory
+
+
+def max_sustained(lines, model, runs, seconds, buffer_bytes, steps=4):
+    # Double from the fastest sustained rate until lines are lost, then
+    # bisect between the last good and the first bad rate
+    good = max((r['rate'] for r in runs if r['sustained']), default=None)
+    bad = min((r['rate'] for r in runs if not r['sustained']), default=None)
+    if good is None:
+        return None
+    while bad is None and good < 10_000_000:
+        result, _ = run_pipeline(lines, model, good * 2, seconds, buffer_bytes)
+        runs.append(result)
+        if result['sustained']:
+            good *= 2
+        else:
+            bad = good * 2
+    for _ in range(steps if bad is not None else 0):
+        rate = (good + bad) // 2
+        result, _ = run_pipeline(lines, model, rate, seconds, buffer_bytes)
+        runs.append(result)
+        if result['sustained']:
+            good = rate
+        else:
+            bad = rate
+    return good
+
+
+def bench_memory(lines, model, rate, seconds, buffer_bytes):
+    # RSS over a long run. Growth is the fitted slope once the sample buffer
+    # has filled (its pages are only touched as it fills) plus a tenth of the
+    # run for warm-up.
+    result, memory = run_pipeline(lines, model, rate, seconds, buffer_bytes, memory_interval=1.0)
+    warmup = BUFFER_CAPACITY / rate + seconds / 10
+    steady = [(t, rss) for t, rss in memory if t >= warmup]
+    growth = None
+    if len(steady) > 1:
+        times, rss = np.array(steady, dtype=float).T
+        growth = float(np.polyfit(times, rss, 1)[0] * 60)
+    return {
+        'rate': rate,
+        'seconds': result['seconds'],
+        'warmup_seconds': warmup,
+        'lines_dropped': result['lines_dropped'],
+        'rss_start_bytes': steady[0][1] if steady else None,
+        'rss_end_bytes': memory[-1][1],
+        'rss_peak_bytes': max(r for _, r in memory),
+        'growth_bytes_per_minute': growth,
+    }
+
+
+def bench_render(rates, ticks):
+    # Imported here, so the ingest runs are measured without Dash loaded
+    import gps_simulation
+    now = time.time()
+    rollups = history_rollups(now, max(gps_simulation.TIME_WINDOWS.values()))
+    return [render_at(gps_simulation, rate, ticks, now, rollups) for rate in rates]
+
+
+def history_rollups(end, seconds, rate=100):
+    # Rollup tiers over the longest time window, for the redraws that reach
+    # past the sample buffer. Their cost depends on the number of buckets,
+    # not on how many samples went into each, so a low rate will do.
+    rollups = Rollups()
+    source = SyntheticSource(rate, speed=None, seed=2)
+    for first in range(0, int(seconds * rate), 10 * rate):
+        adc, amplitude, frequency, status, n = source.generate(np.arange(first, first + 10 * rate))
+        rollups.extend(end - seconds + n / rate, adc, amplitude, frequency, status)
+    return rollups
+
+
+def render_at(gps_simulation, rate, ticks, now, rollups):
+    # The dashboard callbacks on a full buffer filled at `rate`: a redraw
+    # per time window and `ticks` pushed sample batches
+    samples = SampleBuffer(BUFFER_CAPACITY)
+    source = SyntheticSource(SAMPLE_RATE, speed=None, seed=1)
+    adc, amplitude, frequency, status, n = source.generate(np.arange(BUFFER_CAPACITY))
+    samples.extend(now + (n - len(n)) / rate, adc, amplitude, frequency, status)
+    channel = LocalChannel('bench', samples, SerialIngest(None, None, channel=f'render-{rate}'),
+                           AnomalyDetector(samples, channel=f'render-{rate}'), rollups=rollups,
+                           sample_rate=rate)
+    gps_simulation.create_app({'bench': channel})
+
+    results = {'rate': rate, 'redraw': {}}
+    for label, window in gps_simulation.TIME_WINDOWS.items():
+        best = min(timeit.repeat(lambda: gps_simulation.redraw(window, 'bench'), number=1, repeat=REPEAT))
+        payload = to_json_plotly(gps_simulation.redraw(window, 'bench')[:2])
+        results['redraw'][label] = {'ms': best * 1e3, 'payload_bytes': len(payload.encode('utf-8'))}
+
+    # What one push interval brings in at this rate, timed by a histogram
+    # of its own
+    push = gps_simulation.PUSH_SECONDS = Histogram('tejas_render_seconds', '', {'stage': 'push'})
+    batch = max(1, int(rate * gps_simulation.PUSH_INTERVAL))
+    stream = gps_simulation.stream_events(channel, samples.count, 15)
+    sizes = []
+    for i in range(ticks):
+        t = now + (np.arange(batch) + i * batch) / rate
+        samples.extend(t, adc[:batch], amplitude[:batch], frequency[:batch], status[:batch])
+        message = next(stream)
+        while 'event: samples' not in message:
+            message = next(stream)
+        sizes.append(len(message.encode('utf-8')))
+    stream.close()
+    # Never started; this only unregisters their metrics
+    channel.ingest.stop()
+    channel.detector.stop()
+    results['push'] = {'samples_per_batch': batch, 'payload_bytes': float(np.mean(sizes)),
+                       'build': latency(push)}
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before, after):
+    # One line per headline figure on stderr: before, after and the ratio
+    rows = [('max sustained lines/s', ('max_sustained_lines_per_second',)),
+            ('text parse ns/sample', ('parse', 'text_ns_per_sample')),
+            ('binary parse ns/sample', ('parse', 'binary_ns_per_sample')),
+            ('memory growth B/min', ('memory', 'growth_bytes_per_minute'))]
+    for run in after['ingest']:
+        rows.append((f"parse ns/line @ {run['rate']}/s", ('ingest', run['rate'], 'parse_ns_per_line')))
+    for run in after['render']:
+        rate = run['rate']
+        for label in run['redraw']:
+            rows.append((f"redraw {label} ms @ {rate}/s", ('render', rate, 'redraw', label, 'ms')))
+            rows.append((f"redraw {label} bytes @ {rate}/s",
+                         ('render', rate, 'redraw', label, 'payload_bytes')))
+        rows.append((f"push bytes @ {rate}/s", ('render', rate, 'push', 'payload_bytes')))
+
+    def lookup(doc, path):
+        for key in path:
+            if doc is None:
+                return None
+            if isinstance(key, int):
+                doc = next((run for run in doc if run['rate'] == key), None)
+            else:
+                doc = doc.get(key)
+        return doc
+
+    print(f"{'':32s} {before.get('commit') or 'before':>14s} {after.get('commit') or 'after':>14s}",
+          file=sys.stderr)
+    for label, path in rows:
+        old, new = lookup(before, path), lookup(after, path)
+        if old is None or new is None:
+            continue
+        ratio = f"{new / old:6.2f}x" if old else ''
+        print(f"{label:32s} {old:14.1f} {new:14.1f}  {ratio}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the acquisition-to-dashboard path')
+    parser.add_argument('--rates', type=int, nargs='+', default=RATES, help='lines/s to drive')
+    parser.add_argument('--seconds', type=float, default=5, help='length of each ingest run')
+    parser.add_argument('--buffer', type=int, default=DRIVER_BUFFER, help='receive buffer in bytes')
+    parser.add_argument('--no-search', action='store_true', help='only run the given rates')
+    parser.add_argument('--soak', type=float, default=60, help='length of the memory run, 0 to skip')
+    parser.add_argument('--soak-rate', type=int, default=10000, help='lines/s for the memory run')
+    parser.add_argument('--ticks', type=int, default=200, help='pushed batches to measure')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    parser.add_argument('--compare', help='earlier JSON output to compare against')
+    args = parser.parse_args()
+
+    lines, columns = make_pool()
+    model = fit_model(columns)
+    results = {
+        'commit': git_commit(),
+        'time': time.time(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'parse': bench_parse(lines, columns),
+    }
+
+    runs = [run_pipeline(lines, model, rate, args.seconds, args.buffer)[0] for rate in args.rates]
+    if args.no_search:
+        sustained = [r['rate'] for r in runs if r['sustained']]
+        results['max_sustained_lines_per_second'] = max(sustained, default=None)
+    else:
+        results['max_sustained_lines_per_second'] = max_sustained(lines, model, runs, args.seconds,
+                                                                  args.buffer)
+    results['ingest'] = sorted(runs, key=lambda r: r['rate'])
+
+    results['render'] = bench_render(sorted(args.rates), args.ticks)
+
+    if args.soak:
+        results['memory'] = bench_memory(lines, model, args.soak_rate, args.soak, args.buffer)
+
+    document = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(document + '\n')
+    else:
+        print(document)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+# Cold-start cost of each way of starting TEJAS, every run in a fresh
+# interpreter under -X importtime: wall time, time spent importing, peak
+# RSS and which heavy dependencies got loaded.
+#
+#   python benchmarks/bench_startup.py
+#   python benchmarks/bench_startup.py --top 15 --json startup.json
+
+HEAVY = ('dash', 'plotly', 'flask', 'requests', 'geocoder', 'serial', 'numpy', 'scipy')
+REPEAT = 5
+
+SCENARIOS = {
+    'import acquisition': 'import acquisition',
+    'import gps_simulation': 'import gps_simulation',
+    'headless start': (
+        'import acquisition\n'
+        'a = acquisition.Acquisition(PREFIX).start()\n'
+        'a.stop()'
+    ),
+    'dashboard start': (
+        'import acquisition, gps_simulation\n'
+        'a = acquisition.Acquisition(PREFIX).start()\n'
+        'gps_simulation.create_app(a.channels)\n'
+        'a.stop()'
+    ),
+}
+
+# Runs the scenario and reports back on stdout
+PROBE = '''
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+PREFIX = {prefix!r}
+start = time.perf_counter()
+exec(compile({code!r}, '<scenario>', 'exec'))
+seconds = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{
+    'seconds': seconds,
+    'rss_bytes': peak if sys.platform == 'darwin' else peak * 1024,
+    'modules': len(sys.modules),
+    'loaded': [name for name in {heavy!r} if name in sys.modules],
+}}))
+'''
+
+
+def import_times(stderr):
+    # {module: (self us, cumulative us)} from -X importtime output, plus the
+    # total over top-level imports
+    times = {}
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        if not name[1:].startswith(' '):
+            total += int(cumulative)
+        times[name.strip()] = (int(own), int(cumulative))
+    return times, total
+
+
+def run(name, code, directory):
+    env = dict(os.environ,
+               TEJAS_SOURCE='synthetic:1000@max', TEJAS_POSITION='none',
+               TEJAS_EVENTS_DB=os.path.join(directory, 'events.sqlite'),
+               TEJAS_RECORD_DIR=os.path.join(directory, 'recordings'),
+               TEJAS_LOG_LEVEL='WARNING')
+    env.pop('TEJAS_NOTIFY_URL', None)
+    env.pop('TEJAS_CHANNELS', None)
+    probe = PROBE.format(root=ROOT, prefix=f'startup-{os.getpid()}', code=code, heavy=HEAVY)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', probe], cwd=directory, env=env,
+                            capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode:
+        raise RuntimeError(f"{name} failed:\n{result.stderr[-2000:]}")
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    times, total = import_times(result.stderr)
+    report.update(wall_seconds=wall, import_seconds=total / 1e6)
+    return report, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold-start time and memory')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='runs per scenario, best is kept')
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to list per scenario')
+    parser.add_argument('--json', help='also write the results here')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='tejas-startup-') as directory:
+        for name, code in SCENARIOS.items():
+            runs = [run(name, code, directory) for _ in range(args.repeat)]
+            report, times = min(runs, key=lambda r: r[0]['wall_seconds'])
+            report['slowest_imports'] = sorted(
+                ((module, cumulative / 1e3) for module, (_, cumulative) in times.items()
+                 if '.' not in module), key=lambda item: -item[1])[:args.top]
+            results[name] = report
+
+    print(f"{'':24s} {'wall ms':>9s} {'import ms':>10s} {'RSS MB':>8s} {'modules':>8s}  loaded")
+    for name, report in results.items():
+        print(f"{name:24s} {report['wall_seconds'] * 1e3:9.0f} {report['import_seconds'] * 1e3:10.0f} "
+              f"{report['rss_bytes'] / 2 ** 20:8.1f} {report['modules']:8d}  {' '.join(report['loaded'])}")
+    for name, report in results.items():
+        print(f"\n{name}, slowest top-level packages (cumulative ms):")
+        for module, ms in report['slowest_imports']:
+            print(f"  {module:28s} {ms:8.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
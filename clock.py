@@ -0,0 +1,221 @@
+from collections import deque
+
+import numpy as np
+
+
+# Host timestamps for samples, reconstructed from counters the device keeps
+# itself. A read from the port only tells us that its samples were taken
+# some time before the read returned: stamping them all with the read time
+# collapses a burst onto one instant and adds the read latency as jitter.
+# Instead each sample's device counter (the sketch's micros(), or the frame
+# sequence number) is mapped onto host time by a line fitted under the read
+# times, which also follows the drift of the device oscillator.
+
+MICROS_WRAP = 1 << 32  # micros() is a uint32
+SEQ_WRAP = 1 << 16  # frame sequence numbers are uint16
+
+
+class DeviceClock:
+    # Maps a device counter to host time as offset + period * count.
+    #
+    # Every read adds an anchor: the newest count in it and the host time
+    # the read returned, which is never earlier than when that sample was
+    # taken. The lowest anchor of each window / bins seconds is kept for
+    # `window` seconds. The period is the slope of a line fitted through
+    # them, within max_drift of the nominal period (max_drift None learns
+    # the rate from scratch, with `period` only as a first guess), and the
+    # offset puts the line under every anchor, i.e. at the least delayed
+    # read. After `settle` seconds, offset corrections are slewed at no more
+    # than `slew` seconds per second so the timestamps stay evenly spaced; a
+    # step of more than `resync` seconds (a device restart, the host clock
+    # being set) starts over. Timestamps never go backwards.
+
+    def __init__(self, period=None, modulus=None, window=30.0, bins=32, max_drift=0.01, settle=5.0,
+                 slew=0.005, resync=1.0):
+        self.nominal = period
+        self.period = period
+        self.modulus = modulus
+        self.window = window
+        self.bin_width = window / bins
+        self.max_drift = max_drift if period is not None else None
+        self.settle = settle
+        self.slew = slew
+        self.resync = resync
+        self.offset = None
+        self.resyncs = 0
+        self.last_time = -np.inf
+
+        self._anchors = deque()
+        self._bin = None  # [bin index, count, host] of the current bin's lowest anchor
+        self._raw = None
+        self._count = 0
+        self._previous = None  # (count, host) of the last read
+        self._floor = np.inf
+
+    @property
+    def drift(self):
+        # Fractional deviation of the device clock from nominal, e.g. 50e-6
+        # for a crystal running 50 ppm slow
+        if self.nominal is None or self.period is None:
+            return None
+        return self.period / self.nominal - 1
+
+    def map(self, raw, arrival):
+        # Host times of the samples with device counter values `raw`, read
+        # from the port at host time `arrival`
+        counts = self._unwrap(np.asarray(raw, dtype=np.int64))
+        last = counts[-1]
+        # The fit only changes when a bin closes, so most reads skip it
+        if self._anchor(last, arrival) or self.period is None:
+            self._fit(last, arrival)
+        if self.period is None:
+            # A single read of a clock with an unknown rate: nothing to go on
+            times = np.full(len(counts), arrival)
+        else:
+            self._correct(last, arrival)
+            times = self.offset + self.period * counts
+        times = np.maximum.accumulate(np.maximum(times, self.last_time))
+        self.last_time = times[-1]
+        self._previous = (last, arrival)
+        return times
+
+    def _unwrap(self, raw):
+        # Counts since the first sample, as float64 so the fit stays exact
+        previous = raw[0] if self._raw is None else self._raw
+        steps = np.diff(raw, prepend=previous)
+        if self.modulus is not None:
+            steps %= self.modulus
+        counts = self._count + np.cumsum(steps)
+        self._raw = raw[-1]
+        self._count = counts[-1]
+        return counts.astype(np.float64)
+
+    def _anchor(self, count, host):
+        # Returns True when a bin was closed
+        index = int(host // self.bin_width)
+        if self._bin is not None and index == self._bin[0]:
+            period = self.period or 0.0
+            if host - period * count < self._bin[2] - period * self._bin[1]:
+                self._bin[1:] = count, host
+            return False
+        if self._bin is not None:
+            self._anchors.append((self._bin[1], self._bin[2]))
+        self._bin = [index, count, host]
+        while self._anchors and self._anchors[0][1] < host - self.window:
+            self._anchors.popleft()
+        return True
+
+    def _span(self):
+        first = self._anchors[0][1] if self._anchors else self._bin[2]
+        return self._bin[2] - first
+
+    def _fit(self, count, host):
+        counts = np.array([a[0] for a in self._anchors] + [self._bin[1]])
+        hosts = np.array([a[1] for a in self._anchors] + [self._bin[2]])
+        closed = len(self._anchors)
+        if closed >= 3 and hosts[closed - 1] - hosts[0] >= self.settle:
+            # The open bin has only seen one read so far; leave it out
+            period = self._envelope(counts[:closed], hosts[:closed])
+        elif self.nominal is not None:
+            period = self.nominal
+        elif self._previous is not None and count != self._previous[0]:
+            # Not enough history to fit yet: from the first anchor, or
+            # failing that the previous read
+            first = (counts[0], hosts[0]) if count != counts[0] else self._previous
+            period = (host - first[1]) / (count - first[0])
+        else:
+            period = self.period
+        if period is not None and self.max_drift is not None:
+            period = np.clip(period, self.nominal * (1 - self.max_drift), self.nominal * (1 + self.max_drift))
+        if period is not None and period > 0:
+            if self.offset is not None:
+                # Pivot on the newest sample, so a new period does not move it
+                self.offset += (self.period - period) * count
+            self.period = float(period)
+        # Lowest residual among the closed bins, for _correct
+        self._floor = np.min(hosts[:closed] - self.period * counts[:closed]) if closed and self.period else np.inf
+
+    @staticmethod
+    def _envelope(counts, hosts, rounds=2):
+        # Slope of the lower envelope: a bin that only saw slow reads sits
+        # well above the line and would tilt a plain least-squares fit, so
+        # refit on the anchors at or below the median residual. Counts and
+        # hosts are taken relative to the first anchor to keep it well
+        # conditioned.
+        counts = counts - counts[0]
+        hosts = hosts - hosts[0]
+        keep = np.ones(len(counts), dtype=bool)
+        for _ in range(rounds + 1):
+            slope, intercept = np.polyfit(counts[keep], hosts[keep], 1)
+            residuals = hosts - slope * counts - intercept
+            below = residuals <= np.median(residuals[keep])
+            if below.sum() < 3:
+                break
+            keep = below
+        return slope
+
+    def _correct(self, count, host):
+        target = min(self._floor, self._bin[2] - self.period * self._bin[1], host - self.period * count)
+        if self.offset is None:
+            self.offset = target
+            return
+        step = target - self.offset
+        if abs(step) > self.resync:
+            # The device restarted or the host clock was set: start over
+            self.resyncs += 1
+            self._anchors.clear()
+            self._bin = [int(host // self.bin_width), count, host]
+            self._floor = np.inf
+            self.offset = host - self.period * count
+            return
+        if self._span() < self.settle:
+            self.offset = target
+            return
+        elapsed = max(count - self._previous[0], 0.0) * self.period
+        self.offset += float(np.clip(step, -self.slew * elapsed, self.slew * elapsed))
+
+
+class Timebase:
+    # Per-sample host timestamps for SerialIngest. Text lines with a Time
+    # field are mapped by their micros() value, binary frames by their
+    # sequence number, and lines without a device counter by their position
+    # in the stream; the last two run at `sample_rate` if it is known, or at
+    # the rate learned from the reads.
+
+    def __init__(self, sample_rate=None):
+        period = 1.0 / sample_rate if sample_rate else None
+        self.micros = DeviceClock(1e-6, MICROS_WRAP)
+        self.frames = DeviceClock(period, SEQ_WRAP, max_drift=None)
+        self.lines = DeviceClock(period, max_drift=None)
+        self._lines = 0
+
+    def stamp(self, micros, seq, arrival):
+        # micros and seq as returned by StreamDecoder.feed, -1 where absent
+        timed = micros >= 0
+        if timed.all():
+            return self.micros.map(micros, arrival)
+        framed = seq >= 0
+        if framed.all():
+            return self.frames.map(seq, arrival)
+        times = np.empty(len(micros))
+        if timed.any():
+            times[timed] = self.micros.map(micros[timed], arrival)
+        if framed.any():
+            times[framed] = self.frames.map(seq[framed], arrival)
+        plain = ~(timed | framed)
+        n = int(plain.sum())
+        if n:
+            times[plain] = self.lines.map(np.arange(self._lines, self._lines + n), arrival)
+            self._lines += n
+        return times
+
+    def stats(self):
+        # The clock that stamped the newest sample
+        name, clock = max((('micros', self.micros), ('frames', self.frames), ('lines', self.lines)),
+                          key=lambda item: item[1].last_time)
+        drift = clock.drift
+        return {
+            'clock': name,
+            'clock_drift_ppm': drift * 1e6 if drift is not None else None,
+            'clock_resyncs': self.micros.resyncs + self.frames.resyncs + self.lines.resyncs,
+        }
@@ -0,0 +1,135 @@
+import numpy as np
+
+
+# Downsampling between the sample buffer and the figure traces. Both methods
+# keep the first and last point and return (x, y) arrays in time order.
+
+
+def _finite(x, y):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    keep = np.isfinite(x) & np.isfinite(y)
+    if not keep.all():
+        x, y = x[keep], y[keep]
+    if len(x) > 1 and np.any(np.diff(x) < 0):
+        order = np.argsort(x, kind='stable')
+        x, y = x[order], y[order]
+    return x, y
+
+
+def minmax(x, y, width, x_range=None, bucket_width=None):
+    # Keep the minimum and maximum of every pixel-wide bucket, so a one-sample
+    # spike always survives. Buckets split x_range (default: the data range)
+    # into `width` equal parts, or have a fixed bucket_width on an absolute
+    # grid so buckets line up between successive calls.
+    x, y = _finite(x, y)
+    if len(x) <= 2:
+        return x, y
+    if bucket_width is None:
+        x0, x1 = x_range if x_range is not None else (x[0], x[-1])
+        bucket_width = (x1 - x0) / width if x1 > x0 else 1.0
+    else:
+        x0 = 0.0
+    bucket = np.floor((x - x0) / bucket_width).astype(np.int64)
+
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+    if len(starts) * 2 >= len(x):
+        return x, y
+    keep = np.unique(np.concatenate((_extremes(y, starts), [0, len(x) - 1])))
+    return x[keep], y[keep]
+
+
+def _extremes(y, starts):
+    # Indices of the first minimum and first maximum of every segment of y
+    # beginning at starts, unsorted
+    counts = np.diff(np.append(starts, len(y)))
+    segment = np.repeat(np.arange(len(starts)), counts)
+    lows = np.minimum.reduceat(y, starts)
+    highs = np.maximum.reduceat(y, starts)
+    return np.concatenate((_first_hit(y == lows[segment], segment), _first_hit(y == highs[segment], segment)))
+
+
+def _first_hit(hits, segment):
+    # Index of the first True in every segment
+    idx = np.flatnonzero(hits)
+    _, first = np.unique(segment[idx], return_index=True)
+    return idx[first]
+
+
+class LiveMinMax:
+    # minmax for a trace that grows batch by batch, on an absolute grid of
+    # bucket_width. The last bucket stays open: the next batch is folded
+    # into it, so the trace keeps at most two points per bucket however
+    # often it is extended, and a window of width buckets stays within
+    # 2 * (width + 1) points.
+
+    def __init__(self, bucket_width):
+        self.bucket_width = bucket_width
+        self.bucket = None  # index of the open bucket
+        self.x = np.empty(0)  # its kept points
+        self.y = np.empty(0)
+
+    def extend(self, x, y):
+        # (replace, x, y): drop the last `replace` points of the trace, the
+        # open bucket's as last returned, and append x, y; the open bucket's
+        # points are the last `self.open` of them
+        x, y = _finite(x, y)
+        if not len(x):
+            return 0, x, y
+        bucket = np.floor(x / self.bucket_width).astype(np.int64)
+        replace = 0
+        if bucket[0] == self.bucket:
+            replace = len(self.x)
+            x, y = np.concatenate((self.x, x)), np.concatenate((self.y, y))
+            bucket = np.concatenate((np.full(replace, self.bucket), bucket))
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+        keep = np.unique(_extremes(y, starts))
+        x, y, bucket = x[keep], y[keep], bucket[keep]
+        self.bucket = bucket[-1]
+        last = np.searchsorted(bucket, self.bucket)
+        self.x, self.y = x[last:], y[last:]
+        return replace, x, y
+
+    @property
+    def open(self):
+        return len(self.x)
+
+
+def lttb(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: pick the point of every bucket that forms
+    # the largest triangle with the previously kept point and the mean of the
+    # next bucket. Bucket means and bounds are computed up front; only the
+    # chain through the previously kept point is sequential.
+    x, y = _finite(x, y)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    edges = (np.linspace(1, n - 1, n_out - 1)).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    sums_x = np.add.reduceat(x[:-1], starts)
+    sums_y = np.add.reduceat(y[:-1], starts)
+    counts = ends - starts
+    mean_x = np.append(sums_x / counts, x[-1])
+    mean_y = np.append(sums_y / counts, y[-1])
+
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        bx, by = x[start:end], y[start:end]
+        cx, cy = mean_x[i + 1], mean_y[i + 1]
+        area = np.abs((x[a] - cx) * (by - y[a]) - (x[a] - bx) * (cy - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return x[keep], y[keep]
+
+
+def decimate(x, y, width, method='minmax', x_range=None):
+    # Reduce a trace to roughly `width` buckets; 'minmax' returns up to two
+    # points per bucket, 'lttb' exactly width points
+    if method == 'lttb':
+        return lttb(x, y, width)
+    if method == 'minmax':
+        return minmax(x, y, width, x_range=x_range)
+    raise ValueError(f"Unknown decimation method: {method}")
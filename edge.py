@@ -0,0 +1,666 @@
+import argparse
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+from anomaly_detector import WindowScore, score_windows
+from backpressure import DROP_NEWEST, BoundedQueue
+from event_index import EventLogger
+from metrics import get_logger
+from multichannel import RemoteChannel
+from positioning import Position, open_position
+from preprocessing import FeaturePipeline, StreamingFIR, extract_features, sliding_windows
+from recorder import Recorder
+from rollups import TIERS, Rollups
+from sample_buffer import SampleBuffer
+
+
+# Edge mode, for nodes on the train that reach the central node over a
+# cellular link. Instead of every raw sample an edge node sends
+#   - candidate windows: the raw samples from PRE_SECONDS before to
+#     POST_SECONDS after a stretch where a cheap streaming trigger fired
+#     (short-term energy against its running average, or kurtosis),
+#     compressed, and
+#   - summaries: its SUMMARY_WIDTH rollup buckets (see rollups), every
+#     SUMMARY_INTERVAL seconds,
+# which is a few kB per candidate and a few dozen bytes per second.
+#
+# The central node runs acquisition with TEJAS_EDGE_LISTEN set (see there),
+# which hands the messages to a CentralReceiver instead of reading a
+# sensor. It scores the candidate windows with the full detector, and puts
+# the samples, scores, events and summaries into the same shared memory and
+# event index a local channel fills, so dashboards work unchanged.
+#
+#   python edge.py run --central http://central:8600/edge --source serial:/dev/ttyACM0@115200
+#
+# tests/test_edge_loopback.py runs both ends in one process over localhost
+# and checks them against scoring the full stream.
+
+PRE_SECONDS = 0.5
+POST_SECONDS = 0.5
+MAX_EVENT_SECONDS = 10.0  # longer candidates go out in pieces
+SUMMARY_WIDTH = 1.0
+SUMMARY_INTERVAL = 10.0
+
+# Rollup tiers of an edge channel at the central node: it only ever gets
+# buckets of SUMMARY_WIDTH and coarser
+CENTRAL_TIERS = tuple(width for width in TIERS if width >= SUMMARY_WIDTH)
+
+# A channel is shown as stopped after this long without a message
+EDGE_STALE = 3 * SUMMARY_INTERVAL
+
+MAGIC = b'TJE1'
+HEADER = struct.Struct('<4sI')  # magic, length of the JSON metadata that follows
+
+log = get_logger('edge')
+
+
+def _pack(meta, arrays):
+    body = zlib.compress(b''.join(np.ascontiguousarray(a).tobytes() for a in arrays))
+    header = json.dumps(meta, separators=(',', ':')).encode()
+    return HEADER.pack(MAGIC, len(header)) + header + body
+
+
+def encode_window(meta, times, adc, amplitude, frequency, status):
+    # One candidate window. Times go as float32 offsets from the first
+    # sample, ADC values as 16-bit differences when they are whole numbers
+    # (they come from a 10-bit converter), the rest as float32.
+    n = len(times)
+    adc = np.asarray(adc, dtype=np.float64)
+    whole = np.array_equal(adc, np.round(adc)) and np.all(np.abs(adc) < 1 << 14)
+    names, codes = np.unique(np.asarray(status), return_inverse=True)
+    meta = dict(meta, kind='window', n=n, t0=float(times[0]), adc='delta16' if whole else 'float32',
+                status_names=[name.decode() if isinstance(name, bytes) else str(name) for name in names])
+    arrays = [np.asarray(times - times[0], dtype=np.float32),
+              np.diff(adc, prepend=0).astype(np.int16) if whole else adc.astype(np.float32),
+              np.asarray(amplitude, dtype=np.float32), np.asarray(frequency, dtype=np.float32),
+              codes.astype(np.uint8)]
+    return _pack(meta, arrays)
+
+
+def encode_summary(meta, width, rows):
+    return _pack(dict(meta, kind='summary', width=width, rows=len(rows)), [np.asarray(rows, dtype=np.float64)])
+
+
+def decode(message):
+    # (metadata, payload): the columns (times, adc, amplitude, frequency,
+    # status names) of a window, or the rollup rows of a summary. Raises
+    # ValueError on anything malformed.
+    try:
+        magic, size = HEADER.unpack_from(message)
+        if magic != MAGIC:
+            raise ValueError('not an edge message')
+        meta = json.loads(message[HEADER.size:HEADER.size + size])
+        body = zlib.decompress(message[HEADER.size + size:])
+        if meta['kind'] == 'summary':
+            return meta, np.frombuffer(body, dtype=np.float64).reshape(meta['rows'], -1)
+        n = meta['n']
+        dtypes = (np.float32, np.int16 if meta['adc'] == 'delta16' else np.float32, np.float32, np.float32,
+                  np.uint8)
+        columns = []
+        offset = 0
+        for dtype in dtypes:
+            columns.append(np.frombuffer(body, dtype=dtype, count=n, offset=offset))
+            offset += n * np.dtype(dtype).itemsize
+    except (struct.error, KeyError, TypeError, zlib.error) as e:
+        raise ValueError(f"Malformed edge message: {e}") from e
+    times = meta['t0'] + columns[0].astype(np.float64)
+    adc = np.cumsum(columns[1], dtype=np.int64).astype(np.float64) if meta['adc'] == 'delta16' \
+        else columns[1].astype(np.float64)
+    status = np.array([name.encode() for name in meta['status_names']], dtype=np.bytes_)[columns[4]]
+    return meta, (times, adc, columns[2].astype(np.float64), columns[3].astype(np.float64), status)
+
+
+class EdgeTrigger:
+    # Streaming candidate trigger over the band-passed ADC stream, per
+    # window of `window` samples every `step`: a window fires when its
+    # energy is `ratio` times the running average of the energy of recent
+    # quiet windows (over about lta_seconds), or its kurtosis is over
+    # `kurtosis`. Costs a filter pass and two moments per window.
+
+    def __init__(self, sample_rate, band=(20, 2000), window=64, step=16, ratio=2.5, kurtosis=5.0,
+                 lta_seconds=10.0, numtaps=101):
+        self.filter = StreamingFIR.bandpass(band[0], band[1], sample_rate, numtaps)
+        self.window = window
+        self.step = step
+        self.ratio = ratio
+        self.kurtosis = kurtosis
+        self.alpha = min(1.0, step / (lta_seconds * sample_rate))
+        self.lta = None
+        self._adc = np.empty(0)
+        self._time = np.empty(0)
+
+    def process(self, times, adc):
+        # End times of the windows completed by this batch that fire
+        self._adc = np.concatenate((self._adc, self.filter.process(adc)))
+        self._time = np.concatenate((self._time, times))
+        windows = sliding_windows(self._adc, self.window, self.step)
+        if not len(windows):
+            return self._time[:0]
+        ends = self._time[self.window - 1::self.step][:len(windows)]
+        consumed = len(windows) * self.step
+        self._adc = self._adc[consumed:]
+        self._time = self._time[consumed:]
+
+        centred = windows - windows.mean(axis=1, keepdims=True)
+        energy = np.mean(centred ** 2, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            kurtosis = np.mean(centred ** 4, axis=1) / energy ** 2
+        if self.lta is None:
+            self.lta = float(np.median(energy))
+        fired = (energy > self.ratio * self.lta) | (kurtosis > self.kurtosis)
+        # Exponential average over the quiet windows, in order
+        quiet = energy[~fired]
+        if len(quiet):
+            decay = (1 - self.alpha) ** np.arange(len(quiet) - 1, -1, -1)
+            self.lta = self.lta * (1 - self.alpha) ** len(quiet) + self.alpha * float(decay @ quiet)
+        return ends[fired]
+
+
+class EdgeForwarder:
+    # Ingest sink of an edge node; extend() has the SampleBuffer.extend
+    # signature. Runs the trigger over every batch and passes send() the
+    # encoded messages: a window from `pre` seconds before the first firing
+    # window to `post` seconds after the last one (firings closer than that
+    # share a window), and the summary buckets every summary_interval
+    # seconds of stream time. positions, if given, tags windows with where
+    # they start and end. Windows never repeat samples sent before; each is
+    # preceded by `context` samples (by default enough to warm up a filter
+    # of the trigger's length and fill one window) that the central node
+    # only uses to score from the window's first sample on.
+
+    def __init__(self, send, sample_rate, channel='default', run=None, band=(20, 2000), pre=PRE_SECONDS,
+                 post=POST_SECONDS, max_event=MAX_EVENT_SECONDS, summary_width=SUMMARY_WIDTH,
+                 summary_interval=SUMMARY_INTERVAL, positions=None, trigger=None, context=None):
+        self.send = send
+        self.channel = channel
+        self.run = run
+        self.pre = pre
+        self.post = post
+        self.max_event = max_event
+        self.summary_width = summary_width
+        self.summary_interval = summary_interval
+        self.positions = positions
+        self.trigger = trigger or EdgeTrigger(sample_rate, band)
+        if context is None:
+            context = len(self.trigger.filter.taps) - 1 + self.trigger.window - 1
+        self.context = context
+        self.sample_rate = sample_rate
+        self.rollups = Rollups((summary_width,), capacity=int(2 * summary_interval / summary_width) + 16)
+        self._history = deque()  # (index of first sample, columns) per batch
+        self._event = None  # [start, end] of the candidate being collected
+        self._sent_until = -np.inf  # time of the last sample sent in a window
+        self._summarized = None  # last summary bucket sent
+        self._next_summary = None
+        self._seq = 0
+
+        self.samples_in = 0
+        self.firings = 0
+        self.windows_sent = 0
+        self.samples_sent = 0
+        self.summaries_sent = 0
+        self.bytes_sent = 0
+
+    def extend(self, timestamp, adc, amplitude, frequency, status):
+        n = len(status)
+        if not n:
+            return
+        times = np.broadcast_to(np.asarray(timestamp, dtype=np.float64), n).copy()
+        columns = (times, np.asarray(adc, dtype=np.float64), np.asarray(amplitude, dtype=np.float64),
+                   np.asarray(frequency, dtype=np.float64), np.asarray(status))
+        self.rollups.extend(*columns)
+        self._history.append((self.samples_in, columns))
+        self.samples_in += n
+        now = times[-1]
+
+        fired = self.trigger.process(times, columns[1])
+        self.firings += len(fired)
+        for t in fired.tolist():
+            if self._event is not None and t - self.pre > self._event[1]:
+                self._emit(*self._event)
+                self._event = None
+            if self._event is None:
+                self._event = [t - self.pre, t + self.post]
+            else:
+                self._event[1] = t + self.post
+        if self._event is not None:
+            start, end = self._event
+            if now >= end:
+                self._emit(start, end)
+                self._event = None
+            elif now - start >= self.max_event:
+                self._emit(start, now)
+                self._event = [now, end]
+
+        # Raw samples are only kept as long as a window or its context may
+        # still need them
+        keep = now - self.pre if self._event is None else min(self._event[0], now - self.pre)
+        keep -= (self.context + 1) / self.sample_rate
+        while len(self._history) > 1 and self._history[0][1][0][-1] < keep:
+            self._history.popleft()
+
+        if self._next_summary is None:
+            self._next_summary = now + self.summary_interval
+        elif now >= self._next_summary:
+            self._next_summary = now + self.summary_interval
+            self._summarize(int(np.floor(now / self.summary_width)) - 1)
+
+    def flush(self):
+        # Send the candidate being collected and every bucket, the open one
+        # included; for when the stream ends
+        if not self._history:
+            return
+        now = self._history[-1][1][0][-1]
+        if self._event is not None:
+            self._emit(self._event[0], min(self._event[1], now))
+            self._event = None
+        self._summarize(int(np.floor(now / self.summary_width)))
+
+    def _meta(self):
+        self._seq += 1
+        return {'channel': self.channel, 'run': self.run, 'seq': self._seq}
+
+    def _emit(self, start, end):
+        first = self._history[0][0]
+        columns = [np.concatenate(column) for column in zip(*(batch for _, batch in self._history))]
+        times = columns[0]
+        inside = np.flatnonzero((times >= start) & (times <= end) & (times > self._sent_until))
+        if not len(inside):
+            return
+        lo = max(int(inside[0]) - self.context, 0)
+        meta = self._meta()
+        meta['index'] = first + lo
+        meta['context'] = int(inside[0]) - lo
+        if self.positions is not None:
+            meta['positions'] = [list(self.positions.at(t)) for t in (times[inside[0]], times[inside[-1]])]
+        self._sent_until = times[inside[-1]]
+        columns = [column[lo:inside[-1] + 1] for column in columns]
+        message = encode_window(meta, *columns)
+        self.windows_sent += 1
+        self.samples_sent += len(inside)
+        self.bytes_sent += len(message)
+        self.send(message)
+
+    def _summarize(self, last):
+        first = self._summarized + 1 if self._summarized is not None else last - self.rollups.capacity + 1
+        rows = self.rollups.buckets(0, first, last)
+        self._summarized = last
+        if not len(rows):
+            return
+        message = encode_summary(self._meta(), self.summary_width, rows)
+        self.summaries_sent += 1
+        self.bytes_sent += len(message)
+        self.send(message)
+
+    def stats(self):
+        return {
+            'samples_in': self.samples_in,
+            'firings': self.firings,
+            'windows_sent': self.windows_sent,
+            'samples_sent': self.samples_sent,
+            'summaries_sent': self.summaries_sent,
+            'bytes_sent': self.bytes_sent,
+        }
+
+
+class Uplink(threading.Thread):
+    # Posts edge messages to the central node from its own thread, so
+    # ingest never waits on the link. Messages that cannot be delivered
+    # (link down, more than max_bytes waiting) are spooled to spool_dir and
+    # resent oldest first once the central node answers again.
+
+    def __init__(self, url, spool_dir='edge-spool', max_bytes=16 << 20, retries=2, backoff=1.0,
+                 max_backoff=60.0, timeout=10.0):
+        super().__init__(name='edge-uplink', daemon=True)
+        self.url = url
+        self.spool_dir = spool_dir
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        os.makedirs(spool_dir, exist_ok=True)
+        self.outbox = BoundedQueue('uplink', max_bytes, DROP_NEWEST)
+        self.session = requests.Session()
+        self.session.headers['Content-Type'] = 'application/octet-stream'
+        self._stop_event = threading.Event()
+        self._down_until = 0.0
+        self._delay = backoff
+
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.messages_spooled = 0
+
+    def send(self, message):
+        if not self.outbox.put(message, len(message)):
+            self._spool(message)
+
+    def stop(self, timeout=10):
+        # Deliver what is queued, spool what is not delivered in time
+        self._stop_event.set()
+        self.join(timeout)
+        while True:
+            try:
+                self._spool(self.outbox.get(timeout=0))
+            except queue.Empty:
+                break
+        self.outbox.close()
+        self.session.close()
+
+    def run(self):
+        while True:
+            try:
+                message = self.outbox.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop_event.is_set():
+                    return
+                if time.monotonic() >= self._down_until:
+                    self._resend()
+                continue
+            if time.monotonic() < self._down_until or not self._deliver(message):
+                self._spool(message)
+
+    def _deliver(self, message):
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.post(self.url, data=message, timeout=self.timeout)
+                if response.ok:
+                    self.messages_sent += 1
+                    self.bytes_sent += len(message)
+                    self._delay = self.backoff
+                    return True
+                if response.status_code == 400:
+                    log.error("Central node rejected a message: %s", response.text[:200])
+                    return True
+            except requests.RequestException:
+                pass
+            if attempt < self.retries:
+                time.sleep(self.backoff)
+        # Down: back off, doubling while it stays down
+        self._down_until = time.monotonic() + self._delay
+        self._delay = min(self._delay * 2, self.max_backoff)
+        log.warning("Central node %s is not answering; spooling", self.url)
+        return False
+
+    def _spool(self, message):
+        path = os.path.join(self.spool_dir, f"{time.time_ns()}.msg")
+        with open(path + '.tmp', 'wb') as f:
+            f.write(message)
+        os.replace(path + '.tmp', path)
+        self.messages_spooled += 1
+
+    def spooled(self):
+        return sorted(name for name in os.listdir(self.spool_dir) if name.endswith('.msg'))
+
+    def _resend(self):
+        for name in self.spooled():
+            if len(self.outbox) or self._stop_event.is_set():
+                return
+            path = os.path.join(self.spool_dir, name)
+            with open(path, 'rb') as f:
+                message = f.read()
+            if not self._deliver(message):
+                return
+            os.remove(path)
+
+    def stats(self):
+        return {
+            'messages_sent': self.messages_sent,
+            'bytes_sent': self.bytes_sent,
+            'messages_spooled': self.messages_spooled,
+            'spooled': len(self.spooled()),
+            'outbox': self.outbox.depth,
+        }
+
+
+class WindowPosition:
+    # Position provider for the events of one window: interpolates between
+    # the positions the edge sent for its first and last sample
+
+    def __init__(self, first, last):
+        self.first = Position(*first)
+        self.last = Position(*last)
+
+    def at(self, timestamp):
+        a, b = self.first, self.last
+        f = 0.0 if b.time <= a.time else min(max((timestamp - a.time) / (b.time - a.time), 0.0), 1.0)
+        chainage = None if None in (a.chainage, b.chainage) else a.chainage + f * (b.chainage - a.chainage)
+        return Position(timestamp, a.lat + f * (b.lat - a.lat), a.lon + f * (b.lon - a.lon), a.track, chainage)
+
+
+class EdgeChannel(RemoteChannel):
+    # Central-side copy of an edge channel, filled by CentralReceiver
+
+    def __init__(self, name, samples, history=10000, positions=None, rollups=None, sample_rate=None):
+        super().__init__(name, samples, history, positions, rollups, sample_rate)
+        self.last_message = None
+        self.pending_marks = np.empty(0)
+
+    def is_alive(self):
+        return self.last_message is not None and time.monotonic() - self.last_message < EDGE_STALE
+
+
+class CentralReceiver:
+    # Central end of the edge link for the channels in `names`. buffers
+    # and rollups map channel names to the stores to fill (SampleBuffers and
+    # Rollups with CENTRAL_TIERS by default), index is the EventIndex for
+    # events and record_dir, if given, where received windows are recorded.
+    #
+    # Candidate windows are scored with the model and the live detector's
+    # code (anomaly_detector.score_windows) on the edge stream's step grid,
+    # the band-pass filter warmed up on the context samples the edge sends
+    # ahead of each window, so a window scores as it would have at the
+    # train. A window needs no model to be stored; without one it is only
+    # not scored.
+    # Summaries are merged into the rollup tiers; anomalies in buckets whose
+    # summary has not arrived yet are counted once it does. Messages seen
+    # before (a retry) are ignored.
+
+    def __init__(self, names, model=None, buffers=None, rollups=None, index=None, record_dir=None,
+                 sample_rate=5000, band=(20, 2000), step=16, numtaps=101, history=10000, notify=None):
+        buffers = buffers or {name: SampleBuffer(100000) for name in names}
+        rollups = rollups or {name: Rollups(CENTRAL_TIERS) for name in names}
+        self.channels = {name: EdgeChannel(name, buffers[name], history, rollups=rollups[name],
+                                           sample_rate=sample_rate)
+                         for name in names}
+        self.model = model
+        self.index = index
+        self.record_dir = record_dir
+        self.sample_rate = sample_rate
+        self.band = tuple(band)
+        self.step = step
+        self.numtaps = numtaps
+        self.notify = notify
+        self.lock = threading.Lock()
+        self.server = None
+        self._recorders = {}
+        self._seen = set()
+        self._seen_order = deque()
+        self._counts = {name: dict.fromkeys(('windows', 'summaries', 'bytes', 'windows_scored', 'anomalies',
+                                             'duplicates'), 0) for name in names}
+
+    def receive(self, message):
+        # Store one message; raises ValueError if it is malformed or for an
+        # unknown channel
+        meta, payload = decode(message)
+        channel = self.channels.get(meta.get('channel'))
+        if channel is None:
+            raise ValueError(f"Unknown edge channel {meta.get('channel')!r}")
+        with self.lock:
+            counts = self._counts[channel.name]
+            key = (channel.name, meta.get('run'), meta.get('seq'))
+            if key in self._seen:
+                counts['duplicates'] += 1
+                return
+            self._seen.add(key)
+            self._seen_order.append(key)
+            if len(self._seen_order) > 100000:
+                self._seen.discard(self._seen_order.popleft())
+            channel.last_message = time.monotonic()
+            counts['bytes'] += len(message)
+            if meta['kind'] == 'summary':
+                counts['summaries'] += 1
+                channel.rollups.merge(meta['width'], payload)
+                self._mark(channel, [])
+            else:
+                counts['windows'] += 1
+                self._window(channel, meta, payload)
+            channel._stats = dict(counts, threshold=self.model.threshold if self.model is not None else None)
+
+    def _window(self, channel, meta, columns):
+        # The leading context samples were sent before or fall outside the
+        # candidate; they only warm the filter up
+        context = meta.get('context', 0)
+        new = [column[context:] for column in columns]
+        channel.samples.extend(*new)
+        if self.record_dir is not None:
+            run = f"{meta.get('run') or 'edge'}-{channel.name}"
+            if run not in self._recorders:
+                self._recorders[run] = Recorder(self.record_dir, run=run)
+            self._recorders[run].extend(*new)
+        if self.model is None:
+            return
+        # Score the windows on the edge's step grid that end in the new
+        # samples and start after the filter warm-up
+        times, adc = columns[0], columns[1]
+        pipeline = FeaturePipeline(self.sample_rate, self.band, numtaps=self.numtaps)
+        filtered = pipeline.filter.process(adc)
+        window = self.model.window
+        skip = max(self.numtaps - 1, context - window + 1)
+        skip += -(meta.get('index', 0) + skip) % self.step
+        windows = sliding_windows(filtered[skip:], window, self.step)
+        if not len(windows):
+            return
+        ends = times[skip + window - 1::self.step][:len(windows)]
+        scores, flags, anomalies, features = score_windows(self.model, windows, ends, pipeline)
+        channel.scores.extend(map(WindowScore, ends.tolist(), scores.tolist(), flags.tolist()))
+        channel.latest = channel.scores[-1]
+        latest = extract_features(windows[-1:], pipeline.sample_rate, pipeline.bands)
+        channel.latest_features = {name: float(value[0]) for name, value in latest.items()}
+        channel.threshold = self.model.threshold
+        counts = self._counts[channel.name]
+        counts['windows_scored'] += len(scores)
+        counts['anomalies'] += len(anomalies)
+        if anomalies:
+            positions = WindowPosition(*meta['positions']) if meta.get('positions') else None
+            run = meta.get('run')
+            EventLogger(self.index, positions, channel.name, run and f'{run}-{channel.name}',
+                        self.notify)(anomalies, self.model.threshold, features)
+            self._mark(channel, [anomaly.time for anomaly in anomalies])
+
+    def _mark(self, channel, times):
+        # Count anomalies in the rollups, keeping those whose bucket has not
+        # arrived yet for the next summary
+        pending = np.concatenate((channel.pending_marks, times))[-100000:]
+        if len(pending):
+            pending = pending[~channel.rollups.mark(pending)]
+        channel.pending_marks = pending
+
+    def listen(self, host='0.0.0.0', port=8600):
+        # Accept messages POSTed to /edge in a server thread
+        self.server = ThreadingHTTPServer((host, port), _ReceiverHandler)
+        self.server.receiver = self
+        threading.Thread(target=self.server.serve_forever, name='edge-receiver', daemon=True).start()
+        log.info("Receiving edge channels %s on %s:%d", ', '.join(self.channels), host, self.server.server_port)
+        return self
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/edge'
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        with self.lock:
+            for recorder in self._recorders.values():
+                recorder.close()
+
+
+class _ReceiverHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != '/edge':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            self.server.receiver.receive(body)
+        except ValueError as e:
+            reply = str(e).encode()
+            self.send_response(400)
+            self.send_header('Content-Length', str(len(reply)))
+            self.end_headers()
+            self.wfile.write(reply)
+            return
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def run_edge(args):
+    # An edge node: ingest from the source, record locally if asked, and
+    # forward candidates and summaries
+    from acquisition import BANDPASS, SAMPLE_RATE
+    from recorder import run_name
+    from serial_ingest import SerialIngest
+    from sources import open_source
+
+    run = run_name(time.time())
+    source = open_source(args.source)
+    rate = getattr(source, 'sample_rate', None) or SAMPLE_RATE
+    uplink = Uplink(args.central, args.spool)
+    uplink.start()
+    positions = open_position(args.position) if args.position else None
+    forwarder = EdgeForwarder(uplink.send, rate, args.channel, run, BANDPASS, positions=positions)
+    recorder = Recorder(args.record_dir, run=run) if args.record_dir else None
+
+    def store_samples(*batch):
+        forwarder.extend(*batch)
+        if recorder is not None:
+            recorder.extend(*batch)
+
+    ingest = SerialIngest(source, store_samples, channel=args.channel, sample_rate=rate).open()
+    ingest.start()
+    try:
+        while ingest.is_alive():
+            ingest.join(SUMMARY_INTERVAL)
+            log.info("%s", dict(forwarder.stats(), **uplink.stats()))
+    except KeyboardInterrupt:
+        ingest.stop()
+        ingest.join()
+    forwarder.flush()
+    uplink.stop()
+    if recorder is not None:
+        recorder.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Edge node: forward candidate windows and summaries')
+    commands = parser.add_subparsers(dest='command', required=True)
+    edge = commands.add_parser('run', help='run an edge node')
+    edge.add_argument('--central', required=True, help='URL of the central node, e.g. http://central:8600/edge')
+    edge.add_argument('--source', default='synthetic:5000', help='see sources.open_source')
+    edge.add_argument('--channel', default='default', help='channel name at the central node')
+    edge.add_argument('--position', help='see positioning.open_position')
+    edge.add_argument('--record-dir', help='also record every sample on the edge node')
+    edge.add_argument('--spool', default='edge-spool', help='where undelivered messages wait')
+    args = parser.parse_args()
+    if args.command == 'run':
+        run_edge(args)
+
+
+if __name__ == '__main__':
+    main()
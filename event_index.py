@@ -0,0 +1,229 @@
+import argparse
+import json
+import math
+import sqlite3
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from positioning import EARTH_RADIUS
+
+
+# One detected anomaly. severity is the score over the detector threshold,
+# so 1.0 is just over the line; features is the feature snapshot of the
+# flagged window (see preprocessing.extract_features).
+Event = namedtuple('Event', ('id', 'time', 'run', 'channel', 'lat', 'lon', 'track', 'chainage',
+                             'score', 'severity', 'features'))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    run TEXT,
+    channel TEXT,
+    lat REAL,
+    lon REAL,
+    track TEXT,
+    chainage REAL,
+    score REAL NOT NULL,
+    severity REAL NOT NULL,
+    features TEXT
+);
+CREATE INDEX IF NOT EXISTS events_time ON events (time);
+CREATE INDEX IF NOT EXISTS events_track ON events (track, chainage);
+'''
+
+# Bounding boxes of positioned events, keyed by events.id. Where SQLite is
+# built without R*Tree support, events_position stands in for it.
+RTREE_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS events_rtree USING rtree (id, min_lat, max_lat, min_lon, max_lon);
+'''
+FALLBACK_SCHEMA = '''
+CREATE INDEX IF NOT EXISTS events_position ON events (lat, lon);
+'''
+
+_COLUMNS = 'id, time, run, channel, lat, lon, track, chainage, score, severity, features'
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    # Great-circle distance in metres; works on NumPy arrays
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class EventIndex:
+    # Anomaly events in SQLite, indexed for "events within X m of a point"
+    # (R*Tree on latitude and longitude, refined by great-circle distance)
+    # and "events on a stretch of track across runs" (B-tree on track and
+    # chainage). The database runs in WAL mode, so several acquisition
+    # processes can add events while dashboards query it.
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.executescript(SCHEMA)
+            try:
+                self.db.executescript(RTREE_SCHEMA)
+                self.rtree = True
+            except sqlite3.OperationalError:
+                self.db.executescript(FALLBACK_SCHEMA)
+                self.rtree = False
+
+    def add(self, rows):
+        # rows: (time, run, channel, lat, lon, track, chainage, score,
+        # severity, features dict) tuples, written in one transaction
+        rows = [row[:9] + (json.dumps(row[9]) if row[9] is not None else None,) for row in rows]
+        with self.lock, self.db:
+            # Take the write lock first, so the ids handed out here are ours
+            self.db.execute('BEGIN IMMEDIATE')
+            first = self.db.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM events').fetchone()[0]
+            ids = range(first, first + len(rows))
+            self.db.executemany(
+                'INSERT INTO events (id, time, run, channel, lat, lon, track, chainage, score, '
+                'severity, features) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(i,) + row for i, row in zip(ids, rows)])
+            if self.rtree:
+                self.db.executemany(
+                    'INSERT INTO events_rtree VALUES (?, ?, ?, ?, ?)',
+                    [(i, row[3], row[3], row[4], row[4]) for i, row in zip(ids, rows)
+                     if row[3] is not None and row[4] is not None])
+        return list(ids)
+
+    def _events(self, query, args):
+        with self.lock:
+            rows = self.db.execute(query, args).fetchall()
+        return [Event(*row[:10], json.loads(row[10]) if row[10] else None) for row in rows]
+
+    def near(self, lat, lon, radius, t0=None, t1=None):
+        # Events within `radius` metres of (lat, lon), nearest first
+        dlat = math.degrees(radius / EARTH_RADIUS)
+        dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        box = (lat - dlat, lat + dlat, lon - dlon, lon + dlon)
+        if self.rtree:
+            query = (f'SELECT {_COLUMNS} FROM events WHERE id IN (SELECT id FROM events_rtree '
+                     'WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?)')
+            args = [box[0], box[1], box[2], box[3]]
+        else:
+            query = f'SELECT {_COLUMNS} FROM events WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?'
+            args = list(box)
+        query, args = self._time_filter(query, args, t0, t1)
+        events = self._events(query, args)
+        if not events:
+            return []
+        distance = haversine(lat, lon, np.array([e.lat for e in events]),
+                             np.array([e.lon for e in events]))
+        order = np.argsort(distance)
+        return [events[i] for i in order if distance[i] <= radius]
+
+    def on_segment(self, track, start, end, t0=None, t1=None):
+        # Events with start <= chainage <= end on one track, in chainage order
+        query = f'SELECT {_COLUMNS} FROM events WHERE track = ? AND chainage BETWEEN ? AND ?'
+        query, args = self._time_filter(query, [track, start, end], t0, t1)
+        return self._events(query + ' ORDER BY chainage', args)
+
+    def repeats(self, track, bin_size=10.0, min_runs=2):
+        # Stretches of `bin_size` metres where events turned up in at least
+        # `min_runs` different runs: (start chainage, runs, events, worst
+        # severity), worst first
+        with self.lock:
+            return self.db.execute(
+                'SELECT CAST(chainage / ? AS INTEGER) * ? AS bin, COUNT(DISTINCT run), COUNT(*), '
+                'MAX(severity) FROM events WHERE track = ? AND chainage IS NOT NULL '
+                'GROUP BY bin HAVING COUNT(DISTINCT run) >= ? ORDER BY MAX(severity) DESC',
+                (bin_size, bin_size, track, min_runs)).fetchall()
+
+    @staticmethod
+    def _time_filter(query, args, t0, t1):
+        if t0 is not None:
+            query += ' AND time >= ?'
+            args.append(t0)
+        if t1 is not None:
+            query += ' AND time < ?'
+            args.append(t1)
+        return query, args
+
+    def remove(self, run, t0=None, t1=None):
+        # Delete a run's events, or those with t0 <= time < t1; returns how
+        # many were removed
+        query, args = self._time_filter('WHERE run = ?', [run], t0, t1)
+        with self.lock, self.db:
+            if self.rtree:
+                self.db.execute(f'DELETE FROM events_rtree WHERE id IN (SELECT id FROM events {query})', args)
+            return self.db.execute(f'DELETE FROM events {query}', args).rowcount
+
+    def count(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class EventLogger:
+    # AnomalyDetector on_anomaly callback that tags every flagged window
+    # with the position at its time, adds it to an EventIndex and hands the
+    # stored Events to notify (e.g. notifier.Notifier.submit)
+
+    def __init__(self, index, positions=None, channel=None, run=None, notify=None):
+        self.index = index
+        self.positions = positions
+        self.channel = channel
+        self.run = run
+        self.notify = notify
+
+    def __call__(self, anomalies, threshold, features):
+        rows = []
+        for i, anomaly in enumerate(anomalies):
+            position = self.positions.at(anomaly.time) if self.positions is not None else None
+            lat, lon, track, chainage = position[1:] if position is not None else (None,) * 4
+            snapshot = {name: float(values[i]) for name, values in features.items()} if features else None
+            rows.append((anomaly.time, self.run, self.channel, lat, lon, track, chainage,
+                         anomaly.score, anomaly.score / threshold, snapshot))
+        ids = self.index.add(rows) if self.index is not None else [None] * len(rows)
+        if self.notify is not None:
+            self.notify([Event(i, *row) for i, row in zip(ids, rows)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the crack event index')
+    parser.add_argument('--db', default='events.sqlite', help='event database')
+    commands = parser.add_subparsers(dest='command', required=True)
+    near = commands.add_parser('near', help='events within a radius of a point')
+    near.add_argument('lat', type=float)
+    near.add_argument('lon', type=float)
+    near.add_argument('--radius', type=float, default=50, help='metres')
+    segment = commands.add_parser('segment', help='events on a stretch of track')
+    segment.add_argument('track')
+    segment.add_argument('start', type=float, help='chainage in metres')
+    segment.add_argument('end', type=float, help='chainage in metres')
+    repeats = commands.add_parser('repeats', help='stretches with events in several runs')
+    repeats.add_argument('track')
+    repeats.add_argument('--bin', type=float, default=10, help='metres')
+    repeats.add_argument('--min-runs', type=int, default=2)
+    args = parser.parse_args()
+
+    index = EventIndex(args.db)
+    if args.command == 'repeats':
+        for start, runs, events, severity in index.repeats(args.track, args.bin, args.min_runs):
+            print(f"{args.track} {start:.0f}-{start + args.bin:.0f} m: {events} events in {runs} runs, "
+                  f"worst severity {severity:.2f}")
+        return
+    if args.command == 'near':
+        events = index.near(args.lat, args.lon, args.radius)
+    else:
+        events = index.on_segment(args.track, args.start, args.end)
+    for event in events:
+        print(f"{event.time:.3f} {event.run} {event.channel} ({event.lat}, {event.lon}) "
+              f"{event.track} {event.chainage} severity {event.severity:.2f}")
+
+
+if __name__ == '__main__':
+    main()
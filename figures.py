@@ -0,0 +1,116 @@
+import plotly.graph_objs as go
+
+
+# Enhanced graph layouts
+frequency_layout = {
+    'title': {
+        'text': 'Frequency Over Time',
+        'font': {'size': 24}
+    },
+    'xaxis': {
+        'title': 'Time (seconds)',
+        'showgrid': True,
+        'gridwidth': 1,
+        'gridcolor': 'lightgray',
+        'showline': True,
+        'zeroline': False,
+        'type': 'date'
+    },
+    'yaxis': {
+        'title': 'Frequency (Hz)',
+        'showgrid': True,
+        'gridwidth': 1,
+        'gridcolor': 'lightgray',
+        'showline': True,
+        'zeroline': True,
+        'zerolinecolor': 'gray',
+        'zerolinewidth': 2,
+        'autorange': True
+    },
+    'margin': {'l': 50, 'r': 50, 't': 50, 'b': 50},
+    'plot_bgcolor': '#f8f9fa',
+    'paper_bgcolor': '#ffffff',
+    'showlegend': True,
+    'hovermode': 'x unified'
+}
+
+amplitude_layout = {
+    'title': {
+        'text': 'Amplitude Over Time',
+        'font': {'size': 24}
+    },
+    'xaxis': {
+        'title': 'Time (seconds)',
+        'showgrid': True,
+        'gridwidth': 1,
+        'gridcolor': 'lightgray',
+        'showline': True,
+        'zeroline': False,
+        'type': 'date'
+    },
+    'yaxis': {
+        'title': 'Amplitude (V)',
+        'showgrid': True,
+        'gridwidth': 1,
+        'gridcolor': 'lightgray',
+        'showline': True,
+        'zeroline': True,
+        'zerolinecolor': 'gray',
+        'zerolinewidth': 2,
+        'autorange': True
+    },
+    'margin': {'l': 50, 'r': 50, 't': 50, 'b': 50},
+    'plot_bgcolor': '#f8f9fa',
+    'paper_bgcolor': '#ffffff',
+    'showlegend': True,
+    'hovermode': 'x unified'
+}
+
+
+def make_figures():
+    # Create initial figures with enhanced traces
+    fig_frequency = go.Figure(layout=frequency_layout)
+    fig_amplitude = go.Figure(layout=amplitude_layout)
+
+    # Add traces with different colors and names
+    fig_frequency.add_trace(go.Scatter(
+        x=[],
+        y=[],
+        mode='lines+markers',
+        name='Frequency',
+        line={
+            'width': 3,
+            'shape': 'spline',
+            'color': '#ee5253'
+        },
+        marker={
+            'size': 8,
+            'symbol': 'circle',
+            'color': '#ee5253'
+        },
+        connectgaps=True,
+        fill='tozeroy',
+        fillcolor='rgba(238, 82, 83, 0.2)'
+    ))
+
+    fig_amplitude.add_trace(go.Scatter(
+        x=[],
+        y=[],
+        mode='lines+markers',
+        name='Amplitude',
+        line={
+            'width': 3,
+            'shape': 'spline',
+            'color': '#2e86de'
+        },
+        marker={
+            'size': 8,
+            'symbol': 'circle',
+            'color': '#2e86de'
+        },
+        connectgaps=True,
+        fill='tozeroy',
+        fillcolor='rgba(46, 134, 222, 0.2)'
+    ))
+
+    return fig_frequency, fig_amplitude
@@ -0,0 +1,172 @@
+import binascii
+import struct
+
+import numpy as np
+
+from line_parser import parse_lines
+
+
+# Compact binary frame, little endian, 17 bytes:
+#   sync      2 bytes   0xA5 0x5A
+#   seq       uint16    increments by one per frame, wraps at 65536
+#   adc       uint16    raw ADC reading
+#   amplitude float32   volts
+#   frequency float32   hertz
+#   status    uint8     index into STATUS_NAMES
+#   crc       uint16    CRC-16/CCITT-FALSE over seq..status
+# The sync bytes are not valid ASCII, so frames can be told apart from the
+# text protocol on the same port.
+SYNC = b'\xa5\x5a'
+FRAME_FORMAT = '<2sHHffB'
+FRAME_SIZE = struct.calcsize(FRAME_FORMAT) + 2
+FRAME_DTYPE = np.dtype([
+    ('sync', 'S2'),
+    ('seq', '<u2'),
+    ('adc', '<u2'),
+    ('amplitude', '<f4'),
+    ('frequency', '<f4'),
+    ('status', 'u1'),
+    ('crc', '<u2'),
+])
+
+# Text lines longer than this without a newline are treated as line noise
+MAX_LINE_LENGTH = 256
+
+STATUS_NAMES = [b'N/A', b'Normal operation', b'Warning', b'Crack detected']
+STATUS_CODES = {name: code for code, name in enumerate(STATUS_NAMES)}
+_STATUS_LOOKUP = np.array(STATUS_NAMES + [b'Unknown'], dtype=np.bytes_)
+
+
+def crc16(data):
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode_frame(seq, adc_value, amplitude, frequency, status=0):
+    # Reference encoder, byte for byte what the Arduino sketch should send
+    body = struct.pack(FRAME_FORMAT, SYNC, seq & 0xFFFF, int(adc_value), amplitude, frequency, status)
+    return body + struct.pack('<H', crc16(body[2:]))
+
+
+def encode_frames(adc, amplitude, frequency, status=None, first_seq=0):
+    # Encode whole columns at once, e.g. to build a recorded test stream
+    n = len(adc)
+    frames = np.zeros(n, dtype=FRAME_DTYPE)
+    frames['sync'] = SYNC
+    frames['seq'] = (first_seq + np.arange(n)) & 0xFFFF
+    frames['adc'] = adc
+    frames['amplitude'] = amplitude
+    frames['frequency'] = frequency
+    frames['status'] = 0 if status is None else status
+    raw = frames.tobytes()
+    frames['crc'] = [crc16(raw[i + 2:i + FRAME_SIZE - 2]) for i in range(0, len(raw), FRAME_SIZE)]
+    return frames.tobytes()
+
+
+class StreamDecoder:
+    # Incremental decoder for a byte stream carrying text lines, binary frames
+    # or a mix of both. feed() returns the columns of parse_lines, minus the
+    # line count, plus the frame sequence numbers: (adc, amplitude, frequency,
+    # status, micros, seq), with -1 for the device counters a record lacks.
+    # frames_lost counts gaps in the sequence numbers, so it includes frames
+    # that arrived but failed the CRC check.
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._last_seq = None
+
+        self.lines_received = 0
+        self.lines_dropped = 0
+        self.frames_received = 0
+        self.frames_corrupt = 0
+        self.frames_lost = 0
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        pieces = []
+        while self._buffer:
+            start = self._buffer.find(SYNC)
+            if start < 0:
+                self._take_text(len(self._buffer), pieces)
+                break
+            if start > 0:
+                self._take_text(start, pieces, flush=True)
+                continue
+            if not self._take_frames(pieces):
+                break
+
+        if not pieces:
+            return parse_lines(b'')[:5] + (np.empty(0, dtype=np.int64),)
+        if len(pieces) == 1:
+            return pieces[0]
+        return tuple(np.concatenate(column) for column in zip(*pieces))
+
+    def _take_text(self, end, pieces, flush=False):
+        # Parse complete lines in buffer[:end]. With flush, a binary frame
+        # follows, so a trailing partial line can never be completed.
+        text = self._buffer[:end]
+        stop = text.rfind(b'\n') + 1
+        if flush:
+            # Non-ASCII leftovers are the tail of a corrupt frame, not a line
+            if text[stop:].strip() and text[stop:].isascii():
+                self.lines_dropped += 1
+            stop = end
+        elif end - stop > MAX_LINE_LENGTH:
+            self.lines_dropped += 1
+            stop = end
+        if not stop:
+            return
+
+        adc, amplitude, frequency, status, micros, lines = parse_lines(bytes(text[:stop]))
+        del self._buffer[:stop]
+        self.lines_received += lines
+        # Two records glued on one line make up for a malformed line in the
+        # same chunk; the count never goes backwards
+        self.lines_dropped += max(lines - len(adc), 0)
+        if len(adc):
+            pieces.append((adc, amplitude, frequency, status, micros, np.full(len(adc), -1, dtype=np.int64)))
+
+    def _take_frames(self, pieces):
+        # Decode the run of back-to-back frames at the start of the buffer.
+        # Returns False when more bytes are needed.
+        count = len(self._buffer) // FRAME_SIZE
+        if not count:
+            return False
+        frames = np.frombuffer(bytes(self._buffer[:count * FRAME_SIZE]), dtype=FRAME_DTYPE)
+        misaligned = np.flatnonzero(frames['sync'] != SYNC)
+        if len(misaligned):
+            count = int(misaligned[0])
+            frames = frames[:count]
+
+        raw = frames.tobytes()
+        crc = np.array([crc16(raw[i + 2:i + FRAME_SIZE - 2]) for i in range(0, len(raw), FRAME_SIZE)],
+                       dtype=np.uint16)
+        valid = crc == frames['crc']
+        if count and not valid[0]:
+            # Corrupt frame or a false sync match; resync one byte further on
+            self.frames_corrupt += 1
+            del self._buffer[:1]
+            return True
+        if not valid.all():
+            count = int(np.argmin(valid))
+            frames = frames[:count]
+        del self._buffer[:count * FRAME_SIZE]
+
+        self.frames_received += count
+        self._count_lost(frames['seq'])
+        pieces.append((
+            frames['adc'].astype(np.float64),
+            frames['amplitude'].astype(np.float64),
+            frames['frequency'].astype(np.float64),
+            _STATUS_LOOKUP[np.minimum(frames['status'], len(STATUS_NAMES))],
+            np.full(count, -1, dtype=np.int64),
+            frames['seq'].astype(np.int64),
+        ))
+        return True
+
+    def _count_lost(self, seq):
+        seq = seq.astype(np.int64)
+        if self._last_seq is not None:
+            seq = np.concatenate(([self._last_seq], seq))
+        gaps = (np.diff(seq) - 1) % 65536
+        self.frames_lost += int(gaps.sum())
+        self._last_seq = int(seq[-1])
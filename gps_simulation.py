@@ -1,311 +1,565 @@
-import serial
+import argparse
+import atexit
+import json
 import time
-import dash
-from dash import dcc, html
-import plotly.graph_objs as go
-from dash.dependencies import Input, Output
-from collections import deque
 import numpy as np
-import requests
-import geocoder
-
-
-
-
-# Set up serial communication
-arduino_port = 'COM6'  # Replace with your Arduino COM port
-baud_rate = 9600
-
-# Initialize serial connection
-ser = serial.Serial(arduino_port, baud_rate, timeout=1)
-
-# Create a Dash app
-app = dash.Dash(__name__)
-
-# Create fixed-length deques for data storage
-MAX_POINTS = 1000
-time_data = deque(maxlen=MAX_POINTS)
-amplitude_data = deque(maxlen=MAX_POINTS)
-frequency_data = deque(maxlen=MAX_POINTS)
-coordinates_data = deque(maxlen=MAX_POINTS)
-adc_data = deque(maxlen=MAX_POINTS)
-
-# Initialize with some empty data
-initial_time = time.time()
-for i in range(MAX_POINTS):
-    time_data.append(initial_time - (MAX_POINTS - i) * 0.1)
-    amplitude_data.append(None)
-    frequency_data.append(None)
-    coordinates_data.append(None)
-    adc_data.append(None)
-
-# Enhanced graph layouts
-frequency_layout = {
-    'title': {
-        'text': 'Frequency Over Time',
-        'font': {'size': 24}
-    },
-    'xaxis': {
-        'title': 'Time (seconds)',
-        'showgrid': True,
-        'gridwidth': 1,
-        'gridcolor': 'lightgray',
-        'showline': True,
-        'zeroline': False,
-        'type': 'date'
-    },
-    'yaxis': {
-        'title': 'Frequency (Hz)',
-        'showgrid': True,
-        'gridwidth': 1,
-        'gridcolor': 'lightgray',
-        'showline': True,
-        'zeroline': True,
-        'zerolinecolor': 'gray',
-        'zerolinewidth': 2,
-        'autorange': True
-    },
-    'margin': {'l': 50, 'r': 50, 't': 50, 'b': 50},
-    'plot_bgcolor': '#f8f9fa',
-    'paper_bgcolor': '#ffffff',
-    'showlegend': True,
-    'hovermode': 'x unified'
-}
-
-amplitude_layout = {
-    'title': {
-        'text': 'Amplitude Over Time',
-        'font': {'size': 24}
-    },
-    'xaxis': {
-        'title': 'Time (seconds)',
-        'showgrid': True,
-        'gridwidth': 1,
-        'gridcolor': 'lightgray',
-        'showline': True,
-        'zeroline': False,
-        'type': 'date'
-    },
-    'yaxis': {
-        'title': 'Amplitude (V)',
-        'showgrid': True,
-        'gridwidth': 1,
-        'gridcolor': 'lightgray',
-        'showline': True,
-        'zeroline': True,
-        'zerolinecolor': 'gray',
-        'zerolinewidth': 2,
-        'autorange': True
-    },
-    'margin': {'l': 50, 'r': 50, 't': 50, 'b': 50},
-    'plot_bgcolor': '#f8f9fa',
-    'paper_bgcolor': '#ffffff',
-    'showlegend': True,
-    'hovermode': 'x unified'
-}
-
-# Create initial figures with enhanced traces
-fig_frequency = go.Figure(layout=frequency_layout)
-fig_amplitude = go.Figure(layout=amplitude_layout)
-
-# Add traces with different colors and names
-fig_frequency.add_trace(go.Scatter(
-    x=list(time_data),
-    y=list(frequency_data),
-    mode='lines+markers',
-    name='Frequency',
-    line={
-        'width': 3,
-        'shape': 'spline',
-        'color': '#ee5253'
-    },
-    marker={
-        'size': 8,
-        'symbol': 'circle',
-        'color': '#ee5253'
-    },
-    connectgaps=True,
-    fill='tozeroy',
-    fillcolor='rgba(238, 82, 83, 0.2)'
-))
-
-fig_amplitude.add_trace(go.Scatter(
-    x=list(time_data),
-    y=list(amplitude_data),
-    mode='lines+markers',
-    name='Amplitude',
-    line={
-        'width': 3,
-        'shape': 'spline',
-        'color': '#2e86de'
-    },
-    marker={
-        'size': 8,
-        'symbol': 'circle',
-        'color': '#2e86de'
-    },
-    connectgaps=True,
-    fill='tozeroy',
-    fillcolor='rgba(46, 134, 222, 0.2)'
-))
-
-# Layout of the Dash app with side panel
-app.layout = html.Div([
-    html.H2('Real-Time Sensor Data Visualization', 
-            style={'textAlign': 'center', 'color': '#2c3e50', 'padding': '20px'}),
+
+from acquisition import BUS_PREFIX, SAMPLE_RATE, Acquisition, serve
+from decimation import LiveMinMax, decimate
+from metrics import REGISTRY, render
+from multichannel import aligned
+from rollups import envelope
+from sample_bus import attach_channels, published_metrics
+from spectrogram import Waterfall
+
+
+# Nothing is connected, drawn or imported from Dash and plotly until
+# create_app() runs, so tooling and headless runs (--headless) can import
+# this module cheaply. The WSGI entry point builds the app on first use:
+#   gunicorn -w 4 gps_simulation:server
+
+# Charts are decimated to TARGET_WIDTH pixel buckets over the visible window,
+# so the point count stays bounded however long the window is
+TARGET_WIDTH = 1000
+DECIMATION = 'minmax'  # or 'lttb'
+TIME_WINDOWS = {'15 s': 15, '1 min': 60, '10 min': 600, '1 h': 3600, '6 h': 21600}
+
+# Ranges older than the sample buffer are drawn from the channel's rollup
+# tiers (see rollups), at the finest tier that fits TARGET_WIDTH buckets;
+# the browser asks /history for the range whenever the user zooms or pans.
+# Buckets with anomalies are shaded.
+ANOMALY_SHADE = 'rgba(231, 76, 60, 0.25)'
+
+# Live updates are pushed to the browser over Server-Sent Events. New
+# samples are pushed as they arrive, at most once per PUSH_INTERVAL; the
+# side panel is checked every STATUS_INTERVAL seconds and sent if changed.
+PUSH_INTERVAL = 0.02
+STATUS_INTERVAL = 1.0
+
+# Below the charts, a rolling spectrogram of every channel's ADC stream (see
+# spectrogram). Its new columns are computed and pushed as PNG strips every
+# SPECTROGRAM_INTERVAL seconds, and scrolled into one canvas per channel.
+SPECTROGRAM_INTERVAL = 0.1
+SPECTROGRAM_HEIGHT = '150px'
+
+# Time spent building chart updates: full redraws and pushed sample batches
+REDRAW_SECONDS = REGISTRY.histogram('tejas_render_seconds', 'Time to build a chart update', stage='redraw')
+PUSH_SECONDS = REGISTRY.histogram('tejas_render_seconds', 'Time to build a chart update', stage='push')
+SPECTROGRAM_SECONDS = REGISTRY.histogram('tejas_render_seconds', 'Time to build a chart update',
+                                         stage='spectrogram')
+OPEN_STREAMS = REGISTRY.gauge('tejas_open_streams', 'Server-Sent Events streams open in this process')
+# A browser that reads its stream slower than samples arrive skips the
+# samples overwritten in the buffer meanwhile (see backpressure)
+STREAM_SHED = REGISTRY.counter('tejas_queue_shed_samples_total', 'Samples shed by a full stage queue',
+                               queue='stream')
+
+# The acquisition running in this process, if there is no daemon
+acquisition = None
+
+# Channels shown by the app, by name, and their spectrograms; set by
+# create_app()
+channels = {}
+waterfall = None
+
+_app = None
+
+
+def connect():
+    # Attach read-only to the acquisition daemon (python acquisition.py), so
+    # any number of dashboard workers can share one serial port. Without a
+    # daemon, or when the one that left its shared memory behind has died,
+    # acquire in this process and publish for other workers.
+    global acquisition
+    try:
+        return attach_channels(BUS_PREFIX)
+    except FileNotFoundError:
+        pass
+    try:
+        acquisition = Acquisition(BUS_PREFIX).start()
+    except FileExistsError:
+        # Another worker started acquiring first
+        acquisition = None
+        return attach_channels(BUS_PREFIX)
+    atexit.register(acquisition.stop)
+    return acquisition.channels
+
+
+def spectrogram_id(index):
+    return f'spectrogram-{index}'
+
+
+def spectrogram_panel(spectrograms):
+    # One canvas per channel, a pixel per STFT column and frequency bin
+    from dash import html
+    rows = []
+    for index, (name, size) in enumerate(spectrograms.items()):
+        rows.append(html.Div(f"{name}: 0-{size['max_freq']:.0f} Hz, last {size['seconds']:.0f} s",
+                             style={'color': '#2c3e50', 'margin': '10px 0 4px'}))
+        rows.append(html.Canvas(id=spectrogram_id(index), width=size['columns'], height=size['bins'],
+                                style={'width': '100%', 'height': SPECTROGRAM_HEIGHT,
+                                       'imageRendering': 'pixelated', 'backgroundColor': '#440154'}))
+    return html.Div([html.H4('Spectrogram', style={'color': '#2c3e50', 'margin': '10px 0'})] + rows)
+
+
+def make_layout(channels, fig_frequency, fig_amplitude, spectrograms=None):
+    # Layout of the Dash app with side panel
+    from dash import dcc, html
+    return html.Div([
+        html.H2('Real-Time Sensor Data Visualization', 
+                style={'textAlign': 'center', 'color': '#2c3e50', 'padding': '20px'}),
     
-    # Main container with flexbox
-    html.Div([
-        # Graphs container
+        # Main container with flexbox
         html.Div([
-            dcc.Graph(id='frequency-graph', 
-                     figure=fig_frequency,
-                     style={'height': '400px'}),
-            dcc.Graph(id='amplitude-graph', 
-                     figure=fig_amplitude,
-                     style={'height': '400px'}),
-        ], style={'width': '75%', 'display': 'inline-block', 'vertical-align': 'top'}),
+            # Graphs container
+            html.Div([
+                html.Div([
+                    dcc.Dropdown(id='channel',
+                                 options=[{'label': name, 'value': name} for name in channels],
+                                 value=next(iter(channels), None),
+                                 clearable=False,
+                                 style={'width': '200px'}),
+                    dcc.Dropdown(id='time-window',
+                                 options=[{'label': label, 'value': seconds}
+                                          for label, seconds in TIME_WINDOWS.items()],
+                                 value=15,
+                                 clearable=False,
+                                 style={'width': '150px'}),
+                ], style={'display': 'flex', 'gap': '10px'}),
+                dcc.Graph(id='frequency-graph', 
+                         figure=fig_frequency,
+                         style={'height': '400px'}),
+                dcc.Graph(id='amplitude-graph', 
+                         figure=fig_amplitude,
+                         style={'height': '400px'}),
+                spectrogram_panel(spectrograms or {}),
+            ], style={'width': '75%', 'display': 'inline-block', 'vertical-align': 'top'}),
         
-        # Side panel
-        html.Div([
+            # Side panel
             html.Div([
-                html.H3('Real-Time Values', style={'textAlign': 'center', 'color': '#2c3e50'}),
-                
-                # Current Values Display
                 html.Div([
+                    html.H3('Real-Time Values', style={'textAlign': 'center', 'color': '#2c3e50'}),
+                
+                    # Current Values Display
                     html.Div([
-                        html.H4('ADC Value:', style={'color': '#2c3e50', 'margin': '10px 0'}),
-                        html.Div(id='adc-value', style={'fontSize': '24px', 'color': '#27ae60'})
-                    ]),
-                    html.Div([
-                        html.H4('Frequency:', style={'color': '#2c3e50', 'margin': '10px 0'}),
-                        html.Div(id='frequency-value', style={'fontSize': '24px', 'color': '#ee5253'})
-                    ]),
-                    html.Div([
-                        html.H4('Amplitude:', style={'color': '#2c3e50', 'margin': '10px 0'}),
-                        html.Div(id='amplitude-value', style={'fontSize': '24px', 'color': '#2e86de'})
-                    ]),
-                    html.Hr(),
-                    html.H4('Operation Status:', style={'color': '#2c3e50', 'margin': '10px 0'}),
-                    html.Div(id='status-display', style={'fontSize': '18px', 'color': '#2c3e50'}),
-                    html.Hr(),
-                    html.H4('Coordinates:', style={'color': '#2c3e50', 'margin': '10px 0'}),
-                    html.Div(id='coordinates-display', style={'fontSize': '18px', 'color': '#2c3e50'})
-                ], style={'padding': '20px', 'backgroundColor': '#f8f9fa', 'borderRadius': '10px'})
-            ], style={'position': 'fixed', 'width': '23%'})
-        ], style={'width': '25%', 'display': 'inline-block', 'vertical-align': 'top'}),
-    ]),
-    
-    dcc.Interval(
-        id='interval-component',
-        interval=100,
-        n_intervals=0
-    )
-])
-
-@app.callback(
-    [Output('frequency-graph', 'figure'),
-     Output('amplitude-graph', 'figure'),
-     Output('status-display', 'children'),
-     Output('coordinates-display', 'children'),
-     Output('adc-value', 'children'),
-     Output('frequency-value', 'children'),
-     Output('amplitude-value', 'children')],
-    [Input('interval-component', 'n_intervals')]
-)
-def update_graph(n_intervals):
-    global fig_frequency, fig_amplitude, time_data, amplitude_data, frequency_data, coordinates_data, adc_data
+                        html.Div([
+                            html.H4('ADC Value:', style={'color': '#2c3e50', 'margin': '10px 0'}),
+                            html.Div(id='adc-value', style={'fontSize': '24px', 'color': '#27ae60'})
+                        ]),
+                        html.Div([
+                            html.H4('Frequency:', style={'color': '#2c3e50', 'margin': '10px 0'}),
+                            html.Div(id='frequency-value', style={'fontSize': '24px', 'color': '#ee5253'})
+                        ]),
+                        html.Div([
+                            html.H4('Amplitude:', style={'color': '#2c3e50', 'margin': '10px 0'}),
+                            html.Div(id='amplitude-value', style={'fontSize': '24px', 'color': '#2e86de'})
+                        ]),
+                        html.Hr(),
+                        html.H4('Operation Status:', style={'color': '#2c3e50', 'margin': '10px 0'}),
+                        html.Div(id='status-display', style={'fontSize': '18px', 'color': '#2c3e50'}),
+                        html.Hr(),
+                        html.H4('Coordinates:', style={'color': '#2c3e50', 'margin': '10px 0'}),
+                        html.Div(id='coordinates-display', style={'fontSize': '18px', 'color': '#2c3e50'}),
+                        html.Hr(),
+                        html.H4('Anomaly Score:', style={'color': '#2c3e50', 'margin': '10px 0'}),
+                        html.Div(id='anomaly-display', style={'fontSize': '18px', 'color': '#2c3e50'}),
+                        html.Hr(),
+                        html.H4('Features:', style={'color': '#2c3e50', 'margin': '10px 0'}),
+                        html.Div(id='features-display', style={'fontSize': '14px', 'color': '#2c3e50'}),
+                        html.Hr(),
+                        html.H4('Ingest:', style={'color': '#2c3e50', 'margin': '10px 0'}),
+                        html.Div(id='ingest-display', style={'fontSize': '14px', 'color': '#2c3e50'})
+                    ], style={'padding': '20px', 'backgroundColor': '#f8f9fa', 'borderRadius': '10px'})
+                ], style={'position': 'fixed', 'width': '23%'})
+            ], style={'width': '25%', 'display': 'inline-block', 'vertical-align': 'top'}),
+        ]),
     
+        # What the last redraw covered; the live stream continues from there
+        dcc.Store(id='render-cursor', data=None),
+        dcc.Store(id='stream-state', data=None)
+    ])
+
+
+def time_window_patch(current_time, time_window=15):
+    # Only the x-axis range changes between ticks, the rest of the layout stays
+    from dash import Patch
+    patch = Patch()
+    patch['layout']['xaxis']['range'] = [current_time - time_window, current_time]
+    return patch
+
+
+def redraw_patch(trace, current_time, time_window, shapes=None):
+    # Replace the whole trace with the view of the visible window
+    x, y = trace
+    patch = time_window_patch(current_time, time_window)
+    patch['data'][0]['x'] = x.tolist()
+    patch['data'][0]['y'] = y.tolist()
+    if shapes is not None:
+        patch['layout']['shapes'] = shapes
+    return patch
+
+
+def view(channel, start, end, window=None):
+    # What to draw between start and end: the buffered samples decimated to
+    # TARGET_WIDTH if they reach back to start, otherwise the rollup tier
+    # that fits. window is the buffer contents if the caller has them.
+    # Returns {column: (x, y)} for frequency and amplitude, the bucket width
+    # (0 for samples) and the (start, end, count) of buckets with anomalies.
+    rollups = getattr(channel, 'rollups', None)
+    if window is None:
+        window = channel.samples.last()
+    traces = {}
+    marked = rollups.query(start, end, TARGET_WIDTH) if rollups is not None else None
+    if marked is None or (len(window.time) and window.time[0] <= start):
+        first = np.searchsorted(window.time, start)
+        last = np.searchsorted(window.time, end, side='right')
+        for column in ('frequency', 'amplitude'):
+            traces[column] = decimate(window.time[first:last], getattr(window, column)[first:last],
+                                      TARGET_WIDTH, method=DECIMATION, x_range=(start, end))
+        width = 0.0
+    else:
+        for column in ('frequency', 'amplitude'):
+            traces[column] = envelope(marked, column)
+        width = marked.width
+    anomalies = []
+    if marked is not None:
+        hit = marked.anomalies > 0
+        anomalies = [[t, t + marked.width, int(n)] for t, n in zip(marked.time[hit], marked.anomalies[hit])]
+    return traces, width, anomalies
+
+
+def anomaly_shapes(anomalies):
+    return [{'type': 'rect', 'xref': 'x', 'yref': 'paper', 'x0': t0, 'x1': t1, 'y0': 0, 'y1': 1,
+             'fillcolor': ANOMALY_SHADE, 'line': {'width': 0}, 'layer': 'below'}
+            for t0, t1, _ in anomalies]
+
+
+def anomaly_display(channel):
+    # Latest window score from the channel's detector, red when over threshold
+    style = {'fontSize': '18px', 'color': '#2c3e50'}
+    if channel.threshold is None:
+        return "Calibrating...", style
+    if channel.latest is None:
+        return "Waiting...", style
+    if channel.latest.anomaly:
+        style['color'] = '#e74c3c'
+    return f"{channel.latest.score:.3f} (threshold {channel.threshold:.3f})", style
+
+
+def features_display(channel):
+    # Features of the newest scored window
+    features = channel.latest_features
+    if features is None:
+        return "Waiting..."
+    return (f"RMS {features['rms']:.2f}, kurtosis {features['kurtosis']:.2f}, "
+            f"crest {features['crest_factor']:.2f}, centroid {features['spectral_centroid']:.0f} Hz")
+
+
+def coordinates_display(channel):
+    # Where the train is now, and how far along the track when known
+    position = channel.position
+    if position is None:
+        return "Waiting for coordinates..."
+    text = f"{position.lat:.5f}, {position.lon:.5f}"
+    if position.track is not None and position.chainage is not None:
+        text += f" ({position.track} km {position.chainage / 1000:.3f})"
+    return text
+
+
+def ingest_display(channel):
+    stats = channel.stats()
+    text = (f"{stats.get('samples_per_second', 0):.0f} samples/s, "
+            f"{stats.get('lines_dropped', 0)} dropped")
+    # How far the slowest stage is behind, and what views have shed
+    queues = stats.get('queues', {}).values()
+    backlog = max((q['depth'] / q['capacity'] for q in queues if q.get('capacity')), default=0)
+    shed = sum(q.get('shed', 0) for q in queues)
+    if backlog >= 0.01:
+        text += f", {backlog:.0%} backlog"
+    if shed:
+        text += f", {shed} shed"
+    stalled = [name for name, q in stats.get('queues', {}).items() if q.get('stalled')]
+    if stalled:
+        text += f", {' and '.join(stalled)} stalled"
+    if stats.get('degraded'):
+        text += " (overloaded)"
+    return text
+
+
+def sse(event, data, event_id=None):
+    # One Server-Sent Events message
+    message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    if event_id is not None:
+        message = f"id: {event_id}\n" + message
+    return message
+
+
+def stream_events(channel, cursor, time_window, waterfall=None):
+    # New samples, reduced to the extremes of each pixel bucket, as soon as
+    # they land in the buffer; anomaly events as the detector flags them;
+    # new spectrogram columns of every channel in waterfall, the first time
+    # the whole of them; the slower side-panel values when they change,
+    # checked once per STATUS_INTERVAL. Between pushes the stream sleeps on
+    # the buffer (SampleBuffer.wait), so an idle stream only wakes for those
+    # checks and does no spectrogram work while no samples arrive.
+    samples = channel.samples
+    # Each push is folded into the last bucket drawn (see LiveMinMax), so
+    # the traces keep two points per bucket across the whole window
+    traces = {name: LiveMinMax(time_window / TARGET_WIDTH) for name in ('frequency', 'amplitude')}
+    yield sse('config', {'max_points': 2 * (TARGET_WIDTH + 1), 'window': time_window})
+    anomalies = channel.stats().get('anomalies', 0)
+    next_status = 0
+    status = None
+    next_spectrogram = 0
+    spectrogram_cursors = {}
+    spectrogram_counts = None
+    names = waterfall.spectrograms if waterfall is not None else ()
+    ids = {name: spectrogram_id(index) for index, name in enumerate(names)}
+    # Other channels' samples do not wake this stream
+    idle_wait = SPECTROGRAM_INTERVAL if len(names) > 1 else STATUS_INTERVAL
+    last_beat = time.monotonic()
+    OPEN_STREAMS.inc()
     try:
-        if ser.in_waiting > 0:
-            line = ser.readline().decode('utf-8').strip()
-            print(f"Received data: {line}")
+        while True:
+            pushed = samples.wait(cursor, max(0.0, min(next_status - time.monotonic(), idle_wait))) != cursor
+            if pushed:
+                with PUSH_SECONDS.time():
+                    new, count = samples.since(cursor)
+                    if cursor:
+                        STREAM_SHED.inc(max(count - cursor - len(new.time), 0))
+                    cursor = count
+                    message = None
+                    if len(new.time):
+                        latest = samples.latest()
+                        update = {'replace': {}, 'open': {}}
+                        for name, trace in traces.items():
+                            replace, x, y = trace.extend(new.time, getattr(new, name))
+                            update[name] = [x.tolist(), y.tolist()]
+                            update['replace'][name] = replace
+                            update['open'][name] = trace.open
+                        message = sse('samples', dict(update, **{
+                            'time': latest.time,
+                            'values': {
+                                'status-display': f"Status: {latest.status}",
+                                'adc-value': f"{latest.adc:.2f}",
+                                'frequency-value': f"{latest.frequency:.2f} Hz",
+                                'amplitude-value': f"{latest.amplitude:.2f} V",
+                            },
+                        }), event_id=cursor)
+                if message is not None:
+                    yield message
+                    last_beat = time.monotonic()
 
-            if 'ADC Value' in line and 'Amplitude' in line and 'Frequency' in line:
-                # Split by '|' and clean up each part
-                parts = [part.strip() for part in line.split('|')]
-                
-                try:
-                    # Parse ADC value
-                    adc_value = float(parts[0].split(':')[1].strip().split()[0])
-                    
-                    # Parse Amplitude
-                    amplitude = float(parts[1].split(':')[1].strip().split('V')[0])
-                    
-                    # Parse Frequency
-                    frequency = float(parts[2].split(':')[1].strip().split('Hz')[0])
-                    
-                    # Get operation status and coordinates
-                    status = parts[3].strip() if len(parts) > 3 else "N/A"
-                    
-                    # Update deques
-                    current_time = time.time()
-                    time_data.append(current_time)
-                    amplitude_data.append(amplitude)
-                    frequency_data.append(frequency)
-                    coordinates_data.append(status)
-                    adc_data.append(adc_value)
-
-                    # Update plots
-                    fig_frequency.data[0].update(x=list(time_data), y=list(frequency_data))
-                    fig_amplitude.data[0].update(x=list(time_data), y=list(amplitude_data))
-
-                    # Update time window
-                    time_window = 15
-                    xaxis_range = [current_time - time_window, current_time]
-                    
-                    # Update layouts
-                    fig_frequency.update_layout(xaxis_range=xaxis_range)
-                    fig_amplitude.update_layout(xaxis_range=xaxis_range)
-
-                    # Return current values
-                    return (
-                        fig_frequency,
-                        fig_amplitude,
-                        f"Status: {status}",
-                        f"Operation Mode: {status}",
-                        f"{adc_value:.2f}",
-                        f"{frequency:.2f} Hz",
-                        f"{amplitude:.2f} V"
-                    )
-
-                except (IndexError, ValueError) as e:
-                    print(f"Data parsing error: {e}")
-                    # Return last known good values for graphs but error messages for text
-                    return (
-                        fig_frequency,
-                        fig_amplitude,
-                        "Error parsing data",
-                        "Error in data",
-                        str(adc_data[-1]) if adc_data else "Error",
-                        str(frequency_data[-1]) if frequency_data else "Error",
-                        str(amplitude_data[-1]) if amplitude_data else "Error"
-                    )
-
-    except Exception as e:
-        print(f"Error in update_graph: {e}")
-        # Return last known good values
-        return (
-            fig_frequency,
-            fig_amplitude,
-            "Error reading data",
-            "Communication error",
-            str(adc_data[-1]) if adc_data else "Error",
-            str(frequency_data[-1]) if frequency_data else "Error",
-            str(amplitude_data[-1]) if amplitude_data else "Error"
-        )
-
-    # Return last known good values when no new data
+            now = time.monotonic()
+            counts = None
+            if waterfall is not None:
+                counts = [spectrogram.samples.count for spectrogram in waterfall.spectrograms.values()]
+            if counts != spectrogram_counts and now >= next_spectrogram:
+                next_spectrogram = now + SPECTROGRAM_INTERVAL
+                spectrogram_counts = counts
+                with SPECTROGRAM_SECONDS.time():
+                    waterfall.update()
+                    reset = not spectrogram_cursors
+                    strips, spectrogram_cursors = waterfall.since(spectrogram_cursors)
+                if strips:
+                    strips = {ids[name]: strip for name, strip in strips.items()}
+                    yield sse('spectrogram', {'reset': reset, 'channels': strips})
+                    last_beat = now
+            if now >= next_status:
+                next_status = now + STATUS_INTERVAL
+                stats = channel.stats()
+                if stats.get('anomalies', 0) > anomalies and channel.latest is not None:
+                    yield sse('anomaly', {'time': channel.latest.time, 'score': channel.latest.score,
+                                          'count': stats['anomalies'] - anomalies})
+                anomalies = stats.get('anomalies', 0)
+                anomaly_text, anomaly_style = anomaly_display(channel)
+                current = {
+                    'values': {
+                        'ingest-display': ingest_display(channel),
+                        'anomaly-display': anomaly_text,
+                        'features-display': features_display(channel),
+                        'coordinates-display': coordinates_display(channel),
+                        'status-display': None if channel.is_alive() else "Serial ingest stopped",
+                    },
+                    'anomaly_color': anomaly_style['color'],
+                }
+                if current != status:
+                    status = current
+                    yield sse('status', status)
+                    last_beat = now
+            if now - last_beat > 15:
+                # Keeps proxies from closing a quiet connection
+                yield ': keep-alive\n\n'
+                last_beat = now
+            if pushed:
+                # Let the next batch gather rather than pushing every read
+                time.sleep(PUSH_INTERVAL)
+    finally:
+        OPEN_STREAMS.inc(-1)
+
+
+def stream():
+    # Server-Sent Events for one browser; see assets/live_stream.js. A
+    # reconnecting EventSource resumes from the Last-Event-ID it was sent.
+    # Each open stream holds a server thread: under gunicorn use a threaded
+    # worker class, e.g. -k gthread --threads 32.
+    from flask import Response, abort, request
+    channel = channels.get(request.args.get('channel'))
+    if channel is None:
+        abort(404)
+    try:
+        cursor = int(request.headers.get('Last-Event-ID', request.args.get('cursor', 0)))
+        time_window = float(request.args.get('window', 15))
+    except ValueError:
+        abort(400)
+    if cursor < 0 or not (np.isfinite(time_window) and time_window > 0):
+        abort(400)
+    return Response(stream_events(channel, cursor, time_window, waterfall), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def metrics():
+    # Prometheus scrape target: stage latencies and counters of the
+    # acquisition (its workers included) and of this dashboard process
+    from flask import Response
+    if acquisition is not None:
+        snapshots = acquisition.metrics()
+    else:
+        snapshots = REGISTRY.snapshot() + published_metrics(channels)
+    return Response(render(snapshots), mimetype='text/plain; version=0.0.4')
+
+
+def history():
+    # Chart data for any range, for zooming and panning; see view()
+    from flask import abort, jsonify, request
+    channel = channels.get(request.args.get('channel'))
+    if channel is None:
+        abort(404)
+    try:
+        start, end = float(request.args['start']), float(request.args['end'])
+    except (KeyError, ValueError):
+        abort(400)
+    with REDRAW_SECONDS.time():
+        traces, width, anomalies = view(channel, start, end)
+        return jsonify({
+            'start': start,
+            'end': end,
+            'width': width,
+            'frequency': [traces['frequency'][0].tolist(), traces['frequency'][1].tolist()],
+            'amplitude': [traces['amplitude'][0].tolist(), traces['amplitude'][1].tolist()],
+            'anomalies': anomalies,
+        })
+
+
+def aligned_view():
+    # One column of several channels (all by default) resampled onto a
+    # common time grid, for comparing sensors sample by sample; see
+    # multichannel.aligned. step defaults to TARGET_WIDTH points over the
+    # range. Points outside a channel's buffered samples are null.
+    from flask import abort, jsonify, request
+    names = request.args.get('channels')
+    names = names.split(',') if names else list(channels)
+    column = request.args.get('column', 'amplitude')
+    if column not in ('adc', 'amplitude', 'frequency') or any(name not in channels for name in names):
+        abort(404)
+    try:
+        start, end = float(request.args['start']), float(request.args['end'])
+        step = float(request.args.get('step', (end - start) / TARGET_WIDTH))
+    except (KeyError, ValueError):
+        abort(400)
+    if not (end > start and step > 0 and (end - start) / step <= 10 * TARGET_WIDTH):
+        abort(400)
+    with REDRAW_SECONDS.time():
+        grid, values = aligned([channels[name] for name in names], column, start, end, step)
+        return jsonify({
+            'column': column,
+            'time': grid.tolist(),
+            'channels': {name: [None if np.isnan(v) else v for v in row.tolist()]
+                         for name, row in zip(names, values)},
+        })
+
+
+def redraw(time_window, channel_name):
+    # Page load, a new window or a new channel: redraw both traces from the
+    # buffer; the live stream then appends from the returned cursor
+    with REDRAW_SECONDS.time():
+        return _redraw(time_window, channel_name)
+
+
+def _redraw(time_window, channel_name):
+    samples = channels[channel_name].samples
+    latest = samples.latest()
+    if latest is None:
+        from dash import no_update
+        return no_update, no_update, {'channel': channel_name, 'window': time_window, 'cursor': 0}
+    window, cursor = samples.since(0)
+    traces, _, anomalies = view(channels[channel_name], latest.time - time_window, latest.time, window)
+    shapes = anomaly_shapes(anomalies)
     return (
-        fig_frequency,
-        fig_amplitude,
-        "System operational",
-        coordinates_data[-1] if coordinates_data else "Waiting for coordinates...",
-        f"{adc_data[-1]:.2f}" if adc_data and adc_data[-1] is not None else "Waiting...",
-        f"{frequency_data[-1]:.2f} Hz" if frequency_data and frequency_data[-1] is not None else "Waiting...",
-        f"{amplitude_data[-1]:.2f} V" if amplitude_data and amplitude_data[-1] is not None else "Waiting..."
+        redraw_patch(traces['frequency'], latest.time, time_window, shapes),
+        redraw_patch(traces['amplitude'], latest.time, time_window, shapes),
+        {'channel': channel_name, 'window': time_window, 'cursor': cursor},
     )
 
-# Start the Dash app server
+
+def create_app(sources=None):
+    # Build the Dash app over `sources` (channel name -> channel), or over
+    # the channels connect() finds or starts
+    global channels, waterfall
+    import dash
+    from dash.dependencies import ClientsideFunction, Input, Output
+    from figures import make_figures
+
+    channels = connect() if sources is None else sources
+    waterfall = Waterfall(channels, SAMPLE_RATE)
+    app = dash.Dash(__name__)
+    app.layout = make_layout(channels, *make_figures(), waterfall.describe())
+    app.server.add_url_rule('/stream', view_func=stream)
+    app.server.add_url_rule('/metrics', view_func=metrics)
+    app.server.add_url_rule('/history', view_func=history)
+    app.server.add_url_rule('/aligned', view_func=aligned_view)
+    app.callback(
+        [Output('frequency-graph', 'figure'),
+         Output('amplitude-graph', 'figure'),
+         Output('render-cursor', 'data')],
+        [Input('time-window', 'value'),
+         Input('channel', 'value')]
+    )(redraw)
+    # Open (or reopen) the browser's event stream after every redraw
+    app.clientside_callback(
+        ClientsideFunction(namespace='tejas', function_name='connect'),
+        Output('stream-state', 'data'),
+        Input('render-cursor', 'data')
+    )
+    return app
+
+
+def get_app():
+    global _app
+    if _app is None:
+        _app = create_app()
+    return _app
+
+
+def __getattr__(name):
+    # gps_simulation.app and gps_simulation.server build the app on first use
+    if name == 'app':
+        return get_app()
+    if name == 'server':
+        return get_app().server
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Real-time sensor dashboard')
+    parser.add_argument('--headless', action='store_true',
+                        help='only acquire and publish, as python acquisition.py does')
+    args = parser.parse_args()
+    if args.headless:
+        serve(BUS_PREFIX)
+        return
+    # Start the Dash app server
+    get_app().run(debug=True, use_reloader=False)
+
+
 if __name__ == '__main__':
-    app.run_server(debug=True, use_reloader=False)
\ No newline at end of file
+    main()
@@ -0,0 +1,104 @@
+import re
+
+import numpy as np
+
+
+# One precompiled pattern for the Arduino text format, applied to raw bytes:
+#   [Time: 123456789us | ]ADC Value: 512 | Amplitude: 2.5V | Frequency: 120Hz | status
+# The optional Time field is the sketch's micros() when the sample was
+# taken (a uint32 that wraps every 71.6 minutes); see clock.py.
+# Kept free of anchors and lazy quantifiers so findall can scan a whole
+# buffer of lines in a single pass.
+_NUMBER = rb'([-+.\deE]+)'
+LINE_PATTERN = re.compile(
+    rb'(?:Time: *(\d+) *us *\| *)?'
+    rb'ADC Value: *' + _NUMBER + rb'[^|\n]*'
+    rb'\| *Amplitude: *' + _NUMBER + rb' *V[^|\n]*'
+    rb'\| *Frequency: *' + _NUMBER + rb' *Hz[^|\n]*'
+    rb'(?:\| *([^|\r\n]*))?'
+)
+
+DEFAULT_STATUS = b'N/A'
+
+# Lines with nothing but whitespace, which are neither samples nor errors
+# (after the first line; see _blank_lines)
+BLANK_LINE = re.compile(rb'\n[ \t\r]*(?=\n)')
+_LEADING_BLANK = re.compile(rb'[ \t\r]*\n')
+
+
+def parse_line(line):
+    # Parse a single raw line; returns (adc_value, amplitude, frequency, status,
+    # micros) or None if the line does not match. micros is None when the
+    # line carries no device timestamp.
+    match = LINE_PATTERN.search(line)
+    if match is None:
+        return None
+    micros, adc_value, amplitude, frequency, status = match.groups()
+    try:
+        values = float(adc_value), float(amplitude), float(frequency)
+    except ValueError:
+        return None
+    status = status.strip().decode('ascii', errors='replace') if status else 'N/A'
+    return values + (status, int(micros) if micros else None)
+
+
+def parse_lines(buffer):
+    # Parse every complete line in a bytes buffer in one pass.
+    # Returns (adc, amplitude, frequency, status, micros, lines) where the
+    # first three are float64 arrays, status is a bytes array, micros is an
+    # int64 array of device timestamps (-1 where a line has none) and lines
+    # is the number of non-blank newline-terminated lines that were scanned.
+    # A line holding two glued records yields two samples.
+    rows = LINE_PATTERN.findall(buffer)
+    lines = buffer.count(b'\n')
+    if lines > len(rows):
+        # Only then can there be blank lines, unless glued records hide them
+        lines -= _blank_lines(buffer)
+    if not rows:
+        empty = np.empty(0, dtype=np.float64)
+        return empty, empty.copy(), empty.copy(), np.empty(0, dtype='S1'), np.empty(0, dtype=np.int64), lines
+
+    micros, adc, amplitude, frequency, status = zip(*rows)
+    try:
+        columns = [np.fromiter(map(float, column), np.float64, len(rows))
+                   for column in (adc, amplitude, frequency)]
+    except ValueError:
+        # A field matched the character class but is not a number (e.g. "1.2.3");
+        # fall back to checking rows one at a time
+        return _parse_rows(rows, lines)
+    status = np.array([s.rstrip() or DEFAULT_STATUS for s in status], dtype=np.bytes_)
+    return columns[0], columns[1], columns[2], status, _micros(micros), lines
+
+
+def _blank_lines(buffer):
+    return len(BLANK_LINE.findall(buffer)) + (_LEADING_BLANK.match(buffer) is not None)
+
+
+def _micros(column):
+    # Device timestamps as int64, -1 for lines without one
+    if not any(column):
+        return np.full(len(column), -1, dtype=np.int64)
+    if all(column):
+        return np.fromiter(map(int, column), np.int64, len(column))
+    return np.array([int(m) if m else -1 for m in column], dtype=np.int64)
+
+
+def _parse_rows(rows, lines):
+    kept = []
+    for row in rows:
+        try:
+            kept.append((float(row[1]), float(row[2]), float(row[3]), row[4].rstrip() or DEFAULT_STATUS,
+                         int(row[0]) if row[0] else -1))
+        except ValueError:
+            continue
+    if not kept:
+        return parse_lines(b'')[:5] + (lines,)
+    adc, amplitude, frequency, status, micros = zip(*kept)
+    return (
+        np.array(adc, dtype=np.float64),
+        np.array(amplitude, dtype=np.float64),
+        np.array(frequency, dtype=np.float64),
+        np.array(status, dtype=np.bytes_),
+        np.array(micros, dtype=np.int64),
+        lines,
+    )
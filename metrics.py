@@ -0,0 +1,217 @@
+import bisect
+import logging
+import os
+import threading
+import time
+
+
+# Latency histogram buckets in seconds, 10 us to 10 s
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Logging level for every tejas logger, e.g. TEJAS_LOG_LEVEL=DEBUG
+LOG_LEVEL = os.environ.get('TEJAS_LOG_LEVEL', 'INFO')
+
+
+class Counter:
+    # Monotonic count. Each metric is meant to be updated from one thread;
+    # scrapes may read it mid-update and see the previous value.
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def snapshot(self):
+        return {'name': self.name, 'help': self.help, 'type': self.kind, 'labels': self.labels,
+                'value': self.value}
+
+
+class Gauge(Counter):
+    # Value that can go up and down
+
+    kind = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    # Fixed-bucket histogram; observe() is a bisect and three increments
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        # Context manager observing the duration of its block
+        return _Timer(self)
+
+    def snapshot(self):
+        return {'name': self.name, 'help': self.help, 'type': self.kind, 'labels': self.labels,
+                'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.sum,
+                'count': self.count}
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Registry:
+    # Metrics of this process, keyed by name and labels. Collectors are
+    # called at scrape time and return snapshots of values that are already
+    # counted elsewhere (e.g. SerialIngest.stats()), so the hot path does not
+    # count them twice.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = cls(name, help, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help, **labels):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, **labels):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, **labels):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def add_collector(self, collector):
+        with self.lock:
+            self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        # For owners that stop, so their series are no longer exported
+        with self.lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        snapshots = [metric.snapshot() for metric in metrics]
+        for collector in collectors:
+            snapshots.extend(collector())
+        return snapshots
+
+
+REGISTRY = Registry()
+
+
+def sample(name, help, kind, labels, value):
+    # Snapshot of a single value, for collectors
+    return {'name': name, 'help': help, 'type': kind, 'labels': labels, 'value': value}
+
+
+def _labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in sorted(labels.items())) + '}'
+
+
+def render(snapshots):
+    # Prometheus text exposition format
+    lines = []
+    seen = set()
+    for snapshot in sorted(snapshots, key=lambda s: s['name']):
+        name = snapshot['name']
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {snapshot['help']}")
+            lines.append(f"# TYPE {name} {snapshot['type']}")
+        labels = snapshot['labels']
+        if snapshot['type'] == 'histogram':
+            cumulative = 0
+            for bound, count in zip(snapshot['buckets'], snapshot['counts']):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, le=f'{bound:g}')} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {snapshot['count']}")
+            lines.append(f"{name}_sum{_labels(labels)} {snapshot['sum']:.9g}")
+            lines.append(f"{name}_count{_labels(labels)} {snapshot['count']}")
+        else:
+            lines.append(f"{name}{_labels(labels)} {snapshot['value']:.9g}")
+    return '\n'.join(lines) + '\n'
+
+
+class RateLimitFilter(logging.Filter):
+    # Lets at most `burst` records of each message template through per
+    # `interval` seconds; the next record after a quiet spell reports how
+    # many were suppressed
+
+    def __init__(self, burst=5, interval=10.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - start >= self.interval:
+                start, count = now, 0
+            count += 1
+            if count > self.burst:
+                self._windows[key] = (start, count, suppressed + 1)
+                return False
+            self._windows[key] = (start, count, 0)
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+_configured = False
+
+
+def get_logger(name):
+    # Logger under 'tejas', with one rate-limited handler on stderr
+    global _configured
+    if not _configured:
+        _configured = True
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        handler.addFilter(RateLimitFilter())
+        root = logging.getLogger('tejas')
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL.upper())
+        root.propagate = False
+    return logging.getLogger(f'tejas.{name}')
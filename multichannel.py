@@ -0,0 +1,339 @@
+import json
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from anomaly_detector import AnomalyDetector, Autoencoder, WindowScore
+from backpressure import BoundedQueue, Stage, deliver
+from event_index import EventIndex, EventLogger
+from metrics import REGISTRY
+from positioning import open_position
+from preprocessing import FeaturePipeline
+from recorder import Recorder, run_name
+from rollups import Rollups
+from sample_buffer import SampleBuffer
+from serial_ingest import SerialIngest
+from sources import open_source
+
+
+# Channels are declared in a JSON file:
+#   {
+#     "sample_rate": 5000,
+#     "bandpass": [20, 2000],
+#     "record_dir": "recordings",
+#     "events_db": "events.sqlite",
+#     "position": "odometry:19.07,72.88@45,20,main-line",
+#     "channels": [
+#       {"name": "wheelset-1", "source": "serial:/dev/ttyACM0@115200"},
+#       {"name": "wheelset-2", "source": "serial:/dev/ttyACM1@115200", "model": "ws2.npz"}
+#     ]
+#   }
+# Top-level keys are defaults that every channel can override.
+CHANNEL_DEFAULTS = {
+    'sample_rate': 5000,
+    'bandpass': [20, 2000],
+    'buffer_capacity': 100000,
+    'model': None,
+    'record_dir': None,
+    'events_db': None,
+    'position': None,
+    'notify_url': None,
+    'alert_spool': 'alerts',
+    'publish_interval': 0.05,
+    'queue_seconds': 60,
+}
+
+# How often channel workers send their metrics snapshot, in seconds
+METRICS_INTERVAL = 1.0
+
+# Sends from each channel worker that may wait for the merge thread
+RESULTS_QUEUE = 20
+
+
+def load_config(path):
+    with open(path) as f:
+        config = json.load(f)
+    defaults = {key: config.get(key, value) for key, value in CHANNEL_DEFAULTS.items()}
+    return [dict(defaults, **channel) for channel in config['channels']]
+
+
+class LocalChannel:
+    # One channel running in this process: ingest and detector threads over a
+    # shared SampleBuffer, optionally recording to disk and rolling up.
+    # queues are the channel's backpressure.BoundedQueues by name, and
+    # stages the threads draining them, finished before the recorder closes.
+    # sample_rate is the rate the device runs at, if known.
+
+    def __init__(self, name, samples, ingest, detector, recorder=None, positions=None, rollups=None,
+                 queues=None, stages=(), sample_rate=None):
+        self.name = name
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.ingest = ingest
+        self.detector = detector
+        self.recorder = recorder
+        self.positions = positions
+        self.rollups = rollups
+        self.queues = queues or {}
+        self.stages = list(stages)
+
+    @property
+    def position(self):
+        return self.positions.at(time.time()) if self.positions is not None else None
+
+    @property
+    def latest(self):
+        return self.detector.latest
+
+    @property
+    def latest_features(self):
+        return self.detector.latest_features
+
+    @property
+    def threshold(self):
+        return None if self.detector.calibrating else self.detector.model.threshold
+
+    @property
+    def scores(self):
+        return self.detector.scores
+
+    def stats(self):
+        return dict(self.ingest.stats(), **self.detector.stats(),
+                    queues={name: q.stats() for name, q in self.queues.items()})
+
+    def is_alive(self):
+        return self.ingest.is_alive()
+
+    def stop(self):
+        # Ingest may be waiting on a full queue; the detector and the stages
+        # keep draining until it has stopped
+        self.ingest.stop()
+        self.ingest.join(timeout=5)
+        self.detector.stop()
+        for stage in self.stages:
+            stage.stop(timeout=5)
+        for q in self.queues.values():
+            q.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+
+class RemoteChannel:
+    # Parent-side copy of a channel that runs in a worker process, filled by
+    # MultiChannelIngest's merge thread
+
+    def __init__(self, name, samples, history=10000, positions=None, rollups=None, sample_rate=None):
+        self.name = name
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.positions = positions
+        self.rollups = rollups
+        self.metrics = []
+        self.scores = deque(maxlen=history)
+        self.latest = None
+        self.latest_features = None
+        self.threshold = None
+        self._stats = {}
+        self.process = None
+
+    @property
+    def position(self):
+        return self.positions.at(time.time()) if self.positions is not None else None
+
+    def stats(self):
+        return self._stats
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+
+def run_channel(channel, results, stop):
+    # Worker process entry point: ingest, parse, features and detection for
+    # one channel, publishing new samples and scores every publish_interval
+    # until the shared stop flag is set. Ctrl-C reaches the whole process
+    # group; the parent stops the workers itself.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    name = channel['name']
+    samples = SampleBuffer(channel['buffer_capacity'])
+    # As in acquisition: the detector and the recorder get every sample
+    # through queues that never drop, the buffer sent on to the parent is
+    # overwritten oldest first
+    capacity = int(channel['queue_seconds'] * channel['sample_rate'])
+    detect_queue = BoundedQueue('detector', capacity, channel=name)
+    record_queue = None
+    writer = None
+    recorder = None
+    if channel['record_dir']:
+        recorder = Recorder(channel['record_dir'], run=channel.get('run') and f"{channel['run']}-{name}")
+        record_queue = BoundedQueue('recorder', capacity, channel=name)
+        writer = Stage('recorder', record_queue, lambda batch: recorder.extend(*batch))
+        writer.start()
+
+    def store_samples(timestamp, adc, amplitude, frequency, status):
+        samples.extend(timestamp, adc, amplitude, frequency, status)
+        deliver(detect_queue, (timestamp, adc), len(status))
+        if record_queue is not None:
+            deliver(record_queue, (timestamp, adc, amplitude, frequency, status), len(status))
+
+    # Every anomaly goes into the event index, tagged with where it happened,
+    # and out to the track managers
+    logger = None
+    notifier = None
+    if channel['notify_url']:
+        from notifier import Notifier
+        notifier = Notifier(channel['notify_url'], channel['alert_spool']).start()
+    if channel['events_db'] or notifier is not None:
+        positions = open_position(channel['position']) if channel['position'] else None
+        logger = EventLogger(EventIndex(channel['events_db']) if channel['events_db'] else None, positions,
+                             name, recorder.run if recorder is not None else channel.get('run'),
+                             notify=notifier.submit if notifier is not None else None)
+
+    model = Autoencoder.load(channel['model']) if channel['model'] else None
+    pipeline = FeaturePipeline(channel['sample_rate'], tuple(channel['bandpass']))
+    ingest = SerialIngest(open_source(channel['source']), store_samples, channel=name,
+                          sample_rate=channel['sample_rate']).open()
+    detector = AnomalyDetector(samples, model, pipeline=pipeline, on_anomaly=logger, channel=name,
+                               inbox=detect_queue)
+    ingest.start()
+    detector.start()
+
+    # When the parent falls behind and the results queue is full, samples
+    # and scores wait in this process's buffers for the next send; what
+    # those overwrite in the meantime is counted as shed
+    shed = REGISTRY.counter('tejas_queue_shed_samples_total', 'Samples shed by a full stage queue',
+                            channel=name, queue='dashboard')
+    queues = {q.name: q for q in (detect_queue, record_queue) if q is not None}
+    cursor = 0
+    scored = 0
+    next_metrics = 0
+    try:
+        while not stop.value:
+            time.sleep(channel['publish_interval'])
+            # This process's metrics travel with the samples once a second
+            metrics = None
+            if time.monotonic() >= next_metrics:
+                next_metrics = time.monotonic() + METRICS_INTERVAL
+                metrics = REGISTRY.snapshot()
+            new, count = samples.since(cursor)
+            scores, scored_until = detector.scores_since(scored)
+            status = np.array(samples.status_codes.names, dtype=np.bytes_)[new.status]
+            stats = dict(ingest.stats(), **detector.stats(),
+                         queues=dict({q: stage.stats() for q, stage in queues.items()},
+                                     dashboard={'shed': shed.value}))
+            try:
+                results.put_nowait((
+                    name,
+                    (new.time.copy(), new.adc.copy(), new.amplitude.copy(), new.frequency.copy(), status),
+                    scores,
+                    detector.latest_features,
+                    None if detector.calibrating else detector.model.threshold,
+                    stats,
+                    metrics,
+                ))
+            except queue.Full:
+                if metrics is not None:
+                    next_metrics = 0
+            else:
+                shed.inc(count - cursor - len(new.time))
+                cursor = count
+                scored = scored_until
+            if not ingest.is_alive():
+                break
+    finally:
+        ingest.stop()
+        ingest.join(timeout=5)
+        detector.stop()
+        if writer is not None:
+            writer.stop(timeout=5)
+        for q in queues.values():
+            q.close()
+        if recorder is not None:
+            recorder.close()
+        if notifier is not None:
+            notifier.stop()
+
+
+class MultiChannelIngest:
+    # Runs every configured channel in its own worker process, so a noisy
+    # channel cannot starve the others under the GIL, and merges their output
+    # into per-channel buffers in this process. buffers maps channel names to
+    # the buffers to fill, SampleBuffers by default, and rollups to their
+    # rollup tiers, Rollups by default; positions is the provider behind each
+    # channel's current position in this process.
+
+    def __init__(self, channels, history=10000, buffers=None, positions=None, rollups=None):
+        # Channels of one session record to <run>-<channel name> side by side
+        run = run_name(time.time())
+        self.config = {channel['name']: dict(channel, run=channel.get('run', run)) for channel in channels}
+        buffers = buffers or {name: SampleBuffer(channel['buffer_capacity'])
+                              for name, channel in self.config.items()}
+        rollups = rollups or {name: Rollups() for name in self.config}
+        self.channels = {name: RemoteChannel(name, buffers[name], history, positions, rollups[name],
+                                             channel['sample_rate'])
+                         for name, channel in self.config.items()}
+        context = multiprocessing.get_context('spawn')
+        # Bounded, so a merge thread that falls behind holds the workers'
+        # output back in their buffers rather than in an ever-growing pipe
+        self._results = context.Queue(maxsize=RESULTS_QUEUE * len(self.channels))
+        # A lock-free flag rather than an Event: a worker killed while
+        # waiting on an Event leaves it unusable, and set() would hang
+        self._stop = context.RawValue('b', 0)
+        self._context = context
+        self._merge_thread = threading.Thread(target=self._merge, name='channel-merge', daemon=True)
+
+    def start(self):
+        for name, channel in self.channels.items():
+            channel.process = self._context.Process(
+                target=run_channel, args=(self.config[name], self._results, self._stop),
+                name=f'channel-{name}', daemon=True)
+            channel.process.start()
+        self._merge_thread.start()
+        return self
+
+    def stop(self):
+        self._stop.value = 1
+        for channel in self.channels.values():
+            if channel.process is not None:
+                channel.process.join(timeout=5)
+
+    def _merge(self):
+        while not self._stop.value:
+            try:
+                name, batch, scores, features, threshold, stats, metrics = self._results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            channel = self.channels[name]
+            # Rollups first, so anomalies below land in buckets that exist
+            channel.rollups.extend(*batch)
+            channel.samples.extend(*batch)
+            if scores:
+                channel.scores.extend(WindowScore(*score) for score in scores)
+                channel.latest = channel.scores[-1]
+                channel.rollups.mark([score[0] for score in scores if score[2]])
+            channel.latest_features = features
+            channel.threshold = threshold
+            channel._stats = stats
+            if metrics is not None:
+                channel.metrics = metrics
+
+
+def aligned(channels, column, t0, t1, step):
+    # Resample one column of several channels onto a common time grid.
+    # Returns (grid, values) with values shaped (len(channels), len(grid));
+    # grid points outside a channel's data are NaN.
+    grid = np.arange(t0, t1, step)
+    values = np.full((len(channels), len(grid)), np.nan)
+    for row, channel in enumerate(channels):
+        window = channel.samples.last()
+        times = window.time
+        data = getattr(window, column)
+        if len(times) < 2:
+            continue
+        inside = (grid >= times[0]) & (grid <= times[-1])
+        values[row, inside] = np.interp(grid[inside], times, data)
+    return grid, values
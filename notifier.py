@@ -0,0 +1,393 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from event_index import Event, haversine
+from metrics import get_logger
+
+
+log = get_logger('notifier')
+
+
+class _Cluster:
+    # Events close together in time and space, sent as one alert
+
+    def __init__(self, event, now):
+        self.events = [event]
+        self.opened = now
+        self.updated = now
+
+    def accepts(self, event, window, radius):
+        first = self.events[0]
+        if abs(event.time - self.events[-1].time) > window:
+            return False
+        if None in (event.lat, event.lon, first.lat, first.lon):
+            return True
+        return haversine(first.lat, first.lon, event.lat, event.lon) <= radius
+
+    def add(self, event, now):
+        self.events.append(event)
+        self.updated = now
+
+    def due(self, linger, window):
+        # Quiet for `linger` seconds, or open for `window` seconds
+        return min(self.updated + linger, self.opened + window)
+
+
+def make_alert(events):
+    # JSON body of one alert, summarising a cluster of events. The id lets
+    # the receiver drop a retried alert it has already seen.
+    worst = max(events, key=lambda e: e.severity)
+    chainages = [e.chainage for e in events if e.chainage is not None]
+    return {
+        'id': uuid.uuid4().hex,
+        'type': 'crack_alert',
+        'events': len(events),
+        'start': min(e.time for e in events),
+        'end': max(e.time for e in events),
+        'channels': sorted({e.channel for e in events if e.channel}),
+        'runs': sorted({e.run for e in events if e.run}),
+        'max_severity': worst.severity,
+        'max_score': worst.score,
+        'lat': worst.lat,
+        'lon': worst.lon,
+        'track': worst.track,
+        'chainage': [min(chainages), max(chainages)] if chainages else None,
+        'event_ids': [e.id for e in events if e.id is not None][:1000],
+        'features': worst.features,
+    }
+
+
+def rejected(response):
+    # The endpoint refused the alert itself; sending it again will not help
+    return 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+
+
+class Notifier(threading.Thread):
+    # Sends crack alerts to a track-manager HTTP endpoint from an asyncio
+    # loop in its own thread. submit() only schedules work on the loop, so
+    # the detector thread that calls it never waits on the network.
+    #
+    # Events are coalesced: one alert per cluster of events within `window`
+    # seconds and `radius` metres, sent once the cluster has been quiet for
+    # `linger` seconds (or has been open for `window`). Alerts are POSTed
+    # as JSON over a pooled requests.Session in a small thread pool, retried
+    # with jittered exponential backoff, and written to spool_dir when the
+    # endpoint stays down. Spooled alerts are resent
+    # once the endpoint answers again. Alerts the endpoint rejects (a 4xx
+    # other than 408 or 429) are not retried; they are kept for inspection
+    # in spool_dir/rejected.
+
+    def __init__(self, url, spool_dir='alerts', window=30.0, radius=200.0, linger=2.0, max_events=500,
+                 queue_size=10000, senders=4, retries=4, backoff=0.5, max_backoff=30.0, timeout=5.0,
+                 headers=None):
+        super().__init__(name='notifier', daemon=True)
+        self.url = url
+        self.spool_dir = spool_dir
+        self.window = window
+        self.radius = radius
+        self.linger = linger
+        self.max_events = max_events
+        self.queue_size = queue_size
+        self.senders = senders
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.rejected_dir = os.path.join(spool_dir, 'rejected')
+        os.makedirs(self.rejected_dir, exist_ok=True)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=senders)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update(headers or {})
+
+        self._loop = None
+        self._ready = threading.Event()
+        self._stopping = None
+        self._down_until = 0.0
+
+        # Counters, only written on the loop
+        self.events_received = 0
+        self.alerts_sent = 0
+        self.retries_made = 0
+        self.alerts_spooled = 0
+        self.spool_resent = 0
+        self.alerts_rejected = 0
+
+    def start(self):
+        super().start()
+        self._ready.wait()
+        return self
+
+    def submit(self, events):
+        # Queue events for alerting; safe from any thread, never blocks
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._enqueue, list(events))
+
+    def stop(self, timeout=10):
+        # Flush what is pending; anything not delivered in time is spooled
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._stopping.set)
+        self.join(timeout)
+
+    def run(self):
+        asyncio.run(self._main())
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._events = asyncio.Queue(self.queue_size)
+        self._alerts = asyncio.Queue()
+        self._stopping = asyncio.Event()
+        self._clusters = []
+        self._executor = ThreadPoolExecutor(self.senders, thread_name_prefix='notifier-http')
+        self._ready.set()
+        tasks = [asyncio.create_task(self._send_loop()) for _ in range(self.senders)]
+        tasks.append(asyncio.create_task(self._resend_loop()))
+        try:
+            await self._coalesce_loop()
+            # Give the senders a moment to drain, then spool the rest
+            try:
+                await asyncio.wait_for(self._alerts.join(), self.timeout)
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            while not self._alerts.empty():
+                self._spool(self._alerts.get_nowait())
+            self._executor.shutdown(wait=False)
+            self.session.close()
+
+    def _enqueue(self, events):
+        for event in events:
+            self.events_received += 1
+            try:
+                self._events.put_nowait(event)
+            except asyncio.QueueFull:
+                # The coalescing loop is behind: cluster it here instead
+                self._cluster(self._clusters, event)
+
+    async def _coalesce_loop(self):
+        clusters = self._clusters
+        while True:
+            now = time.monotonic()
+            due = min((c.due(self.linger, self.window) for c in clusters), default=None)
+            try:
+                wait = None if due is None else max(0.0, due - now)
+                get = asyncio.ensure_future(self._events.get())
+                stop = asyncio.ensure_future(self._stopping.wait())
+                done, _ = await asyncio.wait((get, stop), timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if get not in done:
+                    get.cancel()
+                stop.cancel()
+                if get in done:
+                    self._cluster(clusters, get.result())
+                    # Take whatever else is already queued in the same pass
+                    while not self._events.empty():
+                        self._cluster(clusters, self._events.get_nowait())
+            finally:
+                now = time.monotonic()
+                stopping = self._stopping.is_set()
+                for cluster in list(clusters):
+                    if stopping or cluster.due(self.linger, self.window) <= now:
+                        clusters.remove(cluster)
+                        self._alerts.put_nowait(make_alert(cluster.events))
+            if self._stopping.is_set():
+                return
+
+    def _cluster(self, clusters, event):
+        if not isinstance(event, Event):
+            event = Event(**event)
+        now = time.monotonic()
+        for cluster in clusters:
+            if cluster.accepts(event, self.window, self.radius):
+                cluster.add(event, now)
+                if len(cluster.events) >= self.max_events:
+                    clusters.remove(cluster)
+                    self._alerts.put_nowait(make_alert(cluster.events))
+                return
+        clusters.append(_Cluster(event, now))
+
+    async def _send_loop(self):
+        while True:
+            alert = await self._alerts.get()
+            try:
+                if not await self._deliver(alert):
+                    self._spool(alert)
+            finally:
+                self._alerts.task_done()
+
+    async def _deliver(self, alert):
+        # POST with retries; True once the alert is sent or set aside as
+        # rejected, False once the endpoint is considered down
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            if time.monotonic() < self._down_until:
+                return False
+            try:
+                response = await self._loop.run_in_executor(self._executor, self._post, alert)
+                if response.ok:
+                    self.alerts_sent += 1
+                    return True
+                if rejected(response):
+                    # Retrying will not help, keep it for inspection
+                    self._reject(alert, response)
+                    return True
+            except requests.RequestException:
+                pass
+            if attempt < self.retries:
+                self.retries_made += 1
+                await asyncio.sleep(min(delay, self.max_backoff) * random.uniform(0.5, 1.0))
+                delay *= 2
+        self._down_until = time.monotonic() + self.max_backoff
+        log.warning("Alert endpoint %s is not answering; spooling alerts", self.url)
+        return False
+
+    def _post(self, alert):
+        return self.session.post(self.url, json=alert, timeout=self.timeout,
+                                 headers={'Idempotency-Key': alert['id']})
+
+    def _spool(self, alert, directory=None):
+        path = os.path.join(directory or self.spool_dir,
+                            f"{time.time_ns()}-{os.getpid()}-{alert['id'][:8]}.json")
+        with open(path + '.tmp', 'w') as f:
+            json.dump(alert, f)
+        os.replace(path + '.tmp', path)
+        if directory is None:
+            self.alerts_spooled += 1
+
+    def _reject(self, alert, response):
+        log.error("Alert %s rejected: HTTP %d; kept in %s", alert['id'], response.status_code,
+                  self.rejected_dir)
+        self._spool(alert, self.rejected_dir)
+        self.alerts_rejected += 1
+
+    def spooled(self):
+        return sorted(name for name in os.listdir(self.spool_dir) if name.endswith('.json'))
+
+    async def _resend_loop(self):
+        # Resend spooled alerts, oldest first, whenever the endpoint is up
+        while True:
+            await asyncio.sleep(max(1.0, self._down_until - time.monotonic()))
+            for name in self.spooled():
+                path = os.path.join(self.spool_dir, name)
+                try:
+                    with open(path) as f:
+                        alert = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                try:
+                    response = await self._loop.run_in_executor(self._executor, self._post, alert)
+                except requests.RequestException:
+                    self._down_until = time.monotonic() + self.max_backoff
+                    break
+                if rejected(response):
+                    # Set aside, so it does not hold up the alerts behind it
+                    log.error("Spooled alert %s rejected: HTTP %d; moved to %s", alert.get('id'),
+                              response.status_code, self.rejected_dir)
+                    os.replace(path, os.path.join(self.rejected_dir, name))
+                    self.alerts_rejected += 1
+                    continue
+                if not response.ok:
+                    break
+                os.remove(path)
+                self.alerts_sent += 1
+                self.spool_resent += 1
+
+    def stats(self):
+        return {
+            'events_received': self.events_received,
+            'alerts_sent': self.alerts_sent,
+            'retries': self.retries_made,
+            'alerts_spooled': self.alerts_spooled,
+            'spool_resent': self.spool_resent,
+            'alerts_rejected': self.alerts_rejected,
+            'queued': self._events.qsize() if self._loop is not None else 0,
+        }
+
+
+class StubEndpoint(ThreadingHTTPServer):
+    # Local stand-in for the alert endpoint, for trying the notifier out:
+    # records every alert it accepts, answers 503 while `down` is set and
+    # 422 to the alerts `reject` (a function of the alert) picks out
+
+    def __init__(self, port=0):
+        super().__init__(('127.0.0.1', port), _StubHandler)
+        self.alerts = []
+        self.requests = 0
+        self.down = False
+        self.reject = None
+        threading.Thread(target=self.serve_forever, name='stub-endpoint', daemon=True).start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/alerts'
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests += 1
+        alert = json.loads(body)
+        if self.server.down:
+            self.send_response(503)
+        elif self.server.reject is not None and self.server.reject(alert):
+            self.send_response(422)
+        else:
+            if all(a['id'] != alert['id'] for a in self.server.alerts):
+                self.server.alerts.append(alert)
+            self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    # Demo against the stub: a burst of events at one spot becomes one alert,
+    # alerts raised while the endpoint is down are spooled and resent later
+    parser = argparse.ArgumentParser(description='Send test alerts to a local stub endpoint')
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--spool', default='alerts')
+    args = parser.parse_args()
+
+    stub = StubEndpoint()
+    notifier = Notifier(stub.url, spool_dir=args.spool, linger=0.5, retries=2, backoff=0.1,
+                        max_backoff=2.0).start()
+    now = time.time()
+    start = time.perf_counter()
+    for i in range(args.events):
+        # Two defects 5 km apart
+        lat = 19.07 if i % 2 else 19.115
+        notifier.submit([Event(i, now + i * 0.001, 'demo', 'default', lat, 72.88, 'main', i % 2 * 5000.0,
+                               1.0, 2.0, None)])
+    print(f"Submitted {args.events} events in {(time.perf_counter() - start) * 1000:.1f} ms")
+    time.sleep(1.5)
+    print(f"Endpoint up: {len(stub.alerts)} alerts for {sum(a['events'] for a in stub.alerts)} events")
+
+    stub.down = True
+    notifier.submit([Event(None, time.time(), 'demo', 'default', 19.2, 72.9, 'main', 20000.0, 1.0, 3.0, None)])
+    time.sleep(2.0)
+    print(f"Endpoint down: {len(notifier.spooled())} alert(s) spooled")
+    stub.down = False
+    time.sleep(3.5)
+    print(f"Endpoint back: {len(stub.alerts)} alerts delivered, {len(notifier.spooled())} spooled")
+    notifier.stop()
+    print(notifier.stats())
+
+
+if __name__ == '__main__':
+    main()
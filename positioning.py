@@ -0,0 +1,255 @@
+import bisect
+import math
+import threading
+import time
+from collections import deque, namedtuple
+
+from metrics import get_logger
+
+
+log = get_logger('positioning')
+
+
+# Where the train was at `time`: WGS84 latitude and longitude in degrees,
+# plus the track it is on and the distance along it in metres (None when
+# the provider cannot tell)
+Position = namedtuple('Position', ('time', 'lat', 'lon', 'track', 'chainage'))
+
+EARTH_RADIUS = 6371008.8  # metres
+
+# A GPS fix older than this (seconds from the time asked about) is not used
+FIX_STALE = 5.0
+
+
+def offset(lat, lon, distance, bearing):
+    # Point `distance` metres from (lat, lon) along `bearing` degrees
+    # (clockwise from north), on a sphere
+    angle = distance / EARTH_RADIUS
+    bearing = math.radians(bearing)
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2 = math.asin(math.sin(lat1) * math.cos(angle)
+                     + math.cos(lat1) * math.sin(angle) * math.cos(bearing))
+    lon2 = lon1 + math.atan2(math.sin(bearing) * math.sin(angle) * math.cos(lat1),
+                             math.cos(angle) - math.sin(lat1) * math.sin(lat2))
+    return math.degrees(lat2), (math.degrees(lon2) + 540) % 360 - 180
+
+
+class FixedPosition:
+    # A sensor that does not move, e.g. a trackside installation
+
+    def __init__(self, lat, lon, track=None, chainage=None):
+        self.lat = lat
+        self.lon = lon
+        self.track = track
+        self.chainage = chainage
+
+    def at(self, timestamp):
+        return Position(timestamp, self.lat, self.lon, self.track, self.chainage)
+
+    def close(self):
+        pass
+
+
+class OdometryPosition:
+    # Dead reckoning from a known start: the train leaves (lat, lon) at
+    # `start` heading `bearing` degrees at a constant `speed` m/s, and the
+    # chainage along `track` grows from `chainage`. Good enough to tag
+    # events on a straight test run, or to stand in for a GPS in replays.
+
+    def __init__(self, lat, lon, bearing=0.0, speed=20.0, track='track', chainage=0.0, start=None):
+        self.lat = lat
+        self.lon = lon
+        self.bearing = bearing
+        self.speed = speed
+        self.track = track
+        self.chainage = chainage
+        self.start = time.time() if start is None else start
+
+    def at(self, timestamp):
+        distance = max(0.0, timestamp - self.start) * self.speed
+        lat, lon = offset(self.lat, self.lon, distance, self.bearing)
+        return Position(timestamp, lat, lon, self.track, self.chainage + distance)
+
+    def close(self):
+        pass
+
+
+def _nmea_degrees(value, hemisphere):
+    # NMEA ddmm.mmmm (dddmm.mmmm for longitude) to signed decimal degrees
+    point = value.index('.') if '.' in value else len(value)
+    degrees = float(value[:point - 2]) + float(value[point - 2:]) / 60
+    return -degrees if hemisphere in ('S', 'W') else degrees
+
+
+def nmea_fix(sentence):
+    # (lat, lon) of an RMC or GGA sentence reporting a valid fix, from any
+    # talker (GP, GN, GL, ...); None for other sentences, no fix or a bad
+    # checksum
+    sentence = sentence.strip()
+    if not sentence.startswith('$'):
+        return None
+    body, _, checksum = sentence[1:].partition('*')
+    if checksum:
+        expected = 0
+        for c in body:
+            expected ^= ord(c)
+        try:
+            if int(checksum[:2], 16) != expected:
+                return None
+        except ValueError:
+            return None
+    fields = body.split(',')
+    kind = fields[0][2:]
+    try:
+        if kind == 'RMC' and fields[2] == 'A':
+            lat, ns, lon, ew = fields[3:7]
+        elif kind == 'GGA' and fields[6] not in ('', '0'):
+            lat, ns, lon, ew = fields[2:6]
+        else:
+            return None
+        return _nmea_degrees(lat, ns), _nmea_degrees(lon, ew)
+    except (IndexError, ValueError):
+        return None
+
+
+class NmeaPosition:
+    # A GPS receiver speaking NMEA 0183 on a serial port. Fixes are stamped
+    # with the host clock as they arrive, like the sensor's samples, and
+    # at() interpolates between the two around the time asked about; it
+    # returns None while the receiver has no fix within FIX_STALE seconds.
+    # The port is reopened if it goes away. GPS knows no chainage, so
+    # positions carry `track` but chainage None.
+
+    def __init__(self, port, baud_rate=4800, track=None, history=600):
+        self.port = port
+        self.baud_rate = baud_rate
+        self.track = track
+        self.lock = threading.Lock()
+        self._times = deque(maxlen=history)
+        self._fixes = deque(maxlen=history)
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='nmea', daemon=True) if port else None
+        if self._thread is not None:
+            self._thread.start()
+
+    def _run(self):
+        # pyserial is only needed with a real receiver
+        import serial
+        while not self._stop_event.is_set():
+            try:
+                with serial.Serial(self.port, self.baud_rate, timeout=1.0) as ser:
+                    while not self._stop_event.is_set():
+                        line = ser.readline()
+                        if line:
+                            self.feed(line.decode('ascii', errors='replace'))
+            except OSError as e:  # serial.SerialException included
+                log.warning("GPS receiver on %s: %s", self.port, e)
+                self._stop_event.wait(5.0)
+
+    def feed(self, sentence, timestamp=None):
+        # Take one NMEA sentence, received at timestamp (default now)
+        fix = nmea_fix(sentence)
+        if fix is None:
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            if self._times and timestamp <= self._times[-1]:
+                self._fixes[-1] = fix  # RMC and GGA of the same epoch
+                return
+            self._times.append(timestamp)
+            self._fixes.append(fix)
+
+    def at(self, timestamp):
+        with self.lock:
+            i = bisect.bisect_left(self._times, timestamp)
+            if i < len(self._times) and i > 0:
+                t0, t1 = self._times[i - 1], self._times[i]
+                if t1 - t0 > 2 * FIX_STALE:
+                    return None  # fix lost in between
+                w = (timestamp - t0) / (t1 - t0)
+                (lat0, lon0), (lat1, lon1) = self._fixes[i - 1], self._fixes[i]
+                lat, lon = lat0 + w * (lat1 - lat0), lon0 + w * (lon1 - lon0)
+                return Position(timestamp, lat, lon, self.track, None)
+            nearest = i - 1 if i else 0
+            if not self._times or abs(timestamp - self._times[nearest]) > FIX_STALE:
+                return None
+            lat, lon = self._fixes[nearest]
+        return Position(timestamp, lat, lon, self.track, None)
+
+    def close(self):
+        self._stop_event.set()
+
+
+class GeocoderPosition:
+    # Coarse fix from the host's public IP address via geocoder, refreshed
+    # every `refresh` seconds in the background so a slow lookup never
+    # blocks the caller. at() returns the last fix, or None before the first.
+    # City-level at best, often kilometres off, and each lookup goes to a
+    # third-party service: only for a rough idea of where a bench setup is,
+    # never for events that near() or repeat queries will compare.
+
+    def __init__(self, refresh=300.0, track=None):
+        self.refresh = refresh
+        self.track = track
+        self.fix = None
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='geocoder', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        # Imported here: geocoder pulls in requests, which headless runs
+        # without an IP fix never need
+        import geocoder
+        while True:
+            try:
+                g = geocoder.ip('me')
+                if g.ok and g.latlng:
+                    self.fix = tuple(g.latlng)
+            except Exception as e:
+                log.warning("Geocoder lookup failed: %s", e)
+            if self._stop_event.wait(self.refresh):
+                break
+
+    def at(self, timestamp):
+        if self.fix is None:
+            return None
+        return Position(timestamp, self.fix[0], self.fix[1], self.track, None)
+
+    def close(self):
+        self._stop_event.set()
+
+
+def open_position(spec):
+    # Build a position provider from a spec string:
+    #   nmea:PORT[@BAUD[,TRACK]]             GPS receiver speaking NMEA
+    #   fixed:LAT,LON[@TRACK,CHAINAGE]       a sensor that does not move
+    #   odometry:LAT,LON@BEARING,SPEED[,TRACK[,CHAINAGE]]
+    #                                        dead reckoning from a start point
+    #   ip                                   geocoder fix of the public IP;
+    #                                        kilometres off, see GeocoderPosition
+    #   none                                 no positions
+    spec, _, option = spec.partition('@')
+    kind, _, target = spec.partition(':')
+    options = option.split(',') if option else []
+    if kind == 'none':
+        return None
+    if kind == 'ip':
+        log.warning("Positions from the public IP address are kilometres off; events will not "
+                    "match by location")
+        return GeocoderPosition()
+    if kind == 'nmea':
+        baud_rate = int(options[0]) if options and options[0] else 4800
+        track = options[1] if len(options) > 1 else None
+        return NmeaPosition(target, baud_rate, track)
+    lat, lon = (float(v) for v in target.split(','))
+    if kind == 'fixed':
+        track = options[0] if options else None
+        chainage = float(options[1]) if len(options) > 1 else None
+        return FixedPosition(lat, lon, track, chainage)
+    if kind == 'odometry':
+        bearing = float(options[0]) if options else 0.0
+        speed = float(options[1]) if len(options) > 1 else 20.0
+        track = options[2] if len(options) > 2 else 'track'
+        chainage = float(options[3]) if len(options) > 3 else 0.0
+        return OdometryPosition(lat, lon, bearing, speed, track, chainage)
+    raise ValueError(f"Unknown position provider: {spec}")
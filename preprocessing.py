@@ -0,0 +1,141 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+# Band energies reported by extract_features, in Hz
+DEFAULT_BANDS = ((20, 200), (200, 500), (500, 1000), (1000, 2000))
+
+
+def sliding_windows(values, window, step):
+    # Zero-copy (n_windows, window) view over a 1-D array
+    if len(values) < window:
+        return np.empty((0, window), dtype=values.dtype)
+    return sliding_window_view(values, window)[::step]
+
+
+def bandpass_taps(low, high, sample_rate, numtaps=101):
+    # Windowed-sinc (Hamming) band-pass FIR design
+    if numtaps % 2 == 0:
+        numtaps += 1
+    nyquist = sample_rate / 2
+    high = min(high, nyquist * 0.99)
+    n = np.arange(numtaps) - (numtaps - 1) / 2
+    taps = (2 * high / sample_rate) * np.sinc(2 * high / sample_rate * n)
+    taps -= (2 * low / sample_rate) * np.sinc(2 * low / sample_rate * n)
+    window = np.hamming(numtaps)
+    taps *= window
+    # A low edge narrower than the filter can resolve leaks DC; remove it
+    taps -= window * (taps.sum() / window.sum())
+    # Unit gain at the centre of the pass band
+    centre = (low + high) / 2
+    gain = np.abs(np.sum(taps * np.exp(-2j * np.pi * centre / sample_rate * np.arange(numtaps))))
+    return taps / gain
+
+
+class StreamingFIR:
+    # FIR filter applied chunk by chunk. The last len(taps) - 1 inputs are
+    # carried over, so filtering a stream in pieces gives the same output as
+    # filtering it in one go. Before the first chunk the history is filled
+    # with the first sample, so a DC offset does not cause a start-up spike.
+
+    def __init__(self, taps):
+        self.taps = np.asarray(taps, dtype=np.float64)
+        self._history = None
+
+    @classmethod
+    def bandpass(cls, low, high, sample_rate, numtaps=101):
+        return cls(bandpass_taps(low, high, sample_rate, numtaps))
+
+    def reset(self):
+        self._history = None
+
+    def process(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if not len(chunk):
+            return chunk
+        if self._history is None:
+            self._history = np.full(len(self.taps) - 1, chunk[0])
+        # Missing samples would poison every output they touch; hold the last value
+        if not np.isfinite(chunk).all():
+            chunk = _fill_gaps(chunk, self._history[-1] if len(self._history) else 0.0)
+        extended = np.concatenate((self._history, chunk))
+        self._history = extended[len(extended) - len(self.taps) + 1:]
+        return np.convolve(extended, self.taps, mode='valid')
+
+
+def _fill_gaps(values, first):
+    # Forward-fill NaNs, vectorized
+    values = values.copy()
+    if not np.isfinite(values[0]):
+        values[0] = first
+    missing = ~np.isfinite(values)
+    idx = np.where(missing, 0, np.arange(len(values)))
+    np.maximum.accumulate(idx, out=idx)
+    return values[idx]
+
+
+def power_spectra(windows, sample_rate):
+    # Hann-windowed one-sided power spectral density of every row
+    window = np.hanning(windows.shape[1])
+    spectrum = np.fft.rfft((windows - windows.mean(axis=1, keepdims=True)) * window, axis=1)
+    psd = np.abs(spectrum) ** 2 / (sample_rate * np.sum(window ** 2))
+    psd[:, 1:-1] *= 2
+    return np.fft.rfftfreq(windows.shape[1], 1 / sample_rate), psd
+
+
+def welch(values, sample_rate, nperseg=256, overlap=0.5):
+    # Welch PSD estimate: mean of overlapping Hann-windowed segments
+    step = max(1, int(nperseg * (1 - overlap)))
+    freqs, psd = power_spectra(sliding_windows(np.asarray(values, dtype=np.float64), nperseg, step),
+                               sample_rate)
+    return freqs, psd.mean(axis=0)
+
+
+def feature_names(bands=DEFAULT_BANDS):
+    return ('rms', 'kurtosis', 'crest_factor', 'spectral_centroid') + tuple(
+        f'band_{low:g}_{high:g}' for low, high in bands)
+
+
+def extract_features(windows, sample_rate, bands=DEFAULT_BANDS):
+    # Time and frequency domain features for every row of a 2-D array of
+    # windows. Returns {name: array of shape (n_windows,)}.
+    windows = np.asarray(windows, dtype=np.float64)
+    centred = windows - windows.mean(axis=1, keepdims=True)
+    variance = np.mean(centred ** 2, axis=1)
+    rms = np.sqrt(np.mean(windows ** 2, axis=1))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kurtosis = np.mean(centred ** 4, axis=1) / variance ** 2
+        crest = np.max(np.abs(windows), axis=1) / rms
+        freqs, psd = power_spectra(windows, sample_rate)
+        total = psd.sum(axis=1)
+        centroid = psd @ freqs / total
+
+    features = dict(zip(feature_names(bands)[:4], (rms, kurtosis, crest, centroid)))
+    df = freqs[1] - freqs[0] if len(freqs) > 1 else 0.0
+    for name, (low, high) in zip(feature_names(bands)[4:], bands):
+        in_band = (freqs >= low) & (freqs < high)
+        features[name] = psd[:, in_band].sum(axis=1) * df
+    return features
+
+
+class FeaturePipeline:
+    # Band-pass filter a raw ADC stream and extract features over overlapping
+    # windows, chunk by chunk. process() returns the filtered chunk and the
+    # features of every window completed by it.
+
+    def __init__(self, sample_rate, band=(20, 2000), window=256, step=128, bands=DEFAULT_BANDS,
+                 numtaps=101):
+        self.sample_rate = sample_rate
+        self.window = window
+        self.step = step
+        self.bands = bands
+        self.filter = StreamingFIR.bandpass(band[0], band[1], sample_rate, numtaps)
+        self._pending = np.empty(0)
+
+    def process(self, chunk):
+        filtered = self.filter.process(chunk)
+        self._pending = np.concatenate((self._pending, filtered))
+        windows = sliding_windows(self._pending, self.window, self.step)
+        self._pending = self._pending[len(windows) * self.step:]
+        return filtered, extract_features(windows, self.sample_rate, self.bands)
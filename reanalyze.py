@@ -0,0 +1,279 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from anomaly_detector import Autoencoder, score_windows
+from event_index import EventIndex, EventLogger
+from metrics import get_logger
+from positioning import open_position
+from preprocessing import FeaturePipeline, sliding_windows
+from recorder import Segment, list_runs, list_segments
+
+
+# Offline re-analysis of recorded runs (see recorder), e.g. after retuning
+# the detection threshold or the denoising filter:
+#
+#   python reanalyze.py --output retuned --threshold 0.8
+#   python reanalyze.py run-20240301-081500 --band 50 1500 --workers 8
+#
+# Every run is cut into chunks of whole detector steps that are scored in a
+# process pool with the live path's filter, windowing and scoring code.
+# Each chunk reads numtaps - 1 samples before its start to warm the filter
+# up and one window past its end, so the windows and scores come out as if
+# the run had been filtered in one piece. Events go to <output>/events.sqlite
+# and a summary of every run to <output>/<run>.json.
+#
+# <output>/manifest.json records the settings, the chunk plan and every
+# chunk that is done, so an interrupted job picks up where it stopped when
+# run again with the same settings. A chunk's events are replaced as a
+# whole, so a chunk that was written but not yet recorded as done is not
+# counted twice.
+
+MANIFEST = 'manifest.json'
+EVENTS_DB = 'events.sqlite'
+CHUNK_SECONDS = 300
+
+log = get_logger('reanalyze')
+
+
+def plan_run(root, run):
+    # Segments of a run with their sample counts
+    segments = [(segment.path, len(segment.columns()['time'])) for segment in list_segments(root, run)]
+    return {'segments': segments, 'samples': sum(count for _, count in segments)}
+
+
+def plan_chunks(plan, sample_rate, chunk_seconds, step, skip=0):
+    # Chunk boundaries as sample indices across the run, from `skip` on,
+    # each chunk a whole number of steps
+    total = plan['samples']
+    size = max(step, int(chunk_seconds * sample_rate) // step * step)
+    return [[lo, min(lo + size, total)] for lo in range(skip, total, size)]
+
+
+def read_columns(segments, lo, hi):
+    # (time, adc) of samples lo to hi of a run, across its segments
+    times, adc = [], []
+    first = 0
+    for path, count in segments:
+        if first >= hi:
+            break
+        if first + count > lo:
+            columns = Segment(path).columns()
+            part = slice(max(lo - first, 0), min(hi - first, count))
+            times.append(np.asarray(columns['time'][part]))
+            adc.append(np.asarray(columns['adc'][part]))
+        first += count
+    if not times:
+        return np.empty(0), np.empty(0)
+    return np.concatenate(times), np.concatenate(adc)
+
+
+def make_pipeline(settings):
+    return FeaturePipeline(settings['sample_rate'], tuple(settings['band']), numtaps=settings['numtaps'])
+
+
+def score_chunk(task):
+    # Worker: score the windows that start in samples lo to hi of one run
+    settings, model = task['settings'], task['model']
+    window, step = model.window, settings['step']
+    lo, hi = task['chunk']
+    pipeline = make_pipeline(settings)
+    warmup = min(lo, len(pipeline.filter.taps) - 1)
+    times, adc = read_columns(task['segments'], lo - warmup, hi - step + window)
+    filtered = pipeline.filter.process(adc)[warmup:]
+    times = times[warmup:]
+    windows = sliding_windows(filtered, window, step)[:-(-(hi - lo) // step)]
+    ends = times[window - 1::step][:len(windows)]
+    result = {'run': task['run'], 'index': task['index'], 'samples': hi - lo, 'windows': len(windows),
+              'anomalies': [], 'features': None, 'score_sum': 0.0, 'score_max': None,
+              't0': float(ends[0]) if len(ends) else None, 't1': float(ends[-1]) if len(ends) else None}
+    if not len(windows):
+        return result
+    scores, _, anomalies, features = score_windows(model, windows, ends, pipeline)
+    result.update(anomalies=anomalies, features=features, score_sum=float(scores.sum()),
+                  score_max=float(scores.max()))
+    return result
+
+
+def calibrate(plan, settings, windows):
+    # Fit a model on the first `windows` windows of a run, as the live
+    # detector does when it starts without one
+    window = settings['window']
+    step = settings['step']
+    _, adc = read_columns(plan['segments'], 0, (windows - 1) * step + window)
+    filtered = make_pipeline(settings).filter.process(adc)
+    return Autoencoder.fit_linear(sliding_windows(filtered, window, step))
+
+
+def load_manifest(path, settings, restart):
+    if restart or not os.path.exists(path):
+        return {'settings': settings, 'runs': {}}
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest['settings'] != settings:
+        raise SystemExit(f"{path} was written with other settings; use --restart or another --output")
+    return manifest
+
+
+def save_json(path, document):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(document, f)
+    os.replace(path + '.tmp', path)
+
+
+def summarize(run, state):
+    done = state['done'].values()
+    windows = sum(chunk['windows'] for chunk in done)
+    maxima = [chunk['score_max'] for chunk in done if chunk['score_max'] is not None]
+    return {
+        'run': run,
+        'samples': state['plan']['samples'],
+        'chunks': len(state['done']),
+        'start': min((chunk['t0'] for chunk in done if chunk['t0'] is not None), default=None),
+        'end': max((chunk['t1'] for chunk in done if chunk['t1'] is not None), default=None),
+        'threshold': state['threshold'],
+        'windows_scored': windows,
+        'anomalies': sum(chunk['anomalies'] for chunk in done),
+        'mean_score': sum(chunk['score_sum'] for chunk in done) / windows if windows else None,
+        'max_score': max(maxima, default=None),
+    }
+
+
+def reanalyze(root, runs, output, settings, model=None, workers=None, positions=None, restart=False,
+              calibration_windows=2000):
+    # Score `runs` under `root` into `output`; returns the run summaries
+    os.makedirs(output, exist_ok=True)
+    manifest_path = os.path.join(output, MANIFEST)
+    manifest = load_manifest(manifest_path, settings, restart)
+    index = EventIndex(os.path.join(output, EVENTS_DB))
+    if restart:
+        for run in runs:
+            index.remove(run)
+
+    # Plan (or take up the recorded plan of) every run, with its model
+    tasks = []
+    models = {}
+    for run in runs:
+        state = manifest['runs'].get(run)
+        if state is None:
+            plan = plan_run(root, run)
+            run_model = model
+            skip = 0
+            if run_model is None:
+                # Calibration windows are not scored live either
+                if plan['samples'] < (calibration_windows - 1) * settings['step'] + settings['window']:
+                    log.warning("%s: too short to calibrate on, skipped", run)
+                    continue
+                run_model = calibrate(plan, settings, calibration_windows)
+                skip = calibration_windows * settings['step']
+            if settings['threshold'] is not None:
+                run_model.threshold = settings['threshold']
+            plan['chunks'] = plan_chunks(plan, settings['sample_rate'], settings['chunk_seconds'],
+                                         settings['step'], skip)
+            state = manifest['runs'][run] = {
+                'plan': plan,
+                'threshold': float(run_model.threshold),
+                'model': os.path.join(output, f'{run}.model.npz'),
+                'done': {},
+            }
+            run_model.save(state['model'])
+            save_json(manifest_path, manifest)
+        models[run] = Autoencoder.load(state['model'])
+        for i, chunk in enumerate(state['plan']['chunks']):
+            if str(i) not in state['done']:
+                tasks.append({'run': run, 'index': i, 'chunk': chunk, 'segments': state['plan']['segments'],
+                              'settings': settings, 'model': models[run]})
+
+    loggers = {run: EventLogger(index, positions, None, run) for run in models}
+    total = sum(task['chunk'][1] - task['chunk'][0] for task in tasks)
+    log.info("%d chunks to score (%d samples) in %d runs", len(tasks), total, len(models))
+    start = time.perf_counter()
+    scored = 0
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers or os.cpu_count(), mp_context=context) as pool:
+        futures = [pool.submit(score_chunk, task) for task in tasks]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                run = result['run']
+                state = manifest['runs'][run]
+                if result['t0'] is not None:
+                    # Replace whatever an interrupted pass left of this chunk
+                    index.remove(run, result['t0'], np.nextafter(result['t1'], np.inf))
+                if result['anomalies']:
+                    loggers[run](result['anomalies'], state['threshold'], result['features'])
+                state['done'][str(result['index'])] = {
+                    'windows': result['windows'], 'anomalies': len(result['anomalies']),
+                    'score_sum': result['score_sum'], 'score_max': result['score_max'],
+                    't0': result['t0'], 't1': result['t1'],
+                }
+                save_json(manifest_path, manifest)
+                scored += result['samples']
+                if len(state['done']) == len(state['plan']['chunks']):
+                    save_json(os.path.join(output, f'{run}.json'), summarize(run, state))
+        except KeyboardInterrupt:
+            for future in futures:
+                future.cancel()
+            log.warning("Interrupted; run again with the same settings to resume")
+            raise
+        finally:
+            index.close()
+    elapsed = time.perf_counter() - start
+    if scored:
+        log.info("Scored %d samples in %.1f s (%.0f samples/s)", scored, elapsed, scored / elapsed)
+    return [summarize(run, manifest['runs'][run]) for run in models]
+
+
+def main():
+    from acquisition import AUTOENCODER_MODEL, BANDPASS, RECORD_DIR, SAMPLE_RATE
+    parser = argparse.ArgumentParser(description='Re-score recorded runs with new detector settings')
+    parser.add_argument('runs', nargs='*', help='runs to score (default: every run under --root)')
+    parser.add_argument('--root', default=RECORD_DIR, help='recordings directory')
+    parser.add_argument('--output', default='reanalysis', help='directory for events, summaries and progress')
+    parser.add_argument('--model', help=f"autoencoder to score with, e.g. {AUTOENCODER_MODEL} "
+                                        "(default: calibrate on the start of every run, as live)")
+    parser.add_argument('--threshold', type=float, help='override the model threshold')
+    parser.add_argument('--sample-rate', type=float, default=SAMPLE_RATE)
+    parser.add_argument('--band', type=float, nargs=2, default=BANDPASS, metavar=('LOW', 'HIGH'),
+                        help='band-pass filter edges in Hz')
+    parser.add_argument('--numtaps', type=int, default=101, help='band-pass filter length')
+    parser.add_argument('--step', type=int, default=16, help='samples between windows')
+    parser.add_argument('--window', type=int, default=64, help='window length when calibrating')
+    parser.add_argument('--chunk-seconds', type=float, default=CHUNK_SECONDS)
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per core)')
+    parser.add_argument('--position', help='tag events with positions, see positioning.open_position')
+    parser.add_argument('--restart', action='store_true', help='discard earlier progress in --output')
+    args = parser.parse_args()
+
+    model = Autoencoder.load(args.model) if args.model else None
+    settings = {
+        'model': os.path.abspath(args.model) if args.model else None,
+        'threshold': args.threshold,
+        'sample_rate': args.sample_rate,
+        'band': list(args.band),
+        'numtaps': args.numtaps | 1,
+        'step': args.step,
+        'window': model.window if model is not None else args.window,
+        'chunk_seconds': args.chunk_seconds,
+    }
+    runs = args.runs or list_runs(args.root)
+    positions = open_position(args.position) if args.position else None
+    try:
+        summaries = reanalyze(args.root, runs, args.output, settings, model, args.workers, positions,
+                              args.restart)
+    except KeyboardInterrupt:
+        return
+    for summary in summaries:
+        mean = summary['mean_score']
+        print(f"{summary['run']}: {summary['windows_scored']} windows, {summary['anomalies']} anomalies, "
+              f"mean score {mean if mean is None else round(mean, 4)}, threshold {summary['threshold']:.4f}")
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,248 @@
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from metrics import REGISTRY
+from sample_buffer import COLUMNS, Samples, StatusCodes
+
+
+# On-disk layout, one directory per run and per segment:
+#   <root>/<run>/<segment>/time.f64, adc.f64, amplitude.f64, frequency.f64
+#   <root>/<run>/<segment>/status.u8
+#   <root>/<run>/<segment>/index.json   {"start", "end", "count", "status_names"}
+# Column files are raw little-endian arrays that are only ever appended to,
+# so a reader can memory-map them while the recorder is still writing.
+# index.json is rewritten at every flush and when the segment is closed.
+COLUMN_FILES = {name: (f'{name}.f64', '<f8') for name in COLUMNS}
+COLUMN_FILES['status'] = ('status.u8', 'u1')
+INDEX_FILE = 'index.json'
+
+
+def run_name(timestamp):
+    return time.strftime('run-%Y%m%d-%H%M%S', time.localtime(timestamp))
+
+
+class Recorder:
+    # Appends every sample to segmented columnar files. extend() has the same
+    # signature as SampleBuffer.extend, so it can sit next to the buffer as
+    # an ingest sink. Samples are buffered in memory and written out in one
+    # write per column once batch_size samples or flush_interval seconds have
+    # accumulated. Segments rotate after segment_samples samples or
+    # segment_seconds seconds; closed segments older than max_age seconds or
+    # beyond max_bytes in total (across all runs under root) are deleted.
+
+    def __init__(self, root, run=None, batch_size=4096, flush_interval=1.0,
+                 segment_samples=1_000_000, segment_seconds=3600, max_age=None, max_bytes=None):
+        self.root = root
+        self.run = run or run_name(time.time())
+        self.path = os.path.join(root, self.run)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_samples = segment_samples
+        self.segment_seconds = segment_seconds
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.status_codes = StatusCodes()
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+        self._pending = []
+        self._pending_count = 0
+        self._last_flush = time.monotonic()
+        self._segment = None
+        self._files = None
+        self._segment_index = None
+        # A reopened run continues after its newest segment; retention may
+        # have deleted older ones, so counting them is not enough
+        numbers = [int(name[len('segment-'):]) for name in os.listdir(self.path)
+                   if name.startswith('segment-') and name[len('segment-'):].isdigit()]
+        self._segment_number = max(numbers, default=-1) + 1
+
+        self.samples_written = 0
+        self.flushes = 0
+        self._flush_seconds = REGISTRY.histogram(
+            'tejas_record_flush_seconds', 'Time to write one batch to disk', run=self.run)
+
+    def extend(self, timestamp, adc, amplitude, frequency, status):
+        codes = self.status_codes.encode(status)
+        n = len(codes)
+        if not n:
+            return
+        batch = {
+            'time': np.broadcast_to(np.asarray(timestamp, dtype='<f8'), n),
+            'adc': np.asarray(adc, dtype='<f8'),
+            'amplitude': np.asarray(amplitude, dtype='<f8'),
+            'frequency': np.asarray(frequency, dtype='<f8'),
+            'status': codes,
+        }
+        with self.lock:
+            self._pending.append(batch)
+            self._pending_count += n
+            if (self._pending_count >= self.batch_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self._close_segment()
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        start = time.perf_counter()
+        columns = {name: np.concatenate([batch[name] for batch in self._pending])
+                   for name in COLUMN_FILES}
+        self._pending = []
+        self._pending_count = 0
+
+        while len(columns['time']):
+            if self._segment is None or self._segment_full(columns['time'][0]):
+                self._close_segment()
+                self._open_segment(columns['time'][0])
+            room = self.segment_samples - self._segment_index['count']
+            part = {name: values[:room] for name, values in columns.items()}
+            columns = {name: values[room:] for name, values in columns.items()}
+            for name, values in part.items():
+                self._files[name].write(values.tobytes())
+                self._files[name].flush()
+            count = len(part['time'])
+            index = self._segment_index
+            index['count'] += count
+            index['end'] = float(np.nanmax(np.append(part['time'], index['end'] or -np.inf)))
+            index['status_names'] = [name.decode('ascii', errors='replace')
+                                     for name in self.status_codes.names]
+            self._write_index()
+            self.samples_written += count
+        self.flushes += 1
+        self._flush_seconds.observe(time.perf_counter() - start)
+
+    def _segment_full(self, next_time):
+        index = self._segment_index
+        return (index['count'] >= self.segment_samples
+                or next_time - index['start'] >= self.segment_seconds)
+
+    def _open_segment(self, start):
+        self._segment = os.path.join(self.path, f'segment-{self._segment_number:06d}')
+        self._segment_number += 1
+        os.makedirs(self._segment)
+        self._files = {name: open(os.path.join(self._segment, filename), 'ab')
+                       for name, (filename, _) in COLUMN_FILES.items()}
+        self._segment_index = {'start': float(start), 'end': None, 'count': 0, 'closed': False}
+
+    def _close_segment(self):
+        if self._segment is None:
+            return
+        for f in self._files.values():
+            f.close()
+        self._segment_index['closed'] = True
+        self._write_index()
+        self._segment = None
+        self._files = None
+        self.apply_retention()
+
+    def _write_index(self):
+        tmp = os.path.join(self._segment, INDEX_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self._segment_index, f)
+        os.replace(tmp, os.path.join(self._segment, INDEX_FILE))
+
+    def apply_retention(self):
+        # Delete the oldest closed segments past max_age or max_bytes
+        if self.max_age is None and self.max_bytes is None:
+            return []
+        segments = [s for s in list_segments(self.root) if s.closed]
+        segments.sort(key=lambda s: s.start)
+        sizes = [s.nbytes for s in segments]
+        total = sum(sizes)
+        removed = []
+        now = time.time()
+        for segment, size in zip(segments, sizes):
+            too_old = self.max_age is not None and now - segment.end > self.max_age
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not (too_old or too_big):
+                break
+            shutil.rmtree(segment.path, ignore_errors=True)
+            total -= size
+            removed.append(segment.path)
+        return removed
+
+
+class Segment:
+    # Read-only, memory-mapped view of one segment
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.start = index['start']
+        self.end = index['end'] if index['end'] is not None else index['start']
+        self.closed = index.get('closed', False)
+        self.status_names = index.get('status_names', [])
+        self._columns = None
+
+    @property
+    def nbytes(self):
+        return sum(os.path.getsize(os.path.join(self.path, filename))
+                   for filename, _ in COLUMN_FILES.values())
+
+    def columns(self):
+        # Map the columns; the sample count is what every column file holds,
+        # so samples being appended right now are simply not visible yet
+        if self._columns is None or not self.closed:
+            sizes = {name: os.path.getsize(os.path.join(self.path, filename)) // np.dtype(dtype).itemsize
+                     for name, (filename, dtype) in COLUMN_FILES.items()}
+            count = min(sizes.values())
+            self._columns = {
+                name: (np.memmap(os.path.join(self.path, filename), dtype=dtype, mode='r', shape=(count,))
+                       if count else np.empty(0, dtype=dtype))
+                for name, (filename, dtype) in COLUMN_FILES.items()
+            }
+        return self._columns
+
+    def slice(self, t0, t1):
+        # Zero-copy views of the samples with t0 <= time < t1
+        columns = self.columns()
+        times = columns['time']
+        lo, hi = np.searchsorted(times, [t0, t1])
+        return Samples(*(columns[name][lo:hi] for name in COLUMNS), status=columns['status'][lo:hi])
+
+
+def list_runs(root):
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+
+
+def list_segments(root, run=None):
+    segments = []
+    for name in [run] if run else list_runs(root):
+        path = os.path.join(root, name)
+        for segment in sorted(os.listdir(path)):
+            if os.path.exists(os.path.join(path, segment, INDEX_FILE)):
+                segments.append(Segment(os.path.join(path, segment)))
+    return segments
+
+
+def query(root, t0, t1, run=None):
+    # Memory-mapped slices of every segment overlapping [t0, t1), oldest first.
+    # Nothing is read from disk until the returned views are used.
+    return [segment.slice(t0, t1) for segment in list_segments(root, run)
+            if segment.start < t1 and segment.end >= t0]
+
+
+def read(root, t0, t1, run=None):
+    # Like query(), but concatenated into one Samples of in-memory arrays
+    parts = query(root, t0, t1, run)
+    if not parts:
+        return Samples(*(np.empty(0) for _ in COLUMNS), status=np.empty(0, dtype=np.uint8))
+    return Samples(*(np.concatenate(column) for column in zip(*parts)))
@@ -0,0 +1,256 @@
+import argparse
+import threading
+import time
+import timeit
+from collections import namedtuple
+
+import numpy as np
+
+
+# Pre-aggregated history at several resolutions, so a chart over an hour or
+# a day reads a few hundred buckets instead of millions of samples. Every
+# tier is a ring of `capacity` buckets addressed by bucket number (time //
+# width), which keeps gaps in the data gaps and makes a range query a
+# slice. Each tier's width must be a whole multiple of the one before it:
+# the coarser tiers are built from the finer buckets of the same batch.
+
+TIERS = (0.1, 1.0, 10.0, 60.0)  # bucket widths in seconds
+TIER_CAPACITY = 36000  # 1 h at 0.1 s, 10 h at 1 s, 100 h at 10 s, 25 days at 1 min
+
+# The sample columns that are rolled up
+ROLLUP_COLUMNS = ('amplitude', 'frequency')
+
+# Fields of a bucket row; the bucket number is -1 in slots never written.
+# Fields merged the same way are adjacent, so they can be sliced together.
+FIELDS = (('bucket', 'anomalies', 'count')
+          + tuple(f'{column}_{statistic}' for statistic in ('sum', 'sumsq') for column in ROLLUP_COLUMNS)
+          + tuple(f'{column}_min' for column in ROLLUP_COLUMNS)
+          + tuple(f'{column}_max' for column in ROLLUP_COLUMNS))
+_BUCKET, _ANOMALIES, _COUNT = range(3)
+_ADD = slice(_COUNT, _COUNT + 1 + 2 * len(ROLLUP_COLUMNS))
+_MIN = slice(_ADD.stop, _ADD.stop + len(ROLLUP_COLUMNS))
+_MAX = slice(_MIN.stop, _MIN.stop + len(ROLLUP_COLUMNS))
+
+
+# Summary of one column over the buckets of a query
+Stats = namedtuple('Stats', ('min', 'max', 'mean', 'rms'))
+
+# Result of Rollups.query(): bucket start times, sample and anomaly counts
+# per bucket, and a Stats per rolled-up column
+Rollup = namedtuple('Rollup', ('width', 'time', 'count', 'anomalies') + ROLLUP_COLUMNS)
+
+
+def _group(buckets, rows):
+    # Merge rows that share a bucket number; buckets must be sorted
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    merged = np.empty((len(starts), len(FIELDS)))
+    merged[:, _BUCKET] = buckets[starts]
+    merged[:, _ANOMALIES] = 0
+    merged[:, _ADD] = np.add.reduceat(rows[:, _ADD], starts)
+    merged[:, _MIN] = np.minimum.reduceat(rows[:, _MIN], starts)
+    merged[:, _MAX] = np.maximum.reduceat(rows[:, _MAX], starts)
+    return merged
+
+
+class Rollups:
+    # Maintains the tiers incrementally. extend() has the same signature as
+    # SampleBuffer.extend, so it can sit next to the buffer as an ingest
+    # sink; mark() counts anomalies by window time.
+
+    def __init__(self, tiers=TIERS, capacity=TIER_CAPACITY):
+        self.tiers = tuple(tiers)
+        self.capacity = capacity
+        self._ratios = [int(round(coarse / fine)) for fine, coarse in zip(self.tiers, self.tiers[1:])]
+        if any(abs(r * fine - coarse) > 1e-9 * coarse for r, fine, coarse
+               in zip(self._ratios, self.tiers, self.tiers[1:])):
+            raise ValueError(f"Tier widths must be multiples of each other: {self.tiers}")
+        self.lock = threading.Lock()
+        self._tables = self._allocate()
+
+    def _allocate(self):
+        tables = np.full((len(self.tiers), self.capacity, len(FIELDS)), np.nan)
+        tables[:, :, _BUCKET] = -1
+        return tables
+
+    def extend(self, timestamp, adc, amplitude, frequency, status):
+        values = {'amplitude': amplitude, 'frequency': frequency}
+        n = len(status)
+        if not n:
+            return
+        times = np.broadcast_to(np.asarray(timestamp, dtype=np.float64), n)
+        buckets = np.floor(times / self.tiers[0]).astype(np.int64)
+        rows = np.empty((n, len(FIELDS)))
+        rows[:, _COUNT] = 1
+        for column in ROLLUP_COLUMNS:
+            x = np.asarray(values[column], dtype=np.float64)
+            for statistic in ('min', 'max', 'sum'):
+                rows[:, FIELDS.index(f'{column}_{statistic}')] = x
+            rows[:, FIELDS.index(f'{column}_sumsq')] = x * x
+        if n > 1 and np.any(np.diff(buckets) < 0):
+            order = np.argsort(buckets, kind='stable')
+            buckets, rows = buckets[order], rows[order]
+
+        # Group the batch per tier, each tier from the one below it
+        grouped = []
+        for tier in range(len(self.tiers)):
+            if tier:
+                buckets = buckets // self._ratios[tier - 1]
+            rows = _group(buckets, rows)
+            buckets = rows[:, _BUCKET].astype(np.int64)
+            grouped.append(rows)
+        with self.lock:
+            self._write(grouped)
+
+    def merge(self, width, rows):
+        # Fold in bucket rows (see FIELDS) rolled up elsewhere, such as the
+        # summaries an edge node sends (see edge), into the tier `width`
+        # seconds wide and the coarser ones. Anomaly counts are not taken
+        # over; mark() counts those here.
+        tier = self._tier(width)
+        rows = np.array(rows, dtype=np.float64).reshape(-1, len(FIELDS))
+        if not len(rows):
+            return
+        rows = rows[np.argsort(rows[:, _BUCKET], kind='stable')]
+        buckets = rows[:, _BUCKET].astype(np.int64)
+        grouped = [rows[:0]] * tier
+        for coarser in range(tier, len(self.tiers)):
+            if coarser > tier:
+                buckets = buckets // self._ratios[coarser - 1]
+            rows = _group(buckets, rows)
+            buckets = rows[:, _BUCKET].astype(np.int64)
+            grouped.append(rows)
+        with self.lock:
+            self._write(grouped)
+
+    def _tier(self, width):
+        for tier, tier_width in enumerate(self.tiers):
+            if abs(tier_width - width) <= 1e-9 * width:
+                return tier
+        raise ValueError(f"No {width} s tier in {self.tiers}")
+
+    def _write(self, grouped):
+        for table, rows in zip(self._tables, grouped):
+            rows = rows[-self.capacity:]
+            slots = rows[:, _BUCKET].astype(np.int64) % self.capacity
+            current = table[slots]
+            # Fold into buckets already open from an earlier batch
+            same = np.flatnonzero(current[:, _BUCKET] == rows[:, _BUCKET])
+            if len(same):
+                new, old = rows[same], current[same]
+                new[:, _ANOMALIES] = old[:, _ANOMALIES]
+                new[:, _ADD] += old[:, _ADD]
+                new[:, _MIN] = np.minimum(new[:, _MIN], old[:, _MIN])
+                new[:, _MAX] = np.maximum(new[:, _MAX], old[:, _MAX])
+                rows[same] = new
+            table[slots] = rows
+
+    def mark(self, times):
+        # Count an anomaly in every tier at each of `times`. Buckets no
+        # sample has reached are left alone; returns which of `times` were
+        # counted in the finest tier.
+        times = np.asarray(times, dtype=np.float64)
+        if not len(times):
+            return np.zeros(0, dtype=bool)
+        with self.lock:
+            return self._mark(times)
+
+    def _mark(self, times):
+        counted = None
+        for tier, width in enumerate(self.tiers):
+            buckets = np.floor(times / width).astype(np.int64)
+            slots = buckets % self.capacity
+            table = self._tables[tier]
+            hit = table[slots, _BUCKET] == buckets
+            np.add.at(table[:, _ANOMALIES], slots[hit], 1)
+            if counted is None:
+                counted = hit
+        return counted
+
+    def tier_for(self, t0, t1, max_buckets):
+        # The finest tier that covers t0..t1 in at most max_buckets buckets,
+        # or the coarsest tier if none does
+        span = max(t1 - t0, 0.0)
+        for tier, width in enumerate(self.tiers):
+            if span / width <= max_buckets:
+                return tier
+        return len(self.tiers) - 1
+
+    def _rows(self, tier, slots):
+        with self.lock:
+            return self._tables[tier][slots]
+
+    def buckets(self, tier, first, last):
+        # Rows (see FIELDS) of the buckets numbered first to last of a tier
+        # that hold samples, oldest first
+        numbers = np.arange(max(first, last - self.capacity + 1), last + 1)
+        rows = self._rows(tier, numbers % self.capacity)
+        return rows[rows[:, _BUCKET] == numbers]
+
+    def query(self, t0, t1, max_buckets=1000, tier=None):
+        # The buckets of one tier between t0 and t1, oldest first; empty
+        # buckets are left out. The tier is picked with tier_for() unless
+        # given.
+        if tier is None:
+            tier = self.tier_for(t0, t1, max_buckets)
+        width = self.tiers[tier]
+        rows = self.buckets(tier, int(np.floor(t0 / width)), int(np.floor(t1 / width)))
+        count = rows[:, _COUNT]
+        stats = []
+        for column in ROLLUP_COLUMNS:
+            mean = rows[:, FIELDS.index(f'{column}_sum')] / count
+            rms = np.sqrt(rows[:, FIELDS.index(f'{column}_sumsq')] / count)
+            stats.append(Stats(rows[:, FIELDS.index(f'{column}_min')], rows[:, FIELDS.index(f'{column}_max')],
+                               mean, rms))
+        return Rollup(width, rows[:, _BUCKET] * width, count.astype(np.int64),
+                      rows[:, _ANOMALIES].astype(np.int64), *stats)
+
+
+def envelope(rollup, column):
+    # (x, y) of a trace through the minimum and maximum of every bucket,
+    # the same shape decimation.minmax gives raw samples
+    stats = getattr(rollup, column)
+    x = np.repeat(rollup.time + rollup.width / 2, 2)
+    y = np.empty(len(x))
+    y[0::2], y[1::2] = stats.min, stats.max
+    return x, y
+
+
+def main():
+    # Roll up an hour of synthetic data, then time queries from the whole
+    # run down to a few seconds around the first crack
+    from sources import SyntheticSource
+    parser = argparse.ArgumentParser(description='Build rollup tiers from synthetic data and time queries')
+    parser.add_argument('--seconds', type=float, default=3600)
+    parser.add_argument('--rate', type=int, default=5000)
+    parser.add_argument('--buckets', type=int, default=1000, help='most buckets a query may return')
+    args = parser.parse_args()
+
+    source = SyntheticSource(args.rate, crack_rate=0.05, speed=None, seed=0)
+    rollups = Rollups()
+    start = time.time()
+    elapsed = 0.0
+    cracks = []
+    for first in range(0, int(args.seconds * args.rate), args.rate // 10):
+        n = np.arange(first, first + args.rate // 10)
+        adc, amplitude, frequency, status, n = source.generate(n)
+        times = start + n / args.rate
+        begin = time.perf_counter()
+        rollups.extend(times, adc, amplitude, frequency, status)
+        rollups.mark(times[status == 3][::50])
+        elapsed += time.perf_counter() - begin
+        cracks.extend(times[status == 3][:1])
+    samples = int(args.seconds * args.rate)
+    print(f"Rolled up {samples} samples in {elapsed:.2f} s ({samples / elapsed / 1e6:.1f} M samples/s)")
+
+    end = start + args.seconds
+    focus = cracks[0] if cracks else start
+    for label, (t0, t1) in (('whole run', (start, end)), ('10 min', (end - 600, end)),
+                            ('1 min', (end - 60, end)), ('crack +-5 s', (focus - 5, focus + 5))):
+        best = min(timeit.repeat(lambda: rollups.query(t0, t1, args.buckets), number=1, repeat=5))
+        rollup = rollups.query(t0, t1, args.buckets)
+        print(f"{label:12s} tier {rollup.width:5.1f} s  {len(rollup.time):5d} buckets  "
+              f"{rollup.anomalies.sum():5d} anomalies  {best * 1e3:6.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
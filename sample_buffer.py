@@ -0,0 +1,133 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from frame_protocol import STATUS_NAMES
+
+
+COLUMNS = ('time', 'adc', 'amplitude', 'frequency')
+
+# Views returned by SampleBuffer.last() and since(); status holds codes,
+# use SampleBuffer.status_name() to turn them back into text
+Samples = namedtuple('Samples', COLUMNS + ('status',))
+
+
+class StatusCodes:
+    # Maps status strings to uint8 codes, starting with the codes of the
+    # binary frame protocol and adding new strings as they appear
+
+    def __init__(self, names=STATUS_NAMES):
+        self.names = list(names)
+        self._codes = {name: code for code, name in enumerate(self.names)}
+
+    def encode(self, status):
+        names, inverse = np.unique(np.asarray(status, dtype=np.bytes_), return_inverse=True)
+        lookup = np.empty(len(names), dtype=np.uint8)
+        for i, name in enumerate(names):
+            code = self._codes.get(name)
+            if code is None:
+                if len(self.names) < 256:
+                    code = len(self.names)
+                    self.names.append(name)
+                    self._codes[name] = code
+                else:
+                    code = 0
+            lookup[i] = code
+        return lookup[inverse.reshape(-1)]
+
+    def name(self, code):
+        return self.names[code].decode('ascii', errors='replace')
+
+
+class SampleBuffer:
+    # Columnar ring buffer with a fixed memory footprint.
+    #
+    # Every column is allocated at twice the capacity and each sample is
+    # written at both i and i + capacity, so the newest n samples are always
+    # one contiguous slice and last(n) can hand out views without copying.
+    # A view of n samples stays valid while at most capacity - n more
+    # samples are appended; the next one starts overwriting it.
+    # Missing values are NaN.
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.count = 0
+        self.lock = threading.Lock()
+        self.arrived = threading.Condition(self.lock)  # notified after every extend()
+        self._columns = {name: np.full(2 * capacity, np.nan) for name in COLUMNS}
+        self._status = np.zeros(2 * capacity, dtype=np.uint8)
+        self.status_codes = StatusCodes()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, adc_value, amplitude, frequency, status=b'N/A'):
+        self.extend(timestamp, [adc_value], [amplitude], [frequency], [status])
+
+    def extend(self, timestamp, adc, amplitude, frequency, status):
+        # timestamp is either one value for the whole batch or an array
+        codes = self.status_codes.encode(status)
+        n = len(codes)
+        if not n:
+            return
+        values = {'time': timestamp, 'adc': adc, 'amplitude': amplitude, 'frequency': frequency}
+        if n > self.capacity:
+            skip = n - self.capacity
+            values = {name: v if np.ndim(v) == 0 else np.asarray(v)[skip:] for name, v in values.items()}
+            codes = codes[skip:]
+
+        with self.lock:
+            start = self.count % self.capacity
+            for name, column in self._columns.items():
+                self._write(column, start, values[name], len(codes))
+            self._write(self._status, start, codes, len(codes))
+            self.count += n
+            self.arrived.notify_all()
+
+    def wait(self, cursor, timeout=None):
+        # Block until the count has moved past `cursor`, or for at most
+        # timeout seconds; returns the count
+        with self.arrived:
+            self.arrived.wait_for(lambda: self.count != cursor, timeout)
+            return self.count
+
+    def _write(self, column, start, values, n):
+        # Write n values at ring position start into both halves of the column
+        capacity = self.capacity
+        scalar = np.ndim(values) == 0
+        first = min(n, capacity - start)
+        for offset in (0, capacity):
+            column[offset + start:offset + start + first] = values if scalar else values[:first]
+            if first < n:
+                column[offset:offset + n - first] = values if scalar else values[first:]
+
+    def status_name(self, code):
+        return self.status_codes.name(code)
+
+    def _views(self, n):
+        end = self.count % self.capacity + self.capacity
+        window = slice(end - n, end)
+        return Samples(*(self._columns[name][window] for name in COLUMNS),
+                       status=self._status[window])
+
+    def last(self, n=None):
+        # Zero-copy views of the newest n samples, oldest first
+        with self.lock:
+            return self._views(len(self) if n is None else min(n, len(self)))
+
+    def since(self, cursor):
+        # Views of every sample appended after the first `cursor` samples,
+        # plus the cursor to pass next time. Samples that have already been
+        # overwritten are skipped.
+        with self.lock:
+            return self._views(max(0, min(self.count - cursor, len(self)))), self.count
+
+    def latest(self):
+        # The newest sample as plain Python values, or None if empty
+        with self.lock:
+            if not self.count:
+                return None
+            i = self.count % self.capacity + self.capacity - 1
+            values = [float(self._columns[name][i]) for name in COLUMNS]
+            return Samples(*values, status=self.status_name(self._status[i]))
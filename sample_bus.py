@@ -0,0 +1,468 @@
+import atexit
+import json
+import sys
+import threading
+import time
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from anomaly_detector import WindowScore
+from positioning import Position
+from rollups import FIELDS, TIER_CAPACITY, TIERS, Rollups
+from sample_buffer import COLUMNS, Samples, SampleBuffer, StatusCodes
+
+
+# Shared-memory names are <prefix>-state for the state block, <prefix>-<n>
+# for the sample ring of the n-th channel and <prefix>-<n>-rollups for its
+# rollup tiers
+DEFAULT_PREFIX = 'tejas'
+
+# Ring header, uint64 slots
+_COUNT, _RESERVED, _CAPACITY, _NAMES = range(4)
+_HEADER_SLOTS = 8
+STATUS_NAME_SIZE = 64
+MAX_STATUS_NAMES = 256
+
+# A state block whose writer has not published for this long is stale
+STALE_AFTER = 5.0
+# How often a reader in another process checks a bus for new samples; the
+# writer cannot wake it
+READER_POLL = 0.02
+
+
+def bus_name(prefix, index):
+    return f'{prefix}-{index}'
+
+
+def state_name(prefix):
+    return f'{prefix}-state'
+
+
+def rollup_name(prefix, index):
+    return f'{prefix}-{index}-rollups'
+
+
+def open_shared(name, size=0, create=False):
+    if create:
+        return shared_memory.SharedMemory(name, create=True, size=size)
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    shm = shared_memory.SharedMemory(name)
+    # Before 3.13 attaching registers the block with the resource tracker,
+    # which unlinks it when this process exits; only the creator owns it
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+# Every open block, so their arrays can be dropped before interpreter
+# shutdown closes the mappings underneath them
+_open_blocks = weakref.WeakSet()
+
+
+@atexit.register
+def _release_all():
+    for block in list(_open_blocks):
+        block.release()
+
+
+def unlink_shared(name):
+    shm = shared_memory.SharedMemory(name)
+    shm.close()
+    shm.unlink()
+
+
+class _SharedStatusCodes(StatusCodes):
+    # StatusCodes that copies every new name into the bus, so readers in
+    # other processes can decode the codes
+
+    def __init__(self, table, header):
+        super().__init__()
+        self._table = table
+        self._header = header
+        self._publish()
+
+    def encode(self, status):
+        known = len(self.names)
+        codes = super().encode(status)
+        if len(self.names) != known:
+            self._publish()
+        return codes
+
+    def _publish(self):
+        self._table[:len(self.names)] = self.names
+        self._header[_NAMES] = len(self.names)
+
+
+class SampleBus(SampleBuffer):
+    # SampleBuffer in shared memory, with one writer process and any number
+    # of reader processes.
+    #
+    # The writer (create=True) uses it exactly like a SampleBuffer. Readers
+    # attach by name and never take a lock: before writing a batch the writer
+    # raises `reserved` to the count it is about to reach, and after writing
+    # it publishes `count`. A reader copies the slots it wants and then drops
+    # any sample at or below reserved - capacity, which the writer may have
+    # overwritten while it was copying. Readers therefore get copies rather
+    # than views from last(), since() and latest().
+
+    def __init__(self, name, capacity=None, create=False):
+        if create:
+            self.shm = open_shared(name, self._size(capacity), create=True)
+        else:
+            self.shm = open_shared(name)
+            capacity = int(np.ndarray(_HEADER_SLOTS, np.uint64, self.shm.buf)[_CAPACITY])
+        self.name = name
+        self.capacity = capacity
+        self.owner = create
+        self._map(capacity)
+        if create:
+            self._header[:] = 0
+            self._header[_CAPACITY] = capacity
+            for column in self._columns.values():
+                column[:] = np.nan
+            self._status[:] = 0
+        self.lock = threading.Lock()
+        self.arrived = threading.Condition(self.lock)
+        self.status_codes = _SharedStatusCodes(self._names, self._header) if create else None
+        _open_blocks.add(self)
+
+    @staticmethod
+    def _size(capacity):
+        return (_HEADER_SLOTS * 8 + len(COLUMNS) * 2 * capacity * 8 + 2 * capacity
+                + MAX_STATUS_NAMES * STATUS_NAME_SIZE)
+
+    def _map(self, capacity):
+        buf = self.shm.buf
+        offset = 0
+        self._header = np.ndarray(_HEADER_SLOTS, np.uint64, buf, offset)
+        offset += _HEADER_SLOTS * 8
+        self._columns = {}
+        for name in COLUMNS:
+            self._columns[name] = np.ndarray(2 * capacity, np.float64, buf, offset)
+            offset += 2 * capacity * 8
+        self._status = np.ndarray(2 * capacity, np.uint8, buf, offset)
+        offset += 2 * capacity
+        self._names = np.ndarray(MAX_STATUS_NAMES, f'S{STATUS_NAME_SIZE}', buf, offset)
+
+    @property
+    def count(self):
+        return int(self._header[_COUNT])
+
+    @count.setter
+    def count(self, value):
+        self._header[_COUNT] = value
+
+    def extend(self, timestamp, adc, amplitude, frequency, status):
+        if not self.owner:
+            raise PermissionError(f"{self.name} is attached read-only")
+        with self.lock:
+            self._header[_RESERVED] = self.count + len(status)
+        super().extend(timestamp, adc, amplitude, frequency, status)
+
+    def wait(self, cursor, timeout=None):
+        if self.owner:
+            return super().wait(cursor, timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.count == cursor and (deadline is None or time.monotonic() < deadline):
+            time.sleep(READER_POLL)
+        return self.count
+
+    def status_name(self, code):
+        if self.owner:
+            return super().status_name(code)
+        if code >= int(self._header[_NAMES]):
+            return 'N/A'
+        return self._names[code].decode('ascii', errors='replace')
+
+    def _copy(self, n, count):
+        # Copy the newest n of count samples, minus any the writer has
+        # started to overwrite since
+        end = count % self.capacity + self.capacity
+        window = slice(end - n, end)
+        columns = [self._columns[name][window].copy() for name in COLUMNS]
+        status = self._status[window].copy()
+        lost = max(0, int(self._header[_RESERVED]) - self.capacity - (count - n))
+        return Samples(*(column[lost:] for column in columns), status=status[lost:])
+
+    def last(self, n=None):
+        if self.owner:
+            return super().last(n)
+        count = self.count
+        available = min(count, self.capacity)
+        return self._copy(available if n is None else min(n, available), count)
+
+    def since(self, cursor):
+        if self.owner:
+            return super().since(cursor)
+        count = self.count
+        return self._copy(max(0, min(count - cursor, count, self.capacity)), count), count
+
+    def latest(self):
+        if self.owner:
+            return super().latest()
+        count = self.count
+        if not count:
+            return None
+        newest = self._copy(1, count)
+        if not len(newest.time):
+            return None
+        values = [float(getattr(newest, name)[0]) for name in COLUMNS]
+        return Samples(*values, status=self.status_name(newest.status[0]))
+
+    def close(self):
+        # The writer also removes the block
+        if self.owner:
+            self.shm.unlink()
+        self.release()
+
+    def release(self):
+        # Unmap. Views handed out by a writer keep the mapping alive until
+        # they are gone.
+        _open_blocks.discard(self)
+        self._header = self._columns = self._status = self._names = None
+        if self.status_codes is not None:
+            self.status_codes._table = self.status_codes._header = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+
+
+# Rollup header, uint64 slots, followed by the tier widths as float64
+_VERSION, _TIERS, _TIER_CAPACITY = range(3)
+_ROLLUP_HEADER_SLOTS = 4
+MAX_TIERS = 8
+
+
+class RollupBus(Rollups):
+    # Rollups in shared memory, with one writer process and any number of
+    # reader processes. Buckets are updated in place, so the writer makes
+    # the version odd while it writes and readers retry a copy that
+    # overlapped a write, as with SharedState.
+
+    def __init__(self, name, tiers=TIERS, capacity=TIER_CAPACITY, create=False):
+        if create:
+            if len(tiers) > MAX_TIERS:
+                raise ValueError(f"At most {MAX_TIERS} rollup tiers")
+            self.shm = open_shared(name, self._size(len(tiers), capacity), create=True)
+        else:
+            self.shm = open_shared(name)
+            header = np.ndarray(_ROLLUP_HEADER_SLOTS, np.uint64, self.shm.buf)
+            capacity = int(header[_TIER_CAPACITY])
+            widths = np.ndarray(MAX_TIERS, np.float64, self.shm.buf, _ROLLUP_HEADER_SLOTS * 8)
+            tiers = tuple(widths[:int(header[_TIERS])])
+        self.name = name
+        self.owner = create
+        super().__init__(tiers, capacity)
+        _open_blocks.add(self)
+
+    @staticmethod
+    def _size(tiers, capacity):
+        return _ROLLUP_HEADER_SLOTS * 8 + MAX_TIERS * 8 + tiers * capacity * len(FIELDS) * 8
+
+    def _allocate(self):
+        buf = self.shm.buf
+        self._header = np.ndarray(_ROLLUP_HEADER_SLOTS, np.uint64, buf)
+        offset = _ROLLUP_HEADER_SLOTS * 8 + MAX_TIERS * 8
+        tables = np.ndarray((len(self.tiers), self.capacity, len(FIELDS)), np.float64, buf, offset)
+        if self.owner:
+            self._header[:] = 0
+            self._header[_TIERS] = len(self.tiers)
+            self._header[_TIER_CAPACITY] = self.capacity
+            np.ndarray(MAX_TIERS, np.float64, buf, _ROLLUP_HEADER_SLOTS * 8)[:len(self.tiers)] = self.tiers
+            tables[:] = super()._allocate()
+        return tables
+
+    def extend(self, timestamp, adc, amplitude, frequency, status):
+        if not self.owner:
+            raise PermissionError(f"{self.name} is attached read-only")
+        super().extend(timestamp, adc, amplitude, frequency, status)
+
+    def merge(self, width, rows):
+        if not self.owner:
+            raise PermissionError(f"{self.name} is attached read-only")
+        super().merge(width, rows)
+
+    def mark(self, times):
+        if not self.owner:
+            raise PermissionError(f"{self.name} is attached read-only")
+        return super().mark(times)
+
+    def _write(self, grouped):
+        self._header[_VERSION] += 1
+        super()._write(grouped)
+        self._header[_VERSION] += 1
+
+    def _mark(self, times):
+        self._header[_VERSION] += 1
+        counted = super()._mark(times)
+        self._header[_VERSION] += 1
+        return counted
+
+    def _rows(self, tier, slots):
+        if self.owner:
+            return super()._rows(tier, slots)
+        while True:
+            version = int(self._header[_VERSION])
+            if version % 2:
+                time.sleep(0.0005)
+                continue
+            rows = self._tables[tier][slots]
+            if int(self._header[_VERSION]) == version:
+                return rows
+
+    def close(self):
+        # The writer also removes the block
+        if self.owner:
+            self.shm.unlink()
+        self.release()
+
+    def release(self):
+        _open_blocks.discard(self)
+        self._header = self._tables = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+
+
+class SharedState:
+    # A JSON document in shared memory, rewritten by one process and read
+    # by many. The version is odd while a write is in progress; a reader
+    # retries until it sees the same even version before and after copying.
+
+    def __init__(self, name, size=1 << 20, create=False):
+        self.shm = open_shared(name, size, create=create)
+        self.name = name
+        self.owner = create
+        self._header = np.ndarray(2, np.uint64, self.shm.buf)
+        self._body = self.shm.buf[16:]
+        self._version = None
+        self._cached = None
+        if create:
+            self._header[:] = 0
+        _open_blocks.add(self)
+
+    def write(self, document):
+        data = json.dumps(document).encode()
+        if len(data) > len(self._body):
+            raise ValueError(f"State document of {len(data)} bytes does not fit in {self.name}")
+        self._header[0] += 1
+        self._body[:len(data)] = data
+        self._header[1] = len(data)
+        self._header[0] += 1
+
+    def read(self):
+        # The newest complete document, or None before the first write
+        while True:
+            version = int(self._header[0])
+            if version == self._version:
+                return self._cached
+            if version % 2:
+                time.sleep(0.0005)
+                continue
+            data = bytes(self._body[:int(self._header[1])])
+            if int(self._header[0]) == version:
+                break
+        self._version = version
+        self._cached = json.loads(data) if version else None
+        return self._cached
+
+    def close(self):
+        if self.owner:
+            self.shm.unlink()
+        self.release()
+
+    def release(self):
+        _open_blocks.discard(self)
+        self._header = None
+        self._body.release()
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+
+
+def writer_alive(state):
+    # Whether the process that writes a state document is still publishing,
+    # judged by its heartbeat alone: probing the pid is not portable (on
+    # Windows os.kill(pid, 0) sends CTRL_C_EVENT) and a pid can be reused
+    document = state.read()
+    if document is None:
+        return False
+    return time.time() - document['time'] < STALE_AFTER
+
+
+class BusChannel:
+    # Read-only view of a channel published by acquisition, with the same
+    # attributes the dashboard uses on multichannel.LocalChannel
+
+    def __init__(self, name, samples, state, rollups=None):
+        self.name = name
+        self.samples = samples
+        self.state = state
+        self.rollups = rollups
+
+    def _published(self):
+        document = self.state.read() or {}
+        return document.get('channels', {}).get(self.name, {})
+
+    @property
+    def latest(self):
+        latest = self._published().get('latest')
+        return WindowScore(*latest) if latest else None
+
+    @property
+    def latest_features(self):
+        return self._published().get('features')
+
+    @property
+    def threshold(self):
+        return self._published().get('threshold')
+
+    @property
+    def sample_rate(self):
+        return self._published().get('sample_rate')
+
+    @property
+    def position(self):
+        position = self._published().get('position')
+        return Position(*position) if position else None
+
+    def stats(self):
+        return self._published().get('stats', {})
+
+    def is_alive(self):
+        return writer_alive(self.state) and self._published().get('alive', False)
+
+
+def published_metrics(channels):
+    # Metric snapshots published by the acquisition process behind channels
+    for channel in channels.values():
+        if isinstance(channel, BusChannel):
+            return (channel.state.read() or {}).get('metrics', [])
+    return []
+
+
+def attach_channels(prefix=DEFAULT_PREFIX, timeout=10.0):
+    # Attach to a running acquisition process. Raises FileNotFoundError if
+    # there is none, or only the shared memory of one that died (which the
+    # next acquisition to start reclaims, see acquisition.claim_state).
+    state = SharedState(state_name(prefix))
+    deadline = time.monotonic() + timeout
+    while True:
+        document = state.read()
+        if document is not None and not writer_alive(state):
+            state.close()
+            raise FileNotFoundError(f"Acquisition on {prefix} is no longer running")
+        # The writer claims the state block before its channels exist
+        if document is not None and document.get('order'):
+            break
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Acquisition on {prefix} did not publish any channels")
+        time.sleep(0.05)
+    return {name: BusChannel(name, SampleBus(bus_name(prefix, index)), state,
+                             RollupBus(rollup_name(prefix, index)))
+            for index, name in enumerate(document['order'])}
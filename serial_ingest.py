@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import deque
+
+from clock import Timebase
+from frame_protocol import StreamDecoder
+from metrics import REGISTRY, get_logger, sample
+
+
+log = get_logger('ingest')
+
+
+class SerialIngest(threading.Thread):
+    # Owns a byte source (the serial port, a capture replay or a synthetic
+    # generator, see sources) and drains everything that arrives, handing
+    # parsed samples to on_samples(times, adc, amplitude, frequency, status)
+    # in batches, with the columns as NumPy arrays. Text lines and binary
+    # frames are both accepted, see frame_protocol. Every sample gets its own
+    # host timestamp from the device counter it carries (see clock), so a
+    # burst of backlog keeps its original spacing; sample_rate is the rate
+    # the device is expected to run at, for records without a Time field.
+    # Read, parse and hand-off latencies are recorded in metrics.REGISTRY
+    # under the channel label.
+
+    def __init__(self, source, on_samples, channel='default', sample_rate=None):
+        super().__init__(name='serial-ingest', daemon=True)
+        self.source = source
+        self.on_samples = on_samples
+        self.channel = channel
+        self._stop_event = threading.Event()
+        self.decoder = StreamDecoder()
+        self.timebase = Timebase(sample_rate)
+
+        self._read_seconds = REGISTRY.histogram(
+            'tejas_read_seconds', 'Time spent in one source read', channel=channel)
+        self._parse_seconds = REGISTRY.histogram(
+            'tejas_parse_seconds', 'Time to decode one chunk', channel=channel)
+        self._append_seconds = REGISTRY.histogram(
+            'tejas_append_seconds', 'Time to store one parsed batch', channel=channel)
+        REGISTRY.add_collector(self._collect)
+        self._dropped = 0
+
+        # Counters, only written by the ingest thread
+        self.bytes_received = 0
+        self.samples_parsed = 0
+
+        # (time, samples_parsed) snapshots for the throughput estimate
+        self._rate_window = deque(maxlen=50)
+
+    def open(self):
+        self.source.open()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        REGISTRY.remove_collector(self._collect)
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set() and not self.source.exhausted:
+                start = time.perf_counter()
+                chunk, timestamp = self.source.read()
+                self._read_seconds.observe(time.perf_counter() - start)
+                if chunk:
+                    self.feed(chunk, timestamp)
+                self._sample_rate()
+        finally:
+            self.source.close()
+
+    def feed(self, chunk, timestamp):
+        self.bytes_received += len(chunk)
+        start = time.perf_counter()
+        adc, amplitude, frequency, status, micros, seq = self.decoder.feed(chunk)
+        parsed = len(adc)
+        if parsed:
+            self.samples_parsed += parsed
+            times = self.timebase.stamp(micros, seq, timestamp)
+            stored = time.perf_counter()
+            self._parse_seconds.observe(stored - start)
+            self.on_samples(times, adc, amplitude, frequency, status)
+            self._append_seconds.observe(time.perf_counter() - stored)
+        dropped = self.decoder.lines_dropped + self.decoder.frames_corrupt
+        if dropped != self._dropped:
+            log.warning("%s: %d malformed lines or frames dropped", self.channel, dropped - self._dropped)
+            self._dropped = dropped
+        return parsed
+
+    def _sample_rate(self):
+        now = time.monotonic()
+        if not self._rate_window or now - self._rate_window[-1][0] >= 0.1:
+            self._rate_window.append((now, self.samples_parsed))
+
+    def throughput(self):
+        # Samples per second over roughly the last five seconds
+        if len(self._rate_window) < 2:
+            return 0.0
+        (t0, n0), (t1, n1) = self._rate_window[0], self._rate_window[-1]
+        if t1 <= t0:
+            return 0.0
+        return (n1 - n0) / (t1 - t0)
+
+    def _collect(self):
+        labels = {'channel': self.channel}
+        clock = self.timebase.stats()
+        return [
+            sample('tejas_bytes_received_total', 'Bytes read from the source', 'counter', labels,
+                   self.bytes_received),
+            sample('tejas_lines_received_total', 'Text lines received', 'counter', labels,
+                   self.decoder.lines_received),
+            sample('tejas_frames_received_total', 'Binary frames received', 'counter', labels,
+                   self.decoder.frames_received),
+            sample('tejas_samples_parsed_total', 'Samples parsed', 'counter', labels, self.samples_parsed),
+            sample('tejas_lines_dropped_total', 'Malformed lines and corrupt frames', 'counter', labels,
+                   self.decoder.lines_dropped + self.decoder.frames_corrupt),
+            sample('tejas_frames_lost_total', 'Gaps in frame sequence numbers', 'counter', labels,
+                   self.decoder.frames_lost),
+            sample('tejas_samples_per_second', 'Recent ingest rate', 'gauge', labels, self.throughput()),
+            sample('tejas_clock_drift_ppm', 'Device clock deviation from its nominal rate', 'gauge', labels,
+                   clock['clock_drift_ppm'] or 0.0),
+            sample('tejas_clock_resyncs_total', 'Device clock mapping restarts', 'counter', labels,
+                   clock['clock_resyncs']),
+        ]
+
+    def stats(self):
+        return {
+            'bytes_received': self.bytes_received,
+            'lines_received': self.decoder.lines_received,
+            'frames_received': self.decoder.frames_received,
+            'samples_parsed': self.samples_parsed,
+            'lines_dropped': self.decoder.lines_dropped + self.decoder.frames_corrupt,
+            'frames_lost': self.decoder.frames_lost,
+            'samples_per_second': self.throughput(),
+            **self.timebase.stats(),
+        }
@@ -0,0 +1,294 @@
+import argparse
+import struct
+import time
+
+import numpy as np
+
+from clock import MICROS_WRAP
+from frame_protocol import STATUS_NAMES, encode_frames
+
+
+# Byte sources for SerialIngest. Every source has open(), read() returning
+# (chunk, timestamp) and blocking for at most about a second, an `exhausted`
+# flag that is set once no more data will come, and close().
+
+# Capture files start with CAPTURE_MAGIC, followed by records of
+# (host timestamp float64, length uint32, bytes)
+CAPTURE_MAGIC = b'TEJASCAP1\n'
+RECORD_HEADER = struct.Struct('<dI')
+
+
+class CaptureWriter:
+    # Records raw chunks with their arrival time, for ReplaySource
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(CAPTURE_MAGIC)
+
+    def write(self, chunk, timestamp):
+        self.file.write(RECORD_HEADER.pack(timestamp, len(chunk)))
+        self.file.write(chunk)
+
+    def close(self):
+        self.file.close()
+
+
+class SerialSource:
+    # The Arduino on a serial port, optionally recording everything read
+
+    exhausted = False
+
+    def __init__(self, port, baud_rate=9600, timeout=1, record_to=None):
+        self.port = port
+        self.baud_rate = baud_rate
+        self.timeout = timeout
+        self.record_to = record_to
+        self.ser = None
+        self.capture = None
+
+    def open(self):
+        # pyserial is only needed for real ports, not replays or synthetic data
+        import serial
+        self.ser = serial.Serial(self.port, self.baud_rate, timeout=self.timeout)
+        if self.record_to:
+            self.capture = CaptureWriter(self.record_to)
+        return self
+
+    def read(self):
+        if self.ser is None:
+            self.open()
+        # Block for the first byte, then take everything already waiting
+        chunk = self.ser.read(max(self.ser.in_waiting, 1))
+        waiting = self.ser.in_waiting
+        if waiting:
+            chunk += self.ser.read(waiting)
+        timestamp = time.time()
+        if chunk and self.capture is not None:
+            self.capture.write(chunk, timestamp)
+        return chunk, timestamp
+
+    def close(self):
+        if self.ser is not None:
+            self.ser.close()
+        if self.capture is not None:
+            self.capture.close()
+
+
+class _Paced:
+    # Sleeps so that source time advances `speed` times faster than the wall
+    # clock; speed None replays as fast as possible. wait() sleeps at most a
+    # second, so a reader can still be stopped during a long gap, and says
+    # whether source_time is due; a source returns nothing until it is.
+
+    def __init__(self, speed):
+        self.speed = speed
+        self._origin = None
+
+    def wait(self, source_time):
+        if not self.speed:
+            return True
+        now = time.monotonic()
+        if self._origin is None:
+            self._origin = (now, source_time)
+        due = self._origin[0] + (source_time - self._origin[1]) / self.speed
+        if due <= now:
+            return True
+        time.sleep(min(due - now, 1.0))
+        return time.monotonic() >= due
+
+
+class ReplaySource:
+    # Replays a capture file in real time (speed=1), N times faster
+    # (speed=N) or as fast as possible (speed=None). Files without the
+    # capture header are replayed as raw bytes paced by baud_rate.
+
+    def __init__(self, path, speed=1.0, baud_rate=9600, chunk_size=4096, loop=False):
+        self.path = path
+        self.baud_rate = baud_rate
+        self.chunk_size = chunk_size
+        self.loop = loop
+        self.exhausted = False
+        self._pace = _Paced(speed)
+        self._file = open(path, 'rb')
+        self._captured = self._file.read(len(CAPTURE_MAGIC)) == CAPTURE_MAGIC
+        self._start = self._file.tell() if self._captured else 0
+        self._file.seek(self._start)
+        self._raw_time = 0.0
+        self._offset = 0.0
+        self._first_time = None
+        self._last_time = 0.0
+        self._pending = None  # a chunk read but not due yet
+
+    def open(self):
+        return self
+
+    def read(self):
+        if self._pending is not None:
+            chunk, timestamp = self._pending
+            if not self._pace.wait(timestamp):
+                return b'', timestamp
+            self._pending = None
+            return chunk, timestamp
+        chunk, timestamp = self._next()
+        if not chunk and self.loop:
+            # Keep timestamps increasing across passes
+            self._offset = timestamp - self._first_time + 1.0 / self.baud_rate
+            self._file.seek(self._start)
+            chunk, timestamp = self._next()
+        if not chunk:
+            self.exhausted = True
+            return b'', timestamp
+        if not self._pace.wait(timestamp):
+            self._pending = chunk, timestamp
+            return b'', timestamp
+        return chunk, timestamp
+
+    def _next(self):
+        if self._captured:
+            header = self._file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return b'', self._last_time
+            timestamp, length = RECORD_HEADER.unpack(header)
+            timestamp += self._offset
+            chunk = self._file.read(length)
+        else:
+            chunk = self._file.read(self.chunk_size)
+            self._raw_time += len(chunk) * 10 / self.baud_rate
+            timestamp = self._raw_time + self._offset
+        if self._first_time is None:
+            self._first_time = timestamp
+        self._last_time = timestamp
+        return chunk, timestamp
+
+    def close(self):
+        self._file.close()
+
+
+class SyntheticSource:
+    # Generates the Arduino text format (or binary frames) from a model of a
+    # vibrating rail: a carrier tone plus noise, with decaying high-frequency
+    # bursts injected at random as crack signatures. Paced like ReplaySource.
+    # Text lines carry the Time field of a device whose micros() runs `drift`
+    # fast (e.g. 50e-6 for a crystal 50 ppm fast); timestamps=False leaves
+    # it out, as older sketches do.
+
+    exhausted = False
+
+    def __init__(self, sample_rate=1000, crack_rate=0.2, speed=1.0, binary=False, chunk_seconds=0.01,
+                 seed=None, duration=None, timestamps=True, drift=0.0):
+        self.sample_rate = sample_rate
+        self.crack_rate = crack_rate
+        self.binary = binary
+        self.timestamps = timestamps
+        self.drift = drift
+        self.chunk = max(1, int(sample_rate * chunk_seconds))
+        self.duration = duration
+        self.rng = np.random.default_rng(seed)
+        self.cracks = []
+        self._pace = _Paced(speed)
+        self._start = time.time()
+        self._n = 0
+
+    def open(self):
+        return self
+
+    def read(self):
+        if self.duration is not None and self._n >= self.duration * self.sample_rate:
+            self.exhausted = True
+            return b'', self._start + self._n / self.sample_rate
+        timestamp = self._start + (self._n + self.chunk) / self.sample_rate
+        if not self._pace.wait(timestamp):
+            return b'', timestamp
+        n = np.arange(self._n, self._n + self.chunk)
+        self._n += self.chunk
+        return self.encode(*self.generate(n)), timestamp
+
+    def generate(self, n):
+        t = n / self.sample_rate
+        signal = 0.5 * np.sin(2 * np.pi * 120 * t) + 0.05 * self.rng.standard_normal(len(n))
+        status = np.ones(len(n), dtype=np.uint8)
+
+        # Crack signature: a 25 ms burst at a quarter of the sample rate
+        for _ in range(self.rng.poisson(self.crack_rate * len(n) / self.sample_rate)):
+            self.cracks.append(n[0] + self.rng.integers(len(n)))
+        burst = int(0.025 * self.sample_rate)
+        for onset in self.cracks:
+            k = n - onset
+            hit = (k >= 0) & (k < burst)
+            signal[hit] += 2.0 * np.exp(-k[hit] / (burst / 4)) * np.sin(np.pi / 2 * k[hit])
+            status[hit] = 3
+        self.cracks = [onset for onset in self.cracks if onset + burst > n[-1]]
+
+        amplitude = 2.5 + signal
+        adc = np.clip(np.round(amplitude / 5.0 * 1023), 0, 1023)
+        frequency = np.full(len(n), 120.0)
+        return adc, amplitude, frequency, status, n
+
+    def encode(self, adc, amplitude, frequency, status, n):
+        if self.binary:
+            return encode_frames(adc, amplitude, frequency, status, first_seq=int(n[0]))
+        names = np.array(STATUS_NAMES, dtype=object)[status]
+        if self.timestamps:
+            micros = np.round(n * (1e6 * (1 + self.drift) / self.sample_rate)).astype(np.int64) % MICROS_WRAP
+            prefixes = [f"Time: {us}us | " for us in micros]
+        else:
+            prefixes = [''] * len(n)
+        return ''.join(
+            f"{p}ADC Value: {a:.0f} | Amplitude: {v:.3f}V | Frequency: {f:.1f}Hz | {s.decode()}\r\n"
+            for p, a, v, f, s in zip(prefixes, adc, amplitude, frequency, names)
+        ).encode('ascii')
+
+    def close(self):
+        pass
+
+
+def _parse_speed(text):
+    # '1x', '10x', '10' or 'max'
+    if text in ('max', 'fast', '0'):
+        return None
+    return float(text.rstrip('x'))
+
+
+def open_source(spec, record_to=None):
+    # Build a source from a spec string:
+    #   serial:COM6[@baud]             a real port
+    #   replay:capture.bin[@10x|@max]  a capture file
+    #   synthetic[:rate][@10x|@max]    generated data with crack signatures
+    spec, _, option = spec.partition('@')
+    kind, _, target = spec.partition(':')
+    if kind == 'serial':
+        return SerialSource(target, int(option) if option else 9600, record_to=record_to)
+    if kind == 'replay':
+        return ReplaySource(target, _parse_speed(option) if option else 1.0)
+    if kind == 'synthetic':
+        return SyntheticSource(int(target) if target else 1000,
+                               speed=_parse_speed(option) if option else 1.0)
+    raise ValueError(f"Unknown source: {spec}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record a source to a capture file')
+    parser.add_argument('source', help="e.g. serial:COM6@9600 or synthetic:1000@max")
+    parser.add_argument('output', help='capture file to write')
+    parser.add_argument('--seconds', type=float, default=60, help='source time to record')
+    args = parser.parse_args()
+
+    source = open_source(args.source)
+    capture = CaptureWriter(args.output)
+    first = None
+    try:
+        while not source.exhausted:
+            chunk, timestamp = source.read()
+            if first is None:
+                first = timestamp
+            if chunk:
+                capture.write(chunk, timestamp)
+            if timestamp - first >= args.seconds:
+                break
+    finally:
+        capture.close()
+        source.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+import argparse
+import base64
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from preprocessing import power_spectra, sliding_windows
+
+
+# Rolling spectrogram (waterfall) of the raw ADC stream of every channel,
+# for the dashboard. Each channel keeps a ring of the last `capacity` STFT
+# columns: the power of NPERSEG samples every HOP samples, in dB. Columns
+# are only computed for samples that arrived since the last update, and
+# the new columns of all channels at the same sample rate go through one
+# FFT call. The dashboard
+# sends them on as small PNG strips (see png), a few hundred bytes per
+# channel and tick, which the browser scrolls into a canvas.
+
+NPERSEG = 256  # samples per column; 19.5 Hz resolution at 5 kHz
+HOP = 128  # samples between columns; 25.6 ms at 5 kHz
+SECONDS = 15  # how much history a channel's ring covers
+DYNAMIC_RANGE = 70  # dB between black and the brightest colour
+HEADROOM = 10  # dB between the loud end of the columns and the brightest colour
+LEVEL_ALPHA = 0.02  # how far the levels move towards each update's columns
+
+# Colour map from low to high power (viridis, interpolated between these)
+_ANCHORS = ((0.0, (68, 1, 84)), (0.25, (59, 82, 139)), (0.5, (33, 145, 140)), (0.75, (94, 201, 98)),
+            (1.0, (253, 231, 37)))
+COLORMAP = np.stack([np.interp(np.linspace(0, 1, 256), [x for x, _ in _ANCHORS],
+                               [rgb[i] for _, rgb in _ANCHORS]) for i in range(3)], axis=1).astype(np.uint8)
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def encode_png(rgb):
+    # PNG of an (height, width, 3) uint8 array, without an imaging library
+    height, width = rgb.shape[:2]
+    raw = np.zeros((height, 1 + 3 * width), dtype=np.uint8)  # each row starts with filter type 0
+    raw[:, 1:] = rgb.reshape(height, -1)
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)  # 8-bit RGB
+    return (PNG_SIGNATURE + _png_chunk(b'IHDR', header) + _png_chunk(b'IDAT', zlib.compress(raw.tobytes(), 6))
+            + _png_chunk(b'IEND', b''))
+
+
+def png(db, levels):
+    # Base64 PNG of spectrogram columns (time along rows of db), time
+    # running left to right and frequency bottom to top; levels are the dB
+    # values mapped to the ends of the colour map
+    low, high = levels
+    index = np.clip((db - low) * (255 / (high - low)), 0, 255).astype(np.uint8)
+    return base64.b64encode(encode_png(COLORMAP[index.T[::-1]])).decode('ascii')
+
+
+class Spectrogram:
+    # STFT columns of one channel's samples (a SampleBuffer or SampleBus).
+    # frames() and store() are the two halves of an update, split so a
+    # Waterfall can transform the frames of several channels together.
+
+    def __init__(self, samples, sample_rate, nperseg=NPERSEG, hop=HOP, capacity=None):
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.nperseg = nperseg
+        self.hop = hop
+        self.capacity = capacity or int(np.ceil(SECONDS * sample_rate / hop))
+        self.freqs = np.fft.rfftfreq(nperseg, 1 / sample_rate)
+        # Set from the first columns, then following the signal slowly, so
+        # neighbouring strips stay comparable but a gain change or a quieter
+        # train does not leave the picture saturated or black for good
+        self.levels = None
+        self.count = 0  # columns computed so far
+        self._db = np.zeros((self.capacity, len(self.freqs)), dtype=np.float32)
+        self._time = np.zeros(self.capacity)
+        self._cursor = 0
+        self._adc = np.empty(0)
+        self._times = np.empty(0)
+
+    def frames(self):
+        # (frames, end times) of the columns completed by the samples that
+        # arrived since the last call. After a gap (samples overwritten
+        # before they were read) the partial frame is dropped.
+        new, count = self.samples.since(self._cursor)
+        if self._cursor and count - self._cursor > len(new.time):
+            self._adc, self._times = self._adc[:0], self._times[:0]
+        self._cursor = count
+        adc = np.concatenate((self._adc, new.adc))
+        times = np.concatenate((self._times, new.time))
+        frames = sliding_windows(adc, self.nperseg, self.hop)
+        ends = times[self.nperseg - 1::self.hop][:len(frames)]
+        consumed = len(frames) * self.hop
+        self._adc, self._times = adc[consumed:], times[consumed:]
+        return frames, ends
+
+    def store(self, ends, psd):
+        # Append columns of power spectral density
+        n = len(ends)
+        if not n:
+            return
+        db = (10 * np.log10(psd[-self.capacity:] + 1e-20)).astype(np.float32)
+        high = float(np.percentile(db, 99.5)) + HEADROOM
+        if self.levels is not None:
+            high = (1 - LEVEL_ALPHA) * self.levels[1] + LEVEL_ALPHA * high
+        self.levels = (high - DYNAMIC_RANGE, high)
+        slots = (self.count + n - len(db) + np.arange(len(db))) % self.capacity
+        self._db[slots] = db
+        self._time[slots] = ends[-self.capacity:]
+        self.count += n
+
+    def since(self, cursor):
+        # (end times, dB columns) computed after the first `cursor` columns,
+        # at most the ring's worth, plus the cursor to pass next time
+        first = max(cursor, self.count - self.capacity)
+        slots = np.arange(first, self.count) % self.capacity
+        return (self._time[slots], self._db[slots]), self.count
+
+
+class Waterfall:
+    # Spectrograms of several channels (name -> channel with .samples),
+    # brought up to date together by update(); safe to share between the
+    # streams of a dashboard process, whichever of them updates first.
+    # Each channel is transformed at its own .sample_rate; sample_rate is
+    # for channels that do not know theirs.
+
+    def __init__(self, channels, sample_rate, nperseg=NPERSEG, hop=HOP, capacity=None):
+        self.sample_rate = sample_rate
+        self.spectrograms = {}
+        for name, channel in channels.items():
+            rate = getattr(channel, 'sample_rate', None) or sample_rate
+            self.spectrograms[name] = Spectrogram(channel.samples, rate, nperseg, hop, capacity)
+        self.lock = threading.Lock()
+
+    def update(self):
+        # Compute the columns of every channel's new samples; returns how
+        # many were added
+        with self.lock:
+            pending = [(spectrogram, *spectrogram.frames()) for spectrogram in self.spectrograms.values()]
+            by_rate = {}
+            for item in pending:
+                if len(item[1]):
+                    by_rate.setdefault(item[0].sample_rate, []).append(item)
+            added = 0
+            for sample_rate, group in by_rate.items():
+                _, psd = power_spectra(np.concatenate([frames for _, frames, _ in group]), sample_rate)
+                first = 0
+                for spectrogram, frames, ends in group:
+                    spectrogram.store(ends, psd[first:first + len(frames)])
+                    first += len(frames)
+                added += first
+            return added
+
+    def since(self, cursors):
+        # {name: {'time', 'image', 'columns'}} for the channels with columns
+        # after their cursor (a missing cursor means the whole ring), and
+        # the cursors to pass next time
+        strips = {}
+        with self.lock:
+            for name, spectrogram in self.spectrograms.items():
+                (times, db), cursors[name] = spectrogram.since(cursors.get(name, 0))
+                if len(times):
+                    strips[name] = {'time': [float(times[0]), float(times[-1])], 'columns': len(times),
+                                    'image': png(db, spectrogram.levels)}
+        return strips, cursors
+
+    def describe(self):
+        # What the browser needs to size a channel's canvas
+        return {name: {'columns': spectrogram.capacity, 'bins': len(spectrogram.freqs),
+                       'max_freq': float(spectrogram.freqs[-1]), 'seconds': spectrogram.capacity
+                       * spectrogram.hop / spectrogram.sample_rate}
+                for name, spectrogram in self.spectrograms.items()}
+
+
+def main():
+    # Feed synthetic channels through a Waterfall tick by tick and compare
+    # with recomputing the whole window every tick, and the image payload
+    # with the same columns as JSON lists
+    import json
+    from sample_buffer import SampleBuffer
+    from sources import SyntheticSource
+
+    parser = argparse.ArgumentParser(description='Time incremental spectrogram updates on synthetic data')
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--rate', type=int, default=5000)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--tick', type=float, default=0.05, help='seconds of data per dashboard tick')
+    args = parser.parse_args()
+
+    class Channel:
+        def __init__(self, seed):
+            self.samples = SampleBuffer(100000)
+            self.source = SyntheticSource(args.rate, crack_rate=0.2, speed=None, seed=seed)
+
+    channels = {f'ch{i}': Channel(i) for i in range(args.channels)}
+    waterfall = Waterfall(channels, args.rate)
+    tick = int(args.tick * args.rate)
+    start = time.time()
+    incremental = full = 0.0
+    cursors = {}
+    image_bytes = json_bytes = ticks = 0
+    for first in range(0, int(args.seconds * args.rate), tick):
+        n = np.arange(first, first + tick)
+        for channel in channels.values():
+            adc, amplitude, frequency, status, _ = channel.source.generate(n)
+            channel.samples.extend(start + n / args.rate, adc, amplitude, frequency, status)
+        begin = time.perf_counter()
+        waterfall.update()
+        previous = dict(cursors)
+        strips, cursors = waterfall.since(cursors)
+        incremental += time.perf_counter() - begin
+        ticks += 1
+        for name, strip in strips.items():
+            image_bytes += len(strip['image'])
+            (_, db), _ = waterfall.spectrograms[name].since(previous.get(name, 0))
+            json_bytes += len(json.dumps(np.round(db, 1).tolist()))
+
+        # What recomputing and sending the whole ring every tick would cost
+        begin = time.perf_counter()
+        for name, channel in channels.items():
+            spectrogram = waterfall.spectrograms[name]
+            window = channel.samples.last(spectrogram.capacity * HOP + NPERSEG - HOP)
+            _, psd = power_spectra(sliding_windows(np.asarray(window.adc, dtype=np.float64), NPERSEG, HOP),
+                                   args.rate)
+            if len(psd):
+                png(10 * np.log10(psd + 1e-20), spectrogram.levels)
+        full += time.perf_counter() - begin
+
+    columns = sum(spectrogram.count for spectrogram in waterfall.spectrograms.values())
+    print(f"{args.channels} channels, {columns} columns in {ticks} ticks")
+    print(f"Incremental: {incremental / ticks * 1e3:.2f} ms per tick; "
+          f"full redraw: {full / ticks * 1e3:.2f} ms per tick ({full / incremental:.0f}x)")
+    print(f"Payload per tick: {image_bytes / ticks:.0f} bytes as PNG strips, "
+          f"{json_bytes / ticks:.0f} bytes as JSON lists")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from decimation import LiveMinMax, lttb, minmax
+
+
+N = 100_000
+
+
+def spiky_trace(width, sign=1.0):
+    # Noisy baseline with isolated one-sample spikes, three buckets apart so
+    # no two share a bucket at this width
+    rng = np.random.default_rng(width)
+    x = np.linspace(0, 3600, N)
+    y = 2.5 + 0.1 * rng.standard_normal(N)
+    spacing = 3 * N // width
+    spikes = np.arange(spacing // 2, N - spacing // 2, spacing)[:20]
+    spikes = spikes + rng.integers(-spacing // 4, spacing // 4, len(spikes))
+    y[spikes] += sign * 4.0
+    return x, y, spikes
+
+
+@pytest.mark.parametrize('width', [10, 100, 1000, 5000])
+@pytest.mark.parametrize('sign', [1.0, -1.0])
+def test_minmax_keeps_every_spike(width, sign):
+    x, y, spikes = spiky_trace(width, sign)
+    dx, dy = minmax(x, y, width)
+    assert len(dx) <= 2 * width + 2
+    assert set(x[spikes]) <= set(dx)
+    assert set(y[spikes]) <= set(dy)
+
+
+@pytest.mark.parametrize('width', [10, 100, 1000, 5000])
+@pytest.mark.parametrize('sign', [1.0, -1.0])
+def test_lttb_keeps_every_spike(width, sign):
+    x, y, spikes = spiky_trace(width, sign)
+    dx, dy = lttb(x, y, width)
+    assert len(dx) == width
+    assert set(x[spikes]) <= set(dx)
+
+
+@pytest.mark.parametrize('width', [10, 100, 1000])
+def test_decimation_keeps_the_ends(width):
+    x, y, _ = spiky_trace(width)
+    for dx, _ in (minmax(x, y, width), lttb(x, y, width)):
+        assert dx[0] == x[0] and dx[-1] == x[-1]
+
+
+@pytest.mark.parametrize('batch', [13, 100, 5000])
+def test_live_minmax_matches_one_pass(batch):
+    # A trace extended batch by batch, replacing the open bucket's points,
+    # ends up with the extremes of every bucket and nothing else
+    x, y, spikes = spiky_trace(1000)
+    bucket_width = 3600 / 1000
+    live = LiveMinMax(bucket_width)
+    tx, ty = [], []
+    for first in range(0, N, batch):
+        replace, bx, by = live.extend(x[first:first + batch], y[first:first + batch])
+        del tx[len(tx) - replace:], ty[len(ty) - replace:]
+        tx.extend(bx)
+        ty.extend(by)
+    assert live.open <= 2
+    bucket = np.floor(x / bucket_width).astype(np.int64)
+    expected = set()
+    for index in np.unique(bucket):
+        members = np.flatnonzero(bucket == index)
+        expected.update((members[np.argmin(y[members])], members[np.argmax(y[members])]))
+    assert tx == list(x[sorted(expected)])
+    assert set(x[spikes]) <= set(tx)
@@ -0,0 +1,105 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from anomaly_detector import Autoencoder, score_windows
+from edge import CentralReceiver, EdgeForwarder, Uplink
+from event_index import EventIndex
+from positioning import open_position
+from preprocessing import FeaturePipeline, sliding_windows
+from serial_ingest import SerialIngest
+from sources import SyntheticSource
+
+
+RATE = 5000
+SECONDS = 20
+BAND = (20, 2000)
+STEP = 16
+
+
+@pytest.fixture(scope='module')
+def model():
+    clean = SyntheticSource(RATE, crack_rate=0, seed=1).generate(np.arange(RATE * 30))[0]
+    pipeline = FeaturePipeline(RATE, BAND)
+    return Autoencoder.fit_linear(sliding_windows(pipeline.filter.process(clean), 64, STEP))
+
+
+@pytest.fixture(scope='module')
+def loopback(model, tmp_path_factory):
+    # Edge and central node in this process, linked over HTTP on localhost,
+    # with a synthetic stream through the edge; also returns every sample
+    tmp_path = tmp_path_factory.mktemp('edge')
+    index = EventIndex(str(tmp_path / 'events.sqlite'))
+    notified = []
+    central = CentralReceiver(['edge-1'], model, index=index, sample_rate=RATE, band=BAND, step=STEP,
+                              notify=notified.extend)
+    central.listen('127.0.0.1', 0)
+    uplink = Uplink(central.url, str(tmp_path / 'spool'))
+    uplink.start()
+    forwarder = EdgeForwarder(uplink.send, RATE, 'edge-1', 'loopback', BAND,
+                              positions=open_position('odometry:19.07,72.88@45,20,main-line'))
+    full = []
+
+    def store_samples(timestamp, adc, amplitude, frequency, status):
+        forwarder.extend(timestamp, adc, amplitude, frequency, status)
+        full.append((timestamp, np.asarray(adc, dtype=np.float64)))
+
+    source = SyntheticSource(RATE, crack_rate=0.2, speed=None, seed=2, duration=SECONDS)
+    ingest = SerialIngest(source, store_samples, channel='edge-1', sample_rate=RATE).open()
+    ingest.start()
+    ingest.join()
+    ingest.stop()
+    forwarder.flush()
+    deadline = time.monotonic() + 30
+    while len(uplink.outbox) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    uplink.stop()
+    try:
+        yield central, index, notified, uplink, full
+    finally:
+        central.stop()
+        index.close()
+
+
+def reference_anomalies(model, full):
+    # Every sample scored continuously, as a local channel does; windows
+    # over the filter warm-up are not scored at the edge either
+    times = np.concatenate([t for t, _ in full])
+    pipeline = FeaturePipeline(RATE, BAND)
+    filtered = pipeline.filter.process(np.concatenate([a for _, a in full]))
+    windows = sliding_windows(filtered, model.window, STEP)
+    _, _, anomalies, _ = score_windows(model, windows, times[model.window - 1::STEP][:len(windows)])
+    settled = times[len(pipeline.filter.taps) - 1 + model.window - 1]
+    return times, np.array([anomaly.time for anomaly in anomalies if anomaly.time >= settled])
+
+
+def test_everything_reaches_central(loopback):
+    _, _, _, uplink, _ = loopback
+    assert len(uplink.outbox) == 0
+    assert uplink.messages_spooled == 0
+    assert not [name for name in os.listdir(uplink.spool_dir) if name.endswith('.msg')]
+
+
+def test_anomalies_match_full_stream(loopback, model):
+    _, _, notified, _, full = loopback
+    _, expected = reference_anomalies(model, full)
+    found = np.sort([event.time for event in notified])
+    assert len(expected) > 0
+    assert len(found) == len(expected)
+    assert np.allclose(found, np.sort(expected), rtol=0, atol=1e-5)
+
+
+def test_rollups_count_every_sample(loopback, model):
+    central, _, _, _, full = loopback
+    times, expected = reference_anomalies(model, full)
+    summary = central.channels['edge-1'].rollups.query(times[0], times[-1] + 1, tier=0)
+    assert int(summary.count.sum()) == len(times)
+    assert int(summary.anomalies.sum()) == len(expected)
+
+
+def test_events_land_in_index(loopback):
+    _, index, notified, _, _ = loopback
+    assert index.count() == len(notified) > 0
+    assert all(event.id is not None for event in notified)
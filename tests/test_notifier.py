@@ -0,0 +1,116 @@
+import time
+
+import pytest
+
+from event_index import Event
+from notifier import Notifier, StubEndpoint
+
+
+def event(i, lat=19.07, lon=72.88, t=None, severity=2.0):
+    return Event(i, time.time() if t is None else t, 'test', 'default', lat, lon, 'main', 100.0 + i, 1.0,
+                 severity, None)
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+@pytest.fixture
+def stub():
+    server = StubEndpoint()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_notifier(stub, tmp_path):
+    started = []
+
+    def make(**options):
+        options = dict({'linger': 0.2, 'retries': 1, 'backoff': 0.05, 'max_backoff': 0.5, 'timeout': 2.0},
+                       **options)
+        notifier = Notifier(stub.url, spool_dir=str(tmp_path / 'alerts'), **options).start()
+        started.append(notifier)
+        return notifier
+
+    yield make
+    for notifier in started:
+        notifier.stop()
+
+
+def test_events_close_together_become_one_alert(stub, make_notifier):
+    notifier = make_notifier()
+    now = time.time()
+    # Two defects 5 km apart, events interleaved
+    notifier.submit([event(i, lat=19.07 if i % 2 else 19.115, t=now + i * 0.01) for i in range(100)])
+    assert wait_for(lambda: len(stub.alerts) == 2)
+    assert sorted(alert['events'] for alert in stub.alerts) == [50, 50]
+    assert notifier.stats()['alerts_spooled'] == 0
+
+
+def test_large_cluster_is_split(stub, make_notifier):
+    notifier = make_notifier(max_events=30)
+    now = time.time()
+    notifier.submit([event(i, t=now + i * 0.001) for i in range(100)])
+    assert wait_for(lambda: sum(alert['events'] for alert in stub.alerts) == 100)
+    assert max(alert['events'] for alert in stub.alerts) <= 30
+
+
+def test_full_queue_still_coalesces(stub, make_notifier):
+    notifier = make_notifier(queue_size=5)
+    now = time.time()
+    notifier.submit([event(i, t=now + i * 0.001) for i in range(200)])
+    assert wait_for(lambda: sum(alert['events'] for alert in stub.alerts) == 200)
+    assert len(stub.alerts) <= 2
+    assert notifier.spooled() == []
+
+
+def test_alerts_spooled_while_down_are_resent(stub, make_notifier):
+    stub.down = True
+    notifier = make_notifier()
+    notifier.submit([event(1)])
+    assert wait_for(lambda: len(notifier.spooled()) == 1)
+    assert stub.alerts == []
+    assert notifier.stats()['alerts_spooled'] == 1
+
+    stub.down = False
+    assert wait_for(lambda: len(stub.alerts) == 1)
+    assert wait_for(lambda: notifier.spooled() == [])
+    assert notifier.stats()['spool_resent'] == 1
+    assert stub.alerts[0]['events'] == 1
+
+
+def test_rejected_alert_is_set_aside(stub, make_notifier, tmp_path):
+    stub.reject = lambda alert: alert['max_severity'] > 5
+    notifier = make_notifier()
+    notifier.submit([event(1, severity=9.0)])
+    assert wait_for(lambda: notifier.stats()['alerts_rejected'] == 1)
+    assert len(list((tmp_path / 'alerts' / 'rejected').glob('*.json'))) == 1
+    assert notifier.spooled() == []
+    # The endpoint is up; alerts after the rejected one still go out
+    notifier.submit([event(2, lat=19.2)])
+    assert wait_for(lambda: len(stub.alerts) == 1)
+    assert notifier.stats()['retries'] == 0
+
+
+def test_rejected_alert_does_not_block_spool(stub, make_notifier, tmp_path):
+    stub.down = True
+    notifier = make_notifier(window=0.5)
+    now = time.time()
+    notifier.submit([event(1, t=now, severity=9.0)])
+    assert wait_for(lambda: len(notifier.spooled()) == 1)
+    for i in range(3):
+        notifier.submit([event(i + 2, lat=19.1 + i * 0.1, t=now + 10 * (i + 1))])
+    assert wait_for(lambda: len(notifier.spooled()) == 4)
+
+    stub.reject = lambda alert: alert['max_severity'] > 5
+    stub.down = False
+    assert wait_for(lambda: notifier.spooled() == [])
+    assert len(stub.alerts) == 3
+    assert len(list((tmp_path / 'alerts' / 'rejected').glob('*.json'))) == 1
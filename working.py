@@ -9,15 +9,20 @@ import numpy as np
 import requests
 import geocoder
 
+from metrics import get_logger
 
 
 
+
+log = get_logger('working')
+
 # Set up serial communication
 arduino_port = 'COM6'  # Replace with your Arduino COM port
 baud_rate = 9600
 
-# Initialize serial connection
-ser = serial.Serial(arduino_port, baud_rate, timeout=1)
+# Serial connection, opened at startup below so that importing this module
+# does not need the port
+ser = None
 
 # Create a Dash app
 app = dash.Dash(__name__)
@@ -219,9 +224,13 @@ def update_graph(n_intervals):
     try:
         if ser.in_waiting > 0:
             line = ser.readline().decode('utf-8').strip()
-            print(f"Received data: {line}")
+            log.debug("Received data: %s", line)
 
             if 'ADC Value' in line and 'Amplitude' in line and 'Frequency' in line:
+                # This prototype stamps samples on arrival; skip the device
+                # Time field that acquisition uses (see clock.py)
+                if line.startswith('Time:'):
+                    line = line.split('|', 1)[1]
                 # Split by '|' and clean up each part
                 parts = [part.strip() for part in line.split('|')]
                 
@@ -270,7 +279,7 @@ def update_graph(n_intervals):
                     )
 
                 except (IndexError, ValueError) as e:
-                    print(f"Data parsing error: {e}")
+                    log.warning("Data parsing error: %s", e)
                     # Return last known good values for graphs but error messages for text
                     return (
                         fig_frequency,
@@ -283,7 +292,7 @@ def update_graph(n_intervals):
                     )
 
     except Exception as e:
-        print(f"Error in update_graph: {e}")
+        log.error("Error in update_graph: %s", e)
         # Return last known good values
         return (
             fig_frequency,
@@ -308,4 +317,5 @@ def update_graph(n_intervals):
 
 # Start the Dash app server
 if __name__ == '__main__':
-    app.run_server(debug=True, use_reloader=False)
\ No newline at end of file
+    ser = serial.Serial(arduino_port, baud_rate, timeout=1)
+    app.run(debug=True, use_reloader=False)
\ No newline at end of file